@@ -0,0 +1,219 @@
+"""
+Calibração automática de g_por_seg por frasco a partir do histórico.
+
+Amostras (últimos CALIB_JANELA_DIAS, só do tempero atual do frasco):
+  - pesagens do usuário (POST /config/robo/pesagens: segundos rodados e
+    gramas medidas na balança) — com CALIB_MIN_AMOSTRAS delas, só elas valem;
+  - senão, o job_execution_log: quantidade_real_g / segundos dos itens "done"
+    que o device mediu (medido=True). O firmware sem balança ecoa o pedido
+    e os segundos que o próprio servidor calculou com g_por_seg — essa razão
+    é só o g_por_seg antigo, então nunca entra (nem linha igual ao pedido).
+
+Estimativa robusta: mediana das razões g/s (um frasco entupido ou uma
+pesagem errada não arrasta o valor), com intervalo de confiança de ~95%
+pelas estatísticas de ordem (sem suposição de distribuição).
+
+O ajuste roda em lote para todos os usuários e frascos de uma vez: uma
+consulta por fonte, ordenação por (grupo, razão) e índices de mediana/IC
+calculados por grupo — vetorizado com NumPy quando instalado (dependência
+opcional, importada só na hora do ajuste), em Python puro caso contrário.
+
+Resultado em `calibracao` por (usuário, frasco):
+  - "proposta": valor atual fora do IC e diferença >= CALIB_MIN_DELTA;
+  - "aplicada": idem, com MotorConfig.calibracao_auto e IC estreito
+    (largura relativa <= CALIB_MAX_IC_REL) — g_por_seg já foi trocado;
+  - "ok" / "insuficiente".
+
+Configuração (env):
+  CALIB_ENABLED=1|0
+  CALIB_INTERVAL_SEC=3600
+  CALIB_JANELA_DIAS=60
+  CALIB_MIN_AMOSTRAS=5
+  CALIB_MIN_DELTA=0.05
+  CALIB_MAX_IC_REL=0.2
+"""
+import asyncio
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+CALIB_ENABLED = os.getenv("CALIB_ENABLED", "1") == "1"
+CALIB_INTERVAL_SEC = float(os.getenv("CALIB_INTERVAL_SEC", "3600"))
+CALIB_JANELA_DIAS = int(os.getenv("CALIB_JANELA_DIAS", "60"))
+CALIB_MIN_AMOSTRAS = int(os.getenv("CALIB_MIN_AMOSTRAS", "5"))
+CALIB_MIN_DELTA = float(os.getenv("CALIB_MIN_DELTA", "0.05"))
+CALIB_MAX_IC_REL = float(os.getenv("CALIB_MAX_IC_REL", "0.2"))
+MIN_SEGUNDOS = 0.2  # execuções curtas demais: ruído do servo domina
+
+Grupo = Tuple[int, int]  # (user_id, frasco)
+Ajuste = Tuple[float, float, float, int]  # (mediana, ic_min, ic_max, n)
+
+
+def _indices_ic(n: int) -> Tuple[int, int]:
+    """Posições (0-based) das estatísticas de ordem do IC ~95% da mediana."""
+    meia = 1.96 * math.sqrt(n) / 2
+    return max(0, math.floor(n / 2 - meia)), min(n - 1, math.ceil(n / 2 + meia) - 1)
+
+
+def ajustar_lote(amostras: Dict[Grupo, List[float]]) -> Dict[Grupo, Ajuste]:
+    """Mediana e IC das razões g/s de cada grupo (todos de uma vez)."""
+    grupos = [g for g, v in amostras.items() if len(v) >= CALIB_MIN_AMOSTRAS]
+    if not grupos:
+        return {}
+    try:
+        import numpy as np  # fora do import do módulo: não pesa no boot
+    except ImportError:  # dependência opcional
+        np = None
+    if np is not None:
+        return _ajustar_numpy(np, grupos, amostras)
+    out = {}
+    for g in grupos:
+        v = sorted(amostras[g])
+        n = len(v)
+        lo, hi = _indices_ic(n)
+        out[g] = ((v[(n - 1) // 2] + v[n // 2]) / 2, v[lo], v[hi], n)
+    return out
+
+
+def _ajustar_numpy(np, grupos: List[Grupo], amostras: Dict[Grupo, List[float]]) -> Dict[Grupo, Ajuste]:
+    contagens = np.array([len(amostras[g]) for g in grupos])
+    ids = np.repeat(np.arange(len(grupos)), contagens)
+    valores = np.concatenate([np.asarray(amostras[g], dtype=float) for g in grupos])
+    valores = valores[np.lexsort((valores, ids))]  # ordena por grupo e, dentro dele, por razão
+    inicio = np.concatenate(([0], np.cumsum(contagens)[:-1]))
+    mediana = (valores[inicio + (contagens - 1) // 2] + valores[inicio + contagens // 2]) / 2
+    meia = 1.96 * np.sqrt(contagens) / 2
+    lo = inicio + np.maximum(0, np.floor(contagens / 2 - meia).astype(int))
+    hi = inicio + np.minimum(contagens - 1, np.ceil(contagens / 2 + meia).astype(int) - 1)
+    return {
+        g: (float(mediana[i]), float(valores[lo[i]]), float(valores[hi[i]]), int(contagens[i]))
+        for i, g in enumerate(grupos)
+    }
+
+
+def _norm(rotulo: Optional[str]) -> str:
+    """Mesma normalização do mapeamento receita → frasco (receita "sal" usa o frasco "Sal")."""
+    return (rotulo or "").strip().lower()
+
+
+def _coletar(db: Session, desde: datetime, user_id: Optional[int]):
+    """Razões g/s por grupo e fonte: ({grupo: [...]} das pesagens, idem do log)."""
+    rotulos = {
+        (u, f): r for u, f, r in db.query(
+            models.ReservatorioConfig.user_id, models.ReservatorioConfig.frasco, models.ReservatorioConfig.rotulo
+        ).filter(*([models.ReservatorioConfig.user_id == user_id] if user_id is not None else []))
+    }
+    pesagens: Dict[Grupo, List[float]] = {}
+    q = db.query(models.Pesagem.user_id, models.Pesagem.frasco, models.Pesagem.rotulo,
+                 models.Pesagem.gramas, models.Pesagem.segundos).filter(models.Pesagem.created_at >= desde)
+    if user_id is not None:
+        q = q.filter(models.Pesagem.user_id == user_id)
+    for u, f, rotulo, g, s in q:
+        if (u, f) in rotulos and _norm(rotulo) == _norm(rotulos[(u, f)]) and s >= MIN_SEGUNDOS and g > 0:
+            pesagens.setdefault((u, f), []).append(g / s)
+
+    log: Dict[Grupo, List[float]] = {}
+    L = models.JobExecutionLog
+    q = db.query(L.user_id, L.frasco, L.tempero, L.quantidade_real_g, L.quantidade_pedida_g, L.segundos).filter(
+        L.status == "done", L.medido.is_(True), L.finished_at >= desde,
+        L.quantidade_real_g > 0, L.segundos >= MIN_SEGUNDOS,
+    )
+    if user_id is not None:
+        q = q.filter(L.user_id == user_id)
+    for u, f, tempero, g, pedida, s in q:
+        if pedida is not None and math.isclose(g, pedida, rel_tol=1e-9):
+            continue  # eco do pedido: g/s seria o próprio g_por_seg da época
+        if (u, f) in rotulos and _norm(tempero) == _norm(rotulos[(u, f)]):
+            log.setdefault((u, f), []).append(g / s)
+    return rotulos, pesagens, log
+
+
+def calibrar(db: Session, agora: datetime, user_id: Optional[int] = None) -> List[Grupo]:
+    """
+    Recalcula a calibração (de todos ou de um usuário) e aplica as
+    automáticas. Devolve os (usuário, frasco) cujo g_por_seg mudou; sem commit.
+    """
+    rotulos, pesagens, log = _coletar(db, agora - timedelta(days=CALIB_JANELA_DIAS), user_id)
+    por_pesagem = ajustar_lote(pesagens)
+    por_log = ajustar_lote({g: v for g, v in log.items() if g not in por_pesagem})
+
+    configs = {
+        (c.user_id, c.frasco): c
+        for c in db.query(models.ReservatorioConfig).filter(
+            *([models.ReservatorioConfig.user_id == user_id] if user_id is not None else [])
+        )
+    }
+    auto = {
+        u for (u,) in db.query(models.MotorConfig.user_id).filter(models.MotorConfig.calibracao_auto.is_(True))
+    }
+    existentes = {
+        (c.user_id, c.frasco): c
+        for c in db.query(models.Calibracao).filter(
+            *([models.Calibracao.user_id == user_id] if user_id is not None else [])
+        )
+    }
+
+    aplicados = []
+    for grupo, cfg in configs.items():
+        fonte, ajuste = ("pesagem", por_pesagem.get(grupo)) if grupo in por_pesagem else ("execucao", por_log.get(grupo))
+        cal = existentes.get(grupo)
+        if cal is None:
+            cal = models.Calibracao(user_id=grupo[0], frasco=grupo[1])
+            db.add(cal)
+        cal.rotulo = rotulos.get(grupo)
+        cal.g_por_seg_atual = cfg.g_por_seg
+        cal.calculado_em = agora
+        if ajuste is None:
+            n = len(pesagens.get(grupo, ())) or len(log.get(grupo, ()))
+            cal.status, cal.fonte, cal.amostras = "insuficiente", None, n
+            cal.g_por_seg_sugerido = cal.ic_min = cal.ic_max = None
+            continue
+        mediana, ic_min, ic_max, n = ajuste
+        cal.fonte, cal.amostras = fonte, n
+        cal.g_por_seg_sugerido, cal.ic_min, cal.ic_max = round(mediana, 3), round(ic_min, 3), round(ic_max, 3)
+        atual = cfg.g_por_seg
+        fora = atual is None or not (ic_min <= atual <= ic_max)
+        if not fora or (atual and abs(mediana - atual) / atual < CALIB_MIN_DELTA):
+            cal.status = "ok"
+        elif grupo[0] in auto and (ic_max - ic_min) / mediana <= CALIB_MAX_IC_REL:
+            cfg.g_por_seg = cal.g_por_seg_sugerido
+            cal.status = "aplicada"
+            aplicados.append(grupo)
+        else:
+            cal.status = "proposta"
+    return aplicados
+
+
+class CalibrationLoop:
+    """Recalibração periódica (asyncio); `run_sync` roda em thread (sessão síncrona)."""
+
+    def __init__(self, run_sync: Callable[[], None], interval_sec: float = CALIB_INTERVAL_SEC):
+        self.run_sync = run_sync
+        self.interval_sec = interval_sec
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            try:
+                await asyncio.to_thread(self.run_sync)
+            except Exception as e:  # nunca derruba o loop
+                print(f"[CALIB ERROR] {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,67 @@
+"""
+Coalescência de jobs: vários jobs da fila do mesmo usuário viram uma única
+execução no device (um ciclo de poll/relatório e um par de delays do motor
+por frasco, em vez de um por item de cada job).
+
+- merge_itens: soma gramas/segundos por frasco (ordem da primeira aparição)
+  e guarda em `origem` de qual item/job veio cada parcela.
+- split_logs: no relatório, reparte o que o device dispensou em cada frasco
+  entre os jobs de origem, proporcionalmente ao pedido de cada um.
+
+Funções puras (sem sessão): main.py cuida do lease e do abate de estoque.
+"""
+from typing import Any, Dict, Iterable, List
+
+
+def merge_itens(jobs: Iterable[Any]) -> List[Dict[str, Any]]:
+    """`jobs` em ordem de execução (líder primeiro), cada um com `.itens` carregados."""
+    por_frasco: Dict[int, Dict[str, Any]] = {}
+    for job in jobs:
+        for it in job.itens:
+            g = float(it.quantidade_g or 0.0)
+            m = por_frasco.get(it.frasco)
+            if m is None:
+                m = por_frasco[it.frasco] = {
+                    "id": it.id,
+                    "ordem": len(por_frasco) + 1,
+                    "frasco": it.frasco,
+                    "tempero": it.tempero,
+                    "quantidade_g": 0.0,
+                    "segundos": 0.0,
+                    "status": "queued",
+                    "origem": [],
+                }
+            m["quantidade_g"] += g
+            m["segundos"] += float(it.segundos or 0.0)
+            m["origem"].append({"job_id": job.id, "item_id": it.id, "quantidade_g": g})
+    for m in por_frasco.values():
+        m["quantidade_g"] = round(m["quantidade_g"], 3)
+        m["segundos"] = round(m["segundos"], 3)
+    return list(por_frasco.values())
+
+
+def split_logs(merged: List[Dict[str, Any]], logs: Iterable[Any], lider_id: int) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Reparte os logs do device (um por frasco) entre os jobs do lote.
+    Retorna {job_id: [log, ...]} no formato de ExecutionLogEntry.
+    Frasco sem item correspondente (não deveria acontecer) fica com o líder.
+    """
+    origem_por_frasco = {m["frasco"]: m["origem"] for m in merged}
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for log in logs:
+        origem = origem_por_frasco.get(log.frasco)
+        if not origem:
+            origem = [{"job_id": lider_id, "quantidade_g": 1.0}]
+        total = sum(o["quantidade_g"] for o in origem) or float(len(origem))
+        for o in origem:
+            frac = (o["quantidade_g"] or (total / len(origem))) / total
+            out.setdefault(o["job_id"], []).append({
+                "frasco": log.frasco,
+                "tempero": log.tempero,
+                "quantidade_g": round(float(log.quantidade_g or 0.0) * frac, 3),
+                "segundos": round(float(log.segundos or 0.0) * frac, 3),
+                "status": log.status,
+                "error": log.error,
+                "medido": log.medido,
+            })
+    return out
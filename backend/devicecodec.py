@@ -0,0 +1,238 @@
+"""
+Codificação binária compacta para as rotas do dispositivo (/devices/me/*).
+
+Negociação por headers, JSON continua sendo o padrão:
+  - requisição com Content-Type application/cbor ou application/msgpack
+    (x-msgpack também) → decodificada e reescrita como JSON antes da rota;
+  - Accept com um desses tipos → a resposta JSON é recodificada.
+
+Nos dois sentidos as chaves dos schemas são trocadas pelas abreviações de
+SHORT_KEYS (ex.: "quantidade_g" → "g"), o que cabe mais itens no buffer de
+4 KiB do firmware. Chaves fora da tabela passam como estão, e o conteúdo
+de campos livres (OPAQUE_KEYS: telemetria `status`, `detail` de erro) não
+é tocado — só o nome do campo é abreviado.
+
+cbor2 e msgpack são dependências opcionais (backend/requirements.txt): sem
+o pacote, o Accept cai para JSON e um corpo naquele formato recebe 415.
+"""
+import json
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import cbor2
+except ImportError:  # dependência opcional
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:  # dependência opcional
+    msgpack = None
+
+PATH_PREFIX = "/devices/me/"
+
+CBOR = "application/cbor"
+MSGPACK = "application/msgpack"
+_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+
+# Protocolo com o firmware: nunca reaproveitar uma abreviação para outro campo.
+SHORT_KEYS: Dict[str, str] = {
+    # job / itens
+    "id": "i",
+    "status": "s",
+    "receita_id": "r",
+    "pessoas_solicitadas": "p",
+    "multiplicador": "mu",
+    "prioridade": "pr",
+    "created_at": "ca",
+    "started_at": "sa",
+    "finished_at": "fa",
+    "lease_until": "lu",
+    "erro_msg": "em",
+    "itens": "it",
+    "ordem": "o",
+    "frasco": "f",
+    "tempero": "t",
+    "quantidade_g": "g",
+    "segundos": "sg",
+    "origem": "og",
+    "job_id": "j",
+    "item_id": "ii",
+    "lote_job_ids": "lj",
+    "tempo_estimado_s": "te",
+    # plano paralelo
+    "plano": "pl",
+    "passos": "ps",
+    "passo": "n",
+    "inicio_ms": "im",
+    "duracao_ms": "dm",
+    "max_simultaneos": "ms",
+    "makespan_ms": "mk",
+    "sequencial_ms": "sq",
+    # motor
+    "motor_config": "mc",
+    "vibration_intensity": "vi",
+    "pre_start_delay_ms": "pd",
+    "post_stop_delay_ms": "sd",
+    "max_runtime_sec": "mr",
+    "coalesce_max_jobs": "cj",
+    "max_servos_simultaneos": "sv",
+    "servo_current_ma": "sc",
+    "power_budget_ma": "pb",
+    # relatórios / respostas
+    "itens_completados": "ic",
+    "itens_falhados": "if",
+    "execution_logs": "el",
+    "medido": "md",
+    "error": "e",
+    "ok": "k",
+    "stock_deducted": "sk",
+    "message": "m",
+    "next_job_pending": "nj",
+    "detail": "d",
+    "status_code": "sx",
+    # heartbeat / sync
+    "fw_version": "fw",
+    "job": "jb",
+    "job_changed": "jc",
+    "job_atual_id": "ja",
+    "status_jobs": "sj",
+    "relatorios": "rl",
+    "resultados": "rs",
+    "poll_ms": "pm",
+}
+LONG_KEYS: Dict[str, str] = {v: k for k, v in SHORT_KEYS.items()}
+
+# valores livres (dicts do próprio firmware, erros de validação): passam intactos
+OPAQUE_KEYS = frozenset({"status", "detail"})
+_OPAQUE_ANY = OPAQUE_KEYS | {SHORT_KEYS[k] for k in OPAQUE_KEYS}
+
+
+def _rekey(obj: Any, table: Dict[str, str]) -> Any:
+    if isinstance(obj, dict):
+        return {
+            table.get(k, k) if isinstance(k, str) else k: v if k in _OPAQUE_ANY else _rekey(v, table)
+            for k, v in obj.items()
+        }
+    if isinstance(obj, list):
+        return [_rekey(v, table) for v in obj]
+    return obj
+
+
+def encoders() -> Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]]:
+    """Formatos disponíveis neste processo: media type → (encode, decode)."""
+    out = {}
+    if cbor2 is not None:
+        # canonical: floats no menor tamanho sem perda (float16/32)
+        out[CBOR] = (lambda o: cbor2.dumps(o, canonical=True), cbor2.loads)
+    if msgpack is not None:
+        out[MSGPACK] = (lambda o: msgpack.packb(o, use_bin_type=True), lambda b: msgpack.unpackb(b, raw=False))
+    return out
+
+
+def _media_type(value: str) -> str:
+    mt = value.split(";", 1)[0].strip().lower()
+    return _ALIASES.get(mt, mt)
+
+
+def negotiate(accept: str, available) -> Optional[str]:
+    """Primeiro formato binário aceito (na ordem do Accept); None = JSON."""
+    for part in accept.split(","):
+        mt = _media_type(part)
+        if mt in available:
+            return mt
+    return None
+
+
+class DeviceCodecMiddleware:
+    def __init__(self, app, prefix: str = PATH_PREFIX):
+        self.app = app
+        self.prefix = prefix
+        self.formats = encoders()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        req_type = _media_type(headers.get("content-type", ""))
+        if req_type in (CBOR, MSGPACK):
+            if req_type not in self.formats:
+                resp = JSONResponse(status_code=415, content={"detail": f"{req_type} não suportado neste servidor."})
+                await resp(scope, receive, send)
+                return
+            json_receive, scope = await self._decode_request(scope, receive, req_type)
+            if json_receive is None:
+                resp = JSONResponse(status_code=400, content={"detail": f"Corpo {req_type} inválido."})
+                await resp(scope, receive, send)
+                return
+            receive = json_receive
+
+        out_type = negotiate(headers.get("accept", ""), self.formats)
+        if out_type is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, self._encoding_send(send, out_type))
+
+    async def _decode_request(self, scope, receive, req_type):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        try:
+            obj = self.formats[req_type][1](b"".join(chunks))
+        except Exception:
+            return None, scope
+        body = json.dumps(_rekey(obj, LONG_KEYS), ensure_ascii=False).encode("utf-8")
+
+        new_headers = MutableHeaders(scope={"type": "http", "headers": list(scope["headers"])})
+        new_headers["content-type"] = "application/json"
+        new_headers["content-length"] = str(len(body))
+        scope = {**scope, "headers": new_headers.raw}
+
+        sent = False
+
+        async def json_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return json_receive, scope
+
+    def _encoding_send(self, send, out_type: str):
+        encode = self.formats[out_type][0]
+        state: Dict[str, Any] = {"start": None, "chunks": [], "passthrough": False}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                ctype = Headers(raw=message["headers"]).get("content-type", "")
+                if not ctype.startswith("application/json"):
+                    state["passthrough"] = True
+                    await send(message)
+                else:
+                    state["start"] = message
+                return
+            if state["passthrough"] or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            state["chunks"].append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            start = state["start"]
+            body = encode(_rekey(json.loads(b"".join(state["chunks"]) or b"null"), SHORT_KEYS))
+            headers = MutableHeaders(raw=start["headers"])
+            headers["content-type"] = out_type
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        return _send
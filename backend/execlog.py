@@ -0,0 +1,70 @@
+"""
+Log de execução normalizado (tabela job_execution_log).
+
+Uma linha por entrada do relatório do device, com a quantidade pedida (do
+JobItem) ao lado da reportada — consumo, taxa de falha e tempo por frasco
+viram consultas no índice (user_id, frasco, finished_at), sem abrir o
+JSON de cada job.
+
+`consumo_g` é o que saiu do estoque e alimenta os rollups. Quando o device
+só avisa "done" sem relatório, o consumo é o pedido e `quantidade_real_g`
+fica None: nada foi reportado, então não vira "medição".
+
+As linhas são montadas aqui e gravadas com um único INSERT em lote
+(executemany), tanto na conclusão do job quanto no backfill da migração.
+"""
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from . import models
+
+
+def log_rows(job_id: int, user_id: int, finished_at: datetime,
+             itens: Iterable[Tuple[int, float]], logs: Iterable[Dict[str, Any]],
+             reportado: bool = True) -> List[Dict[str, Any]]:
+    """
+    `itens`: (frasco, quantidade_g) dos JobItems em ordem de execução;
+    `logs`: entradas do relatório ({frasco, tempero, quantidade_g, segundos, status, error});
+    `reportado=False`: entradas montadas do pedido (sem relatório do device).
+    A n-ésima entrada de um frasco casa com o n-ésimo item daquele frasco.
+    """
+    pedidos = defaultdict(deque)
+    for frasco, quantidade_g in itens:
+        pedidos[frasco].append(quantidade_g)
+    rows = []
+    for log in logs:
+        frasco = int(log["frasco"])
+        fila = pedidos.get(frasco)
+        done = log.get("status") == "done"
+        gramas = _float_or_none(log.get("quantidade_g")) if done else None
+        rows.append({
+            "job_id": job_id,
+            "user_id": user_id,
+            "frasco": frasco,
+            "tempero": str(log.get("tempero") or "")[:60],
+            "quantidade_pedida_g": fila.popleft() if fila else None,
+            "quantidade_real_g": gramas if reportado else None,
+            "consumo_g": gramas or 0.0,
+            "medido": bool(reportado and done and log.get("medido")),
+            "segundos": _float_or_none(log.get("segundos")),
+            "status": "done" if done else "failed",
+            "error": (log.get("error") or None) and str(log["error"])[:255],
+            "finished_at": finished_at,
+        })
+    return rows
+
+
+def _float_or_none(v: Any) -> Optional[float]:
+    try:
+        return float(v) if v is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def bulk_insert(conn, rows: List[Dict[str, Any]]) -> None:
+    """INSERT em lote; `conn` pode ser Session ou Connection."""
+    if rows:
+        conn.execute(insert(models.JobExecutionLog), rows)
@@ -0,0 +1,57 @@
+"""
+Serialização rápida para endpoints de listagem.
+
+- FastJSONResponse: usa orjson quando instalado (opcional), senão o json da
+  stdlib em modo compacto.
+- Para dados internos confiáveis, o endpoint monta dicts direto de tuplas
+  (sem instanciar ORM) e devolve a resposta pronta — o FastAPI então pula a
+  validação/serialização do response_model (que continua valendo para a doc).
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # dependência opcional
+    orjson = None
+
+# headers que o GET condicional anota na Response "injetada" do FastAPI
+_PASSTHROUGH_HEADERS = ("etag", "cache-control")
+
+
+def _default(obj: Any):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def fast_json(content: Any, sub_response: Optional[Response] = None, status_code: int = 200) -> FastJSONResponse:
+    """Resposta pronta, herdando ETag/Cache-Control da Response injetada no endpoint."""
+    headers: Dict[str, str] = {}
+    if sub_response is not None:
+        for h in _PASSTHROUGH_HEADERS:
+            if h in sub_response.headers:
+                headers[h] = sub_response.headers[h]
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
+
+
+def group_rows(rows: Iterable[tuple], key_index: int = 0) -> Dict[Any, List[tuple]]:
+    """Agrupa tuplas (já ordenadas ou não) pela coluna `key_index`."""
+    out: Dict[Any, List[tuple]] = {}
+    for r in rows:
+        out.setdefault(r[key_index], []).append(r)
+    return out
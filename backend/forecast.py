@@ -0,0 +1,177 @@
+"""
+Previsão de esgotamento por frasco e alerta de estoque baixo.
+
+Taxa de consumo (g/dia) como média exponencial no tempo, atualizada a
+cada abate de estoque sem reler o histórico:
+
+    taxa(t) = taxa(t0) · e^(−Δt/τ) + g / τ
+
+(soma dos consumos com peso e^(−idade/τ), normalizada por τ). Parado, o
+frasco vai "esfriando" sozinho: a leitura aplica o decaimento até agora.
+Trocar o tempero do frasco zera a taxa. A migração semeia a taxa a partir
+do consumo_dia (rollups), então bancos existentes já começam com histórico.
+
+dias_restantes = estoque_g / taxa. Quando cai abaixo de LOW_STOCK_DAYS
+(ou o estoque fica abaixo de LOW_STOCK_MIN_G, para frascos ainda sem
+taxa), sai um evento "low_stock" uma única vez; reabastecer acima do
+limite rearma o alerta.
+
+Configuração (env):
+  FORECAST_TAU_DAYS=7
+  LOW_STOCK_DAYS=3
+  LOW_STOCK_MIN_G=10
+"""
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+
+FORECAST_TAU_DAYS = float(os.getenv("FORECAST_TAU_DAYS", "7"))
+LOW_STOCK_DAYS = float(os.getenv("LOW_STOCK_DAYS", "3"))
+LOW_STOCK_MIN_G = float(os.getenv("LOW_STOCK_MIN_G", "10"))
+
+
+def _aware(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def decair(taxa: float, desde: Optional[datetime], agora: datetime, tau_dias: float = FORECAST_TAU_DAYS) -> float:
+    if not taxa or desde is None:
+        return taxa or 0.0
+    dias = max(0.0, (agora - _aware(desde)).total_seconds() / 86400.0)
+    return taxa * math.exp(-dias / tau_dias)
+
+
+def acumular(taxa: float, desde: Optional[datetime], gramas: float, agora: datetime,
+             tau_dias: float = FORECAST_TAU_DAYS) -> float:
+    """Taxa após um consumo de `gramas` em `agora`."""
+    return decair(taxa, desde, agora, tau_dias) + gramas / tau_dias
+
+
+def dias_restantes(estoque_g: Optional[float], taxa: float) -> Optional[float]:
+    if estoque_g is None or taxa <= 0:
+        return None
+    return estoque_g / taxa
+
+
+def _estado(db: Session, user_id: int) -> Dict[int, models.PrevisaoEstoque]:
+    return {
+        p.frasco: p
+        for p in db.query(models.PrevisaoEstoque).filter(models.PrevisaoEstoque.user_id == user_id)
+    }
+
+
+def _configs(db: Session, user_id: int) -> List[models.ReservatorioConfig]:
+    return (
+        db.query(models.ReservatorioConfig)
+        .filter(models.ReservatorioConfig.user_id == user_id)
+        .order_by(models.ReservatorioConfig.frasco.asc())
+        .all()
+    )
+
+
+def registrar_consumo(db: Session, user_id: int, consumo_por_frasco: Dict[int, float], agora: datetime) -> None:
+    """Atualiza a taxa dos frascos que tiveram abate (sem commit)."""
+    estado = _estado(db, user_id)
+    rotulos = {c.frasco: c.rotulo for c in _configs(db, user_id)}
+    for frasco, gramas in consumo_por_frasco.items():
+        p = estado.get(frasco)
+        if p is None:
+            p = models.PrevisaoEstoque(user_id=user_id, frasco=frasco, taxa_g_dia=0.0, alerta_ativo=False)
+            db.add(p)
+        if p.rotulo != rotulos.get(frasco):
+            # outro tempero no frasco: histórico não vale mais
+            p.rotulo, p.taxa_g_dia, p.atualizado_em = rotulos.get(frasco), 0.0, None
+        p.taxa_g_dia = acumular(p.taxa_g_dia or 0.0, p.atualizado_em, float(gramas), agora)
+        p.atualizado_em = agora
+    db.flush()  # a sessão é autoflush=False: avaliar_alertas precisa ver as linhas novas
+
+
+def previsao(db: Session, user_id: int, agora: datetime) -> List[dict]:
+    """Por frasco configurado: estoque, taxa atual (decaída até agora) e dias até esvaziar."""
+    estado = _estado(db, user_id)
+    out = []
+    for c in _configs(db, user_id):
+        p = estado.get(c.frasco)
+        taxa = decair(p.taxa_g_dia, p.atualizado_em, agora) if p and p.rotulo == c.rotulo else 0.0
+        dias = dias_restantes(c.estoque_g, taxa)
+        out.append({
+            "frasco": c.frasco,
+            "rotulo": c.rotulo,
+            "estoque_g": c.estoque_g,
+            "taxa_g_dia": round(taxa, 3),
+            "dias_restantes": None if dias is None else round(dias, 2),
+            "esgota_em": None if dias is None or dias > 3650 else agora + timedelta(days=dias),
+            "baixo": _baixo(c.estoque_g, dias),
+        })
+    return out
+
+
+def _baixo(estoque_g: Optional[float], dias: Optional[float]) -> bool:
+    if estoque_g is None:
+        return False
+    if dias is not None:
+        return dias < LOW_STOCK_DAYS
+    return estoque_g < LOW_STOCK_MIN_G
+
+
+def avaliar_alertas(db: Session, user_id: int, agora: datetime) -> List[dict]:
+    """
+    Frascos que acabaram de cruzar o limite (cada um alerta uma vez; sai do
+    estado baixo → rearma). Devolve os payloads dos eventos; sem commit.
+    """
+    estado = _estado(db, user_id)
+    novos = []
+    for item in previsao(db, user_id, agora):
+        p = estado.get(item["frasco"])
+        if p is None:
+            if not item["baixo"]:
+                continue
+            p = models.PrevisaoEstoque(user_id=user_id, frasco=item["frasco"], rotulo=item["rotulo"],
+                                       taxa_g_dia=0.0, alerta_ativo=False)
+            db.add(p)
+        if item["baixo"] and not p.alerta_ativo:
+            p.alerta_ativo = True
+            esgota = item["esgota_em"]
+            novos.append({**item, "esgota_em": esgota.isoformat().replace("+00:00", "Z") if esgota else None})
+        elif not item["baixo"] and p.alerta_ativo:
+            p.alerta_ativo = False
+    return novos
+
+
+def _norm(rotulo: Optional[str]) -> str:
+    """consumo_dia guarda a grafia da receita; o frasco casa como no mapeamento (sem caixa/espaços)."""
+    return (rotulo or "").strip().lower()
+
+
+def semear_de_rollups(conn, agora: datetime) -> None:
+    """Taxa inicial de cada (usuário, frasco) a partir do consumo_dia (usado pela migração)."""
+    dia = models.ConsumoDia.__table__
+    cfg = models.ReservatorioConfig.__table__
+    prev = models.PrevisaoEstoque.__table__
+    rotulos = {(u, f): r for u, f, r in conn.execute(select(cfg.c.user_id, cfg.c.frasco, cfg.c.rotulo))}
+    estado: Dict[tuple, tuple] = {}
+    linhas = conn.execute(
+        select(dia.c.user_id, dia.c.frasco, dia.c.tempero, dia.c.inicio, dia.c.gramas)
+        .where(dia.c.inicio >= agora - timedelta(days=FORECAST_TAU_DAYS * 8))
+        .order_by(dia.c.user_id, dia.c.frasco, dia.c.inicio)
+    )
+    for user_id, frasco, tempero, inicio, gramas in linhas:
+        if _norm(rotulos.get((user_id, frasco))) != _norm(tempero) or not gramas:
+            continue
+        meio_dia = _aware(inicio) + timedelta(hours=12)
+        taxa, desde = estado.get((user_id, frasco), (0.0, None))
+        estado[(user_id, frasco)] = (acumular(taxa, desde, gramas, meio_dia), meio_dia)
+    if estado:
+        conn.execute(prev.insert(), [
+            {"user_id": u, "frasco": f, "rotulo": rotulos[(u, f)], "taxa_g_dia": taxa,
+             "atualizado_em": desde, "alerta_ativo": False}
+            for (u, f), (taxa, desde) in estado.items()
+        ])
@@ -0,0 +1,232 @@
+"""
+Idempotency-Key para POSTs que o frontend/ESP32 repetem em Wi-Fi instável.
+
+Rotas cobertas (IDEMPOTENT_ROUTES): criação de job e relatórios do device.
+Com o header `Idempotency-Key`, a primeira resposta 2xx fica guardada por
+(identidade, chave) durante o TTL; a repetição devolve a mesma resposta
+(com `Idempotent-Replayed: true`) sem chegar à rota — nada de validação,
+mapeamento ou abate de estoque de novo.
+
+  - mesma chave com corpo/rota diferente → 422
+  - mesma chave ainda em processamento (mesmo processo) → 409
+  - respostas não-2xx não são guardadas (o cliente pode corrigir e repetir)
+
+Store: LRU em memória na frente da tabela `idempotency_keys` (vale entre
+workers e reinícios). Expirados são apagados aos poucos, a cada N gravações.
+
+Configuração (env):
+  IDEMPOTENCY_TTL_SEC=86400
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, NamedTuple, Optional, Pattern, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from . import models
+
+IDEMPOTENCY_TTL_SEC = int(os.getenv("IDEMPOTENCY_TTL_SEC", str(24 * 3600)))
+HEADER = "idempotency-key"
+MAX_KEY_LEN = 100
+
+
+class Route(NamedTuple):
+    method: str
+    path: Pattern
+    key: str  # "device" | "user" (mesma identidade do rate limit)
+
+
+IDEMPOTENT_ROUTES: List[Route] = [
+    Route("POST", re.compile(r"^/jobs$"), "user"),
+    Route("POST", re.compile(r"^/devices/me/jobs/\d+/(status|complete)$"), "device"),
+]
+
+
+class Stored(NamedTuple):
+    fingerprint: str
+    status_code: int
+    content_type: str
+    body: bytes
+    expires_at: datetime
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _aware(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+class IdempotencyStore:
+    """LRU em memória + tabela. Métodos síncronos (chamados em threadpool)."""
+
+    def __init__(self, session_factory: Callable[[], Session], ttl_sec: int = IDEMPOTENCY_TTL_SEC,
+                 max_memory: int = 2000, purge_every: int = 200):
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl_sec)
+        self.max_memory = max_memory
+        self.purge_every = purge_every
+        self._mem: "OrderedDict[Tuple[str, str], Stored]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _remember(self, k: Tuple[str, str], item: Stored) -> None:
+        with self._lock:
+            self._mem[k] = item
+            self._mem.move_to_end(k)
+            while len(self._mem) > self.max_memory:
+                self._mem.popitem(last=False)
+
+    def get(self, scope: str, key: str) -> Optional[Stored]:
+        k = (scope, key)
+        now = _now()
+        with self._lock:
+            item = self._mem.get(k)
+            if item is not None:
+                if item.expires_at > now:
+                    self._mem.move_to_end(k)
+                    return item
+                del self._mem[k]
+
+        db = self.session_factory()
+        try:
+            row = db.get(models.IdempotencyKey, (scope, key))
+            if row is None or _aware(row.expires_at) <= now:
+                return None
+            item = Stored(row.fingerprint, row.status_code, row.content_type, row.body, _aware(row.expires_at))
+        finally:
+            db.close()
+        self._remember(k, item)
+        return item
+
+    def put(self, scope: str, key: str, fingerprint: str, status_code: int, content_type: str, body: bytes) -> None:
+        now = _now()
+        item = Stored(fingerprint, status_code, content_type, body, now + self.ttl)
+        db = self.session_factory()
+        try:
+            db.merge(models.IdempotencyKey(
+                scope=scope, key=key, fingerprint=fingerprint, status_code=status_code,
+                content_type=content_type, body=body, created_at=now, expires_at=item.expires_at,
+            ))
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                db.query(models.IdempotencyKey).filter(models.IdempotencyKey.expires_at < now).delete(
+                    synchronize_session=False
+                )
+            db.commit()
+        except IntegrityError:
+            db.rollback()  # outro worker gravou a mesma chave: vale a dele
+        finally:
+            db.close()
+        self._remember((scope, key), item)
+
+
+class IdempotencyMiddleware:
+    """
+    Middleware ASGI. `identify(kind, request)` como no RateLimitMiddleware;
+    sem identidade (ou sem header) a requisição segue normalmente.
+    """
+
+    def __init__(self, app, identify: Callable[[str, Request], Optional[str]], store: IdempotencyStore,
+                 routes: Optional[List[Route]] = None):
+        self.app = app
+        self.identify = identify
+        self.store = store
+        self.routes = routes if routes is not None else IDEMPOTENT_ROUTES
+        self._inflight = set()
+
+    def _match(self, method: str, path: str) -> Optional[Route]:
+        for r in self.routes:
+            if r.method == method and r.path.match(path):
+                return r
+        return None
+
+    async def __call__(self, scope, receive, send):
+        route = self._match(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        key = request.headers.get(HEADER)
+        ident = self.identify(route.key, request) if key else None
+        if not key or ident is None:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LEN:
+            await JSONResponse(status_code=400, content={"detail": "Idempotency-Key muito longa."})(scope, receive, send)
+            return
+
+        # corpo inteiro (pequeno) para o fingerprint; depois é reentregue à rota
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        fingerprint = hashlib.sha256(scope["method"].encode() + scope["path"].encode() + b"\n" + body).hexdigest()
+
+        stored = await run_in_threadpool(self.store.get, ident, key)
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                resp = JSONResponse(
+                    status_code=422,
+                    content={"detail": "Idempotency-Key já usada com outra requisição."},
+                )
+            else:
+                resp = Response(
+                    stored.body, status_code=stored.status_code, media_type=stored.content_type,
+                    headers={"Idempotent-Replayed": "true"},
+                )
+            await resp(scope, receive, send)
+            return
+
+        slot = (ident, key)
+        if slot in self._inflight:
+            await JSONResponse(
+                status_code=409,
+                content={"detail": "Requisição com esta Idempotency-Key ainda em processamento."},
+            )(scope, receive, send)
+            return
+        self._inflight.add(slot)
+
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start = {}
+        out_chunks = []
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                out_chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            status_code = start.get("status", 500)
+            if 200 <= status_code < 300:
+                headers = {k.decode().lower(): v.decode() for k, v in start.get("headers", [])}
+                await run_in_threadpool(
+                    self.store.put, ident, key, fingerprint, status_code,
+                    headers.get("content-type", "application/json"), b"".join(out_chunks),
+                )
+        finally:
+            self._inflight.discard(slot)
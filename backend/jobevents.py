@@ -0,0 +1,81 @@
+"""
+Log de eventos por job (ring buffer) para replay na reconexão.
+
+Todo evento publicado no JobExecutionManager ganha um `seq` crescente por
+job e fica guardado nos últimos JOB_EVENT_BUFFER eventos daquele job.
+Quem conecta com `?since=<seq>` recebe na hora o que perdeu (since=0: a
+linha do tempo inteira ainda em memória), sem chamar /jobs/{id}.
+
+Limites: JOB_EVENT_MAX_JOBS jobs (LRU por último evento/leitura); jobs
+antigos saem inteiros. Em memória do processo: após reinício não há replay
+e o cliente cai no REST como antes.
+
+Configuração (env):
+  JOB_EVENT_BUFFER=256
+  JOB_EVENT_MAX_JOBS=1000
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+JOB_EVENT_BUFFER = int(os.getenv("JOB_EVENT_BUFFER", "256"))
+JOB_EVENT_MAX_JOBS = int(os.getenv("JOB_EVENT_MAX_JOBS", "1000"))
+
+
+class _JobLog:
+    __slots__ = ("seq", "events")
+
+    def __init__(self, maxlen: int):
+        self.seq = 0
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=maxlen)
+
+
+class JobEventLog:
+    def __init__(self, buffer_size: int = JOB_EVENT_BUFFER, max_jobs: int = JOB_EVENT_MAX_JOBS):
+        self.buffer_size = buffer_size
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[int, _JobLog]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, job_id: int, event_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Registra e devolve o evento pronto para envio ({seq, type, data, timestamp})."""
+        with self._lock:
+            log = self._jobs.get(job_id)
+            if log is None:
+                log = self._jobs[job_id] = _JobLog(self.buffer_size)
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.popitem(last=False)
+            else:
+                self._jobs.move_to_end(job_id)
+            log.seq += 1
+            event = {
+                "seq": log.seq,
+                "type": event_type,
+                "data": data,
+                "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            }
+            log.events.append(event)
+            return event
+
+    def since(self, job_id: int, seq: int) -> List[Dict[str, Any]]:
+        """Eventos com seq > `seq` ainda no buffer (em ordem)."""
+        with self._lock:
+            log = self._jobs.get(job_id)
+            if log is None:
+                return []
+            self._jobs.move_to_end(job_id)
+            return [e for e in log.events if e["seq"] > seq]
+
+    def last_seq(self, job_id: int) -> Optional[int]:
+        with self._lock:
+            log = self._jobs.get(job_id)
+            return log.seq if log else None
+
+    def total_events(self) -> int:
+        with self._lock:
+            return sum(len(log.events) for log in self._jobs.values())
+
+    def __len__(self) -> int:
+        return len(self._jobs)
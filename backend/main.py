@@ -1,23 +1,68 @@
+import time
+
+_BOOT_T0 = time.perf_counter()  # início do import (relatório de boot)
+
 from fastapi import FastAPI, Depends, HTTPException, Form, Query, Response, Request, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session, selectinload
-from passlib.hash import bcrypt
-from typing import Optional, List, Iterable, Tuple, Dict, Set
+from typing import Optional, List, Iterable, Literal, Tuple, Dict, Set
 from starlette import status
-from sqlalchemy import func
-from jose import jwt, JWTError
+from sqlalchemy import func, or_
 from datetime import datetime, timedelta, timezone
 import os
 import json
+import hashlib
 from random import randint
 import asyncio
-from collections import defaultdict
 
-from . import models, schemas, database
+from . import models, schemas, database, migrate, outbox, execlog, rollups, forecast, calibration
+from .ratelimit import RateLimitMiddleware
+from .idempotency import IdempotencyMiddleware, IdempotencyStore
+from .devicecodec import DeviceCodecMiddleware
+from .pollhint import ActivityTracker, PollHintMiddleware
+from .compression import CompressionMiddleware
+from .fastjson import fast_json, group_rows
+from .coalesce import merge_itens, split_logs
+from .planner import capacidade_paralela, planejar
+from .jobevents import JobEventLog
+from .userchannel import TOPICS, DevicePresence, PresenceLoop, UserHub
+from .wsregistry import CLOSE_TOO_MANY, ConnectionRegistry, LivenessLoop
+from .reaper import JobReaper, REAPER_ENABLED, STALE_RUNNING_MSG
 
 app = FastAPI(title="API Dispenser de Temperos")
 
+# ---------------------------------------------------------------------
+# Idempotency-Key (POST /jobs e relatórios do device) — o mais interno,
+# para guardar a resposta ainda sem compressão.
+# ---------------------------------------------------------------------
+app.add_middleware(
+    IdempotencyMiddleware,
+    identify=lambda kind, request: _rate_limit_identity(kind, request),
+    store=IdempotencyStore(lambda: database.SessionLocal()),
+)
+
+# CBOR/MessagePack com chaves curtas em /devices/me/* (JSON continua o padrão);
+# por fora do Idempotency-Key, que assim sempre vê/guarda JSON
+app.add_middleware(DeviceCodecMiddleware)
+
+# X-Poll-Interval-Ms nas respostas de next_job/sync (calculado nos handlers)
+app.add_middleware(PollHintMiddleware)
+
+# ---------------------------------------------------------------------
+# Rate limiting (token bucket por device/usuário) — registrado antes do
+# CORS para que as respostas 429 também levem os headers de CORS.
+# Identidade resolvida em _rate_limit_identity (mais abaixo).
+# ---------------------------------------------------------------------
+app.add_middleware(
+    RateLimitMiddleware,
+    identify=lambda kind, request: _rate_limit_identity(kind, request),
+    enabled=os.getenv("RATE_LIMIT_ENABLED", "1") == "1",
+)
+
+# Compressão (br se disponível, senão gzip) para corpos >= 1 KiB
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
 # ---------------------------------------------------------------------
 # CORS
 # ---------------------------------------------------------------------
@@ -56,6 +101,16 @@ DEFAULT_TEMPEROS = [
     "Cominho",
 ]
 
+# Jobs: estados ainda não finalizados e lease (posse temporária) do dispositivo
+ACTIVE_JOB_STATUSES = ("queued", "leased", "running")
+# "canceled" = cancelado pelo usuário (não conta como falha do dispositivo)
+FINAL_JOB_STATUSES = ("done", "done_partial", "failed", "canceled")
+JOB_LEASE_SEC = int(os.getenv("JOB_LEASE_SEC", "120"))
+MAX_ACTIVE_JOBS_PER_USER = int(os.getenv("MAX_ACTIVE_JOBS_PER_USER", "20"))
+
+# Atividade do usuário no app → intervalo de poll sugerido aos devices (pollhint.py)
+user_activity = ActivityTracker()
+
 # =====================================================================
 # WebSocket Manager para broadcast de execution_logs em tempo real
 # =====================================================================
@@ -63,66 +118,89 @@ class JobExecutionManager:
     """
     Gerencia conexões WebSocket para monitorar execução de jobs.
     Permite múltiplos clientes conectarem a um job_id e receberem updates em tempo real.
+    Todo evento passa pelo JobEventLog (seq por job) para replay com ?since=<seq>.
     """
-    def __init__(self):
-        self.job_connections: Dict[int, Set[WebSocket]] = defaultdict(set)  # job_id -> set de WebSockets
+    def __init__(self, registry: ConnectionRegistry, user_hub: Optional[UserHub] = None):
+        self.registry = registry  # sockets por job, dono, lock de envio e liveness
+        self.events = JobEventLog()
+        self.user_hub = user_hub  # repassa tudo ao tópico "progress" do /ws/me do dono
+        self.sse_queues: Dict[int, Set[asyncio.Queue]] = {}  # job_id -> filas dos streams SSE
     
-    async def connect(self, job_id: int, ws: WebSocket):
-        self.job_connections[job_id].add(ws)
-        print(f"[WS] Cliente conectado ao job {job_id}. Total: {len(self.job_connections[job_id])}")
+    async def connect(self, job_id: int, ws: WebSocket, user_id: Optional[int], since: Optional[int] = None) -> bool:
+        """Registra o socket no job; False se o dono já está no teto de conexões."""
+        conn = self.registry.register(ws, user_id, job_id)
+        if conn is None:
+            return False
+        # lock do socket: replay e broadcasts não se intercalam (ordem de seq garantida)
+        async with conn.lock:
+            # registro e snapshot sem await no meio: nada se perde entre os dois
+            perdidos = self.events.since(job_id, since) if since is not None else []
+            print(f"[WS] Cliente conectado ao job {job_id}. Total: {len(self.registry.job_sockets(job_id))}")
+            for event in perdidos:
+                await ws.send_json(event)
+        return True
     
     async def disconnect(self, job_id: int, ws: WebSocket):
-        if ws in self.job_connections[job_id]:
-            self.job_connections[job_id].discard(ws)
-            print(f"[WS] Cliente desconectado do job {job_id}. Restantes: {len(self.job_connections[job_id])}")
-            if not self.job_connections[job_id]:
-                del self.job_connections[job_id]
-    
-    async def broadcast_log_entry(self, job_id: int, entry: dict):
-        """Envia um log entry para todos os clientes conectados a este job."""
-        if job_id not in self.job_connections:
-            return
-        
+        if self.registry.unregister(ws) is not None:
+            print(f"[WS] Cliente desconectado do job {job_id}. Restantes: {len(self.registry.job_sockets(job_id))}")
+
+    async def _publish(self, job_id: int, event_type: str, data: dict, user_id: Optional[int] = None) -> List[WebSocket]:
+        """Registra o evento e envia aos conectados. Retorna os sockets que falharam."""
+        event = self.events.append(job_id, event_type, data)
+        if self.user_hub is not None and user_id is not None:
+            self.user_hub.emit(user_id, "progress", event_type, {"job_id": job_id, "seq": event["seq"], **data})
+        for q in self.sse_queues.get(job_id, ()):
+            q.put_nowait(event)
         disconnected = []
-        for ws in self.job_connections[job_id]:
+        for ws in self.registry.job_sockets(job_id):
+            conn = self.registry.get(ws)
+            if conn is None:  # saiu durante o envio a outro socket
+                continue
             try:
-                await ws.send_json({
-                    "type": "execution_log_entry",
-                    "data": entry,
-                    "timestamp": iso_utc(now_utc()),
-                })
+                async with conn.lock:
+                    await ws.send_json(event)
             except Exception as e:
-                print(f"[WS] Erro ao enviar para job {job_id}: {e}")
+                print(f"[WS] Erro ao enviar '{event_type}' para job {job_id}: {e}")
                 disconnected.append(ws)
-        
-        # Remove clientes desconectados
-        for ws in disconnected:
+        return disconnected
+    
+    def subscribe_stream(self, job_id: int, since: Optional[int]) -> Tuple[asyncio.Queue, List[dict]]:
+        """Fila para um stream SSE + eventos já perdidos (seq > since), sem lacuna entre os dois."""
+        q: asyncio.Queue = asyncio.Queue()
+        self.sse_queues.setdefault(job_id, set()).add(q)
+        return q, (self.events.since(job_id, since) if since is not None else [])
+
+    def unsubscribe_stream(self, job_id: int, q: asyncio.Queue) -> None:
+        qs = self.sse_queues.get(job_id)
+        if qs is not None:
+            qs.discard(q)
+            if not qs:
+                del self.sse_queues[job_id]
+
+    async def broadcast_log_entry(self, job_id: int, entry: dict, user_id: Optional[int] = None):
+        """Envia um log entry para todos os clientes conectados a este job."""
+        for ws in await self._publish(job_id, "execution_log_entry", entry, user_id):
             await self.disconnect(job_id, ws)
     
-    async def broadcast_completion(self, job_id: int, result: dict):
+    async def broadcast_event(self, job_id: int, event_type: str, data: dict, user_id: Optional[int] = None):
+        """Envia um evento genérico (ex.: job_status) sem encerrar o acompanhamento."""
+        for ws in await self._publish(job_id, event_type, data, user_id):
+            await self.disconnect(job_id, ws)
+
+    async def broadcast_completion(self, job_id: int, result: dict, user_id: Optional[int] = None):
         """Notifica todos os clientes que a execução terminou."""
-        if job_id not in self.job_connections:
-            return
-        
-        disconnected = []
-        for ws in self.job_connections[job_id]:
-            try:
-                await ws.send_json({
-                    "type": "execution_complete",
-                    "data": result,
-                    "timestamp": iso_utc(now_utc()),
-                })
-                # Não fecha aqui - deixa o frontend fechar após processar
-                print(f"[WS] Notificação de conclusão enviada para job {job_id}")
-            except Exception as e:
-                print(f"[WS] Erro ao notificar conclusão (job {job_id}): {e}")
-                disconnected.append(ws)
-        
-        # Limpa
-        if job_id in self.job_connections:
-            del self.job_connections[job_id]
+        for ws in await self._publish(job_id, "execution_complete", result, user_id):
+            await self.disconnect(job_id, ws)
+        # Não fecha aqui - deixa o frontend fechar após processar (o liveness recolhe
+        # quem não fechar); o buffer continua disponível para quem (re)conectar com ?since=
+        print(f"[WS] Notificação de conclusão enviada para job {job_id}")
 
-job_exec_manager = JobExecutionManager()
+# Canal por usuário (/ws/me) e presença dos devices
+user_hub = UserHub()
+device_presence = DevicePresence(user_hub)
+
+ws_registry = ConnectionRegistry()
+job_exec_manager = JobExecutionManager(ws_registry, user_hub)
 
 # ---------------------------------------------------------------------
 # Utilidades de data/hora (UTC consistente)
@@ -148,14 +226,33 @@ def server_time():
     return {"utc": iso_utc(now_utc())}
 
 # ---------------------------------------------------------------------
-# JWT helpers
+# JWT / hash de senha (imports sob demanda: pesam no cold start)
 # ---------------------------------------------------------------------
+def _jwt():
+    from jose import jwt
+    return jwt
+
+
+def _pwd_hasher():
+    from passlib.hash import bcrypt
+    return bcrypt
+
+
+def _decode_token(token: str) -> dict:
+    """Valida assinatura/expiração do JWT. Erros do jose viram ValueError."""
+    from jose import JWTError
+    try:
+        return _jwt().decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        raise ValueError(str(e)) from e
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     n = now_utc()
     expire = n + (expires_delta or timedelta(minutes=ACCESS_TOKEN_MINUTES))
     to_encode.update({"iat": int(n.timestamp()), "exp": int(expire.timestamp())})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return _jwt().encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
 def set_auth_cookie(resp: Response, token: str) -> None:
@@ -194,10 +291,161 @@ def get_db():
 
 # ---------------------------------------------------------------------
 # Inicialização
+#  SCHEMA_STARTUP_MODE:
+#    upgrade (padrão) → aplica migrações pendentes
+#    verify           → 1 consulta à schema_migrations; falha se não estiver no head
+#                       (deploys com migração como passo separado / cold start rápido)
+#    skip             → não toca no banco no boot
 # ---------------------------------------------------------------------
+SCHEMA_STARTUP_MODE = os.getenv("SCHEMA_STARTUP_MODE", "upgrade").strip().lower()
+APP_RELEASE = os.getenv("APP_RELEASE", "dev")
+
+_IMPORT_MS = (time.perf_counter() - _BOOT_T0) * 1000.0
+startup_report: Dict = {}
+
+
 @app.on_event("startup")
 def on_startup() -> None:
-    models.Base.metadata.create_all(bind=database.engine)
+    t0 = time.perf_counter()
+    if SCHEMA_STARTUP_MODE == "verify":
+        schema_version = migrate.verify(database.engine)
+    elif SCHEMA_STARTUP_MODE == "skip":
+        schema_version = None
+    else:
+        migrate.upgrade(database.engine)
+        schema_version = migrate.HEAD_VERSION
+    schema_ms = (time.perf_counter() - t0) * 1000.0
+
+    startup_report.update({
+        "release": APP_RELEASE,
+        "schema_mode": SCHEMA_STARTUP_MODE,
+        "schema_version": schema_version,
+        "import_ms": round(_IMPORT_MS, 1),
+        "schema_ms": round(schema_ms, 1),
+        "total_ms": round((time.perf_counter() - _BOOT_T0) * 1000.0, 1),
+        "started_at": iso_utc(now_utc()),
+    })
+    print(
+        f"[BOOT] release={APP_RELEASE} mode={SCHEMA_STARTUP_MODE} "
+        f"import={startup_report['import_ms']}ms schema={startup_report['schema_ms']}ms "
+        f"total={startup_report['total_ms']}ms"
+    )
+
+
+async def _notify_reaped(requeued, failed) -> None:
+    """Avisa quem acompanha o job pelo WebSocket sobre a ação do reaper."""
+    for job_id, uid in requeued:
+        await job_exec_manager.broadcast_event(
+            job_id, "job_status", {"status": "queued", "reason": "lease_expired"}, user_id=uid
+        )
+        _emit_job_status(uid, job_id, "queued", reason="lease_expired")
+    for job_id, uid in failed:
+        _emit_job_status(uid, job_id, "failed", reason="stale_running")
+        await job_exec_manager.broadcast_completion(job_id, {
+            "ok": False,
+            "stock_deducted": False,
+            "itens_completados": 0,
+            "itens_falhados": None,
+            "job_status": "failed",
+            "error": STALE_RUNNING_MSG,
+        }, user_id=uid)
+
+
+job_reaper = JobReaper(database.SessionLocal, notify=_notify_reaped)
+
+
+async def _outbox_job_completed(msg: outbox.OutboxMessage) -> None:
+    """Status, logs e conclusão para quem acompanha o job (WS, SSE e /ws/me)."""
+    p = msg.payload
+    _emit_job_status(msg.user_id, msg.job_id, p["status"], device_id=p["device_id"])
+    for entry in p["logs"]:
+        await job_exec_manager.broadcast_log_entry(msg.job_id, entry, user_id=msg.user_id)
+    await job_exec_manager.broadcast_completion(msg.job_id, p["result"], user_id=msg.user_id)
+
+
+def _emit_stock_nova_sessao(user_id: int) -> None:
+    db = database.SessionLocal()
+    try:
+        _emit_stock(db, user_id)
+    finally:
+        db.close()
+
+
+async def _outbox_stock_changed(msg: outbox.OutboxMessage) -> None:
+    if msg.user_id in user_hub.users():
+        await asyncio.to_thread(_emit_stock_nova_sessao, msg.user_id)
+
+
+async def _outbox_low_stock(msg: outbox.OutboxMessage) -> None:
+    user_hub.emit(msg.user_id, "stock", "low_stock", msg.payload)
+
+
+outbox_dispatcher = outbox.OutboxDispatcher(database.SessionLocal)
+outbox_dispatcher.register("job_completed", _outbox_job_completed)
+outbox_dispatcher.register("stock_changed", _outbox_stock_changed)
+outbox_dispatcher.register("low_stock", _outbox_low_stock)
+presence_loop = PresenceLoop(
+    device_presence,
+    lambda user_ids: _presence_rows(user_ids),
+    interval_sec=float(os.getenv("PRESENCE_INTERVAL_SEC", "15")),
+)
+ws_liveness = LivenessLoop(ws_registry)
+
+
+def _calibrar_todos() -> None:
+    """Recalibração em lote (thread do CalibrationLoop)."""
+    db = database.SessionLocal()
+    try:
+        aplicados = calibration.calibrar(db, now_utc())
+        for uid in sorted({u for u, _ in aplicados}):
+            _bump_rev(db, uid, "config_robo")
+        db.commit()
+    finally:
+        db.close()
+
+
+calibration_loop = calibration.CalibrationLoop(_calibrar_todos)
+
+
+@app.on_event("startup")
+async def start_background_tasks() -> None:
+    user_hub.bind_loop(asyncio.get_running_loop())
+    presence_loop.start()
+    ws_liveness.start()
+    if outbox.OUTBOX_ENABLED:
+        outbox_dispatcher.start()
+    if REAPER_ENABLED:
+        job_reaper.start()
+    if calibration.CALIB_ENABLED:
+        calibration_loop.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks() -> None:
+    await job_reaper.stop()
+    await presence_loop.stop()
+    await ws_liveness.stop()
+    await outbox_dispatcher.stop()
+    await calibration_loop.stop()
+
+
+@app.get("/health/startup")
+def health_startup():
+    """Relatório de boot (latência por release)."""
+    return startup_report
+
+
+@app.get("/health/realtime")
+def health_realtime():
+    """Medidor de memória do tempo real: tudo aqui deve voltar a ~0 sem clientes."""
+    return {
+        "websockets": ws_registry.stats(),
+        "user_channels": user_hub.connections(),
+        "sse_streams": sum(len(q) for q in job_exec_manager.sse_queues.values()),
+        "event_log": {"jobs": len(job_exec_manager.events), "events": job_exec_manager.events.total_events()},
+        "presence_devices": len(device_presence),
+        "outbox": outbox_dispatcher.stats(),
+    }
 
 
 @app.get("/")
@@ -216,9 +464,9 @@ def get_current_user(
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Não autenticado.")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(token)
         uid = int(payload.get("sub"))
-    except (JWTError, ValueError, TypeError):
+    except (ValueError, TypeError):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Sessão inválida.")
     user = db.query(models.Usuario).filter(models.Usuario.id == uid).first()
     if not user:
@@ -235,9 +483,9 @@ def get_optional_user(
     if not token:
         return None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(token)
         uid = int(payload.get("sub"))
-    except (JWTError, ValueError, TypeError):
+    except (ValueError, TypeError):
         return None
     return db.query(models.Usuario).filter(models.Usuario.id == uid).first()
 
@@ -264,21 +512,104 @@ def get_current_device(
     if not token:
         raise HTTPException(status_code=401, detail="Token do dispositivo ausente.")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(token)
         if payload.get("typ") != "device":
-            raise JWTError("tipo inválido")
+            raise ValueError("tipo inválido")
         sub = payload.get("sub") or ""
         if not sub.startswith("dev:"):
-            raise JWTError("sub inválido")
+            raise ValueError("sub inválido")
         dev_id = int(sub.split(":", 1)[1])
     except Exception:
         raise HTTPException(status_code=401, detail="Token inválido.")
     dev = db.query(models.Device).filter(models.Device.id == dev_id).first()
     if not dev:
         raise HTTPException(status_code=401, detail="Dispositivo não encontrado.")
+    if not _is_online(dev):
+        device_presence.came_online(dev.id, dev.user_id)
     return dev
 
 
+def _rate_limit_identity(kind: str, request: Request) -> Optional[str]:
+    """Chave do balde de rate limit: 'dev:<id>' (Bearer) ou 'user:<id>' (cookie)."""
+    try:
+        if kind == "device":
+            token = _parse_bearer(request.headers.get("authorization"))
+            sub = _decode_token(token).get("sub") if token else None
+            return sub if sub and sub.startswith("dev:") else None
+        token = request.cookies.get(COOKIE_NAME)
+        return f"user:{int(_decode_token(token).get('sub'))}" if token else None
+    except (ValueError, TypeError):
+        return None
+
+
+# ---------------------------------------------------------------------
+# Cache HTTP: ETag por (usuário, recurso) + GET condicional
+#  - toda escrita incrementa resource_revisions.rev na mesma transação
+#  - o GET compara If-None-Match com 1 lookup por PK e responde 304
+#    antes de carregar/serializar o recurso
+#  - ETags fracos (W/): o corpo pode ir com gzip/br
+# ---------------------------------------------------------------------
+CACHE_CONTROL_PRIVATE = "private, no-cache"
+
+
+def _bump_rev(db: Session, user_id: int, *resources: str) -> None:
+    """Invalida os ETags dos recursos do usuário (chamar antes do commit da escrita)."""
+    for res in resources:
+        n = (
+            db.query(models.ResourceRevision)
+            .filter(models.ResourceRevision.user_id == user_id, models.ResourceRevision.resource == res)
+            .update({models.ResourceRevision.rev: models.ResourceRevision.rev + 1}, synchronize_session=False)
+        )
+        if not n:
+            db.add(models.ResourceRevision(user_id=user_id, resource=res, rev=1))
+
+
+def _get_rev(db: Session, user_id: int, resource: str) -> int:
+    rev = (
+        db.query(models.ResourceRevision.rev)
+        .filter(models.ResourceRevision.user_id == user_id, models.ResourceRevision.resource == resource)
+        .scalar()
+    )
+    return rev or 0
+
+
+def _etag(*parts) -> str:
+    raw = "|".join(str(p) for p in parts).encode("utf-8")
+    return f'W/"{hashlib.blake2b(raw, digest_size=10).hexdigest()}"'
+
+
+def _check_not_modified(request: Request, response: Response, etag: str) -> None:
+    """304 (via HTTPException, sem corpo) se o cliente já tem esta versão; senão anota o ETag."""
+    inm = request.headers.get("if-none-match")
+    if inm:
+        tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+        if "*" in tags or etag.removeprefix("W/") in tags:
+            raise HTTPException(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers={"ETag": etag, "Cache-Control": CACHE_CONTROL_PRIVATE},
+            )
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL_PRIVATE
+
+
+def conditional_get(resource: str, optional_user: bool = False):
+    """Dependência de GET condicional para um recurso versionado por usuário."""
+    user_dep = get_optional_user if optional_user else get_current_user
+
+    def _dep(
+        request: Request,
+        response: Response,
+        user: Optional[models.Usuario] = Depends(user_dep),
+        db: Session = Depends(get_db),
+    ) -> None:
+        uid = user.id if user else 0
+        rev = _get_rev(db, uid, resource) if user else 0
+        etag = _etag(resource, uid, rev, request.url.path, request.url.query)
+        _check_not_modified(request, response, etag)
+
+    return _dep
+
+
 # ---------------------------------------------------------------------
 # Usuários / Autenticação
 # ---------------------------------------------------------------------
@@ -286,7 +617,7 @@ def get_current_device(
 def register(payload: schemas.UsuarioCreate, db: Session = Depends(get_db)):
     if db.query(models.Usuario).filter(models.Usuario.nome == payload.nome).first():
         raise HTTPException(status_code=400, detail="Usuário já existe.")
-    user = models.Usuario(nome=payload.nome, senha_hash=bcrypt.hash(payload.senha))
+    user = models.Usuario(nome=payload.nome, senha_hash=_pwd_hasher().hash(payload.senha))
     db.add(user)
     db.commit()
     db.refresh(user)
@@ -296,7 +627,7 @@ def register(payload: schemas.UsuarioCreate, db: Session = Depends(get_db)):
 @app.post("/auth/login", response_model=schemas.Usuario)
 def login(payload: schemas.UsuarioCreate, db: Session = Depends(get_db)):
     user = db.query(models.Usuario).filter(models.Usuario.nome == payload.nome).first()
-    if not user or not bcrypt.verify(payload.senha, user.senha_hash):
+    if not user or not _pwd_hasher().verify(payload.senha, user.senha_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas.")
     token = create_access_token({"sub": str(user.id), "nome": user.nome})
     resp = JSONResponse(status_code=200, content={"id": user.id, "nome": user.nome})
@@ -321,7 +652,7 @@ def me(current: models.Usuario = Depends(get_current_user)):
 def criar_usuario(usuario: schemas.UsuarioCreate, db: Session = Depends(get_db)):
     if db.query(models.Usuario).filter(models.Usuario.nome == usuario.nome).first():
         raise HTTPException(status_code=400, detail="Usuário já existe")
-    db_usuario = models.Usuario(nome=usuario.nome, senha_hash=bcrypt.hash(usuario.senha))
+    db_usuario = models.Usuario(nome=usuario.nome, senha_hash=_pwd_hasher().hash(usuario.senha))
     db.add(db_usuario)
     db.commit()
     db.refresh(db_usuario)
@@ -411,6 +742,7 @@ def _get_tempero_catalog(db: Session, user_id: Optional[int]) -> List[str]:
 def catalogo_temperos(
     opt_user: Optional[models.Usuario] = Depends(get_optional_user),
     db: Session = Depends(get_db),
+    _cache: None = Depends(conditional_get("receitas", optional_user=True)),  # catálogo deriva das receitas
 ):
     user_id = opt_user.id if opt_user else None
     return _get_tempero_catalog(db, user_id)
@@ -448,43 +780,68 @@ def criar_receita(
             )
         )
 
+    _bump_rev(db, current.id, "receitas")
     db.commit()
     return _carregar_receita(db, db_receita.id)
 
 
 @app.get("/receitas/", response_model=List[schemas.Receita])
 def listar_receitas(
+    response: Response,
     current: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db),
+    _cache: None = Depends(conditional_get("receitas")),
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0),
     q: Optional[str] = Query(None, min_length=1),
 ):
+    # caminho rápido: tuplas em vez de ORM + resposta pronta (sem revalidar o response_model)
+    return fast_json(_listar_receitas_rows(db, current.id, limit, offset, q), response)
+
+
+def _listar_receitas_rows(
+    db: Session, user_id: int, limit: int, offset: int, q: Optional[str] = None
+) -> List[Dict]:
+    """Receitas do usuário no formato de schemas.Receita, montadas de 2 consultas por colunas."""
     query = (
-        db.query(models.Receita)
-        .options(selectinload(models.Receita.ingredientes))
-        .filter(models.Receita.dono_id == current.id)
+        db.query(models.Receita.id, models.Receita.nome, models.Receita.porcoes)
+        .filter(models.Receita.dono_id == user_id)
         .order_by(models.Receita.id.asc())
     )
     if q:
         qn = q.strip().lower()
         query = query.filter(func.lower(models.Receita.nome).contains(qn))
-    query = query.offset(offset).limit(limit)
-    return list(query)
-
+    receitas = query.offset(offset).limit(limit).all()
+    if not receitas:
+        return []
 
-@app.get("/receitas/{id}", response_model=schemas.Receita)
-def obter_receita(
-    id: int,
-    current: models.Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db),
-):
-    receita = _carregar_receita(db, id)
-    if not receita or receita.dono_id != current.id:
-        raise HTTPException(status_code=404, detail="Receita não encontrada.")
-    return receita
+    ing_rows = (
+        db.query(
+            models.IngredienteReceita.receita_id,
+            models.IngredienteReceita.id,
+            models.IngredienteReceita.tempero,
+            models.IngredienteReceita.quantidade,
+        )
+        .filter(models.IngredienteReceita.receita_id.in_([r[0] for r in receitas]))
+        .order_by(models.IngredienteReceita.id.asc())
+        .all()
+    )
+    por_receita = group_rows(ing_rows)
+    return [
+        {
+            "id": rid,
+            "nome": nome,
+            "porcoes": porcoes,
+            "ingredientes": [
+                {"id": iid, "tempero": tempero, "quantidade": float(qtd)}
+                for _rid, iid, tempero, qtd in por_receita.get(rid, ())
+            ],
+        }
+        for rid, nome, porcoes in receitas
+    ]
 
 
+# (declarada antes de /receitas/{id}, senão "sugestoes" casa como {id})
 @app.get("/receitas/sugestoes", response_model=List[schemas.SugestaoReceita])
 def sugerir_receitas(
     q: str = Query(..., min_length=1),
@@ -506,6 +863,19 @@ def sugerir_receitas(
     return [{"id": r[0], "nome": r[1]} for r in rows]
 
 
+@app.get("/receitas/{id}", response_model=schemas.Receita)
+def obter_receita(
+    id: int,
+    current: models.Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    _cache: None = Depends(conditional_get("receitas")),
+):
+    receita = _carregar_receita(db, id)
+    if not receita or receita.dono_id != current.id:
+        raise HTTPException(status_code=404, detail="Receita não encontrada.")
+    return receita
+
+
 @app.put("/receitas/{id}", response_model=schemas.Receita)
 def atualizar_receita(
     id: int,
@@ -535,6 +905,7 @@ def atualizar_receita(
             )
         )
 
+    _bump_rev(db, current.id, "receitas")
     db.commit()
     return _carregar_receita(db, id)
 
@@ -549,6 +920,7 @@ def excluir_receita(
     if not receita or receita.dono_id != current.id:
         raise HTTPException(status_code=404, detail="Receita não encontrada.")
     db.delete(receita)
+    _bump_rev(db, current.id, "receitas")
     db.commit()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -611,6 +983,7 @@ def criar_receita_form(
 def get_config_robo(
     db: Session = Depends(get_db),
     current: models.Usuario = Depends(get_current_user),
+    _cache: None = Depends(conditional_get("config_robo")),
 ):
     rows = (
         db.query(models.ReservatorioConfig)
@@ -683,10 +1056,104 @@ def put_config_robo(
         db.flush()
         result.append(row)
 
+    _bump_rev(db, current.id, "config_robo")
+    _atualizar_previsao(db, current.id, {}, now_utc())  # reabastecer rearma o alerta
     db.commit()
+    _emit_stock(db, current.id)
+    outbox_dispatcher.wake()
     return result
 
 
+@app.get("/config/robo/previsao", response_model=List[schemas.PrevisaoFrascoOut])
+def get_previsao_estoque(
+    db: Session = Depends(get_db),
+    current: models.Usuario = Depends(get_current_user),
+):
+    """Dias até esvaziar cada frasco, pela taxa de consumo recente (backend/forecast.py)."""
+    return forecast.previsao(db, current.id, now_utc())
+
+
+def _recalibrar_usuario(db: Session, user_id: int) -> List[models.Calibracao]:
+    if calibration.calibrar(db, now_utc(), user_id=user_id):
+        _bump_rev(db, user_id, "config_robo")
+    db.commit()
+    return (
+        db.query(models.Calibracao)
+        .filter(models.Calibracao.user_id == user_id)
+        .order_by(models.Calibracao.frasco.asc())
+        .all()
+    )
+
+
+@app.post("/config/robo/pesagens", response_model=List[schemas.CalibracaoOut], status_code=201)
+def registrar_pesagem(
+    pesagem: schemas.PesagemIn,
+    db: Session = Depends(get_db),
+    current: models.Usuario = Depends(get_current_user),
+):
+    """Registra uma pesagem (tempo rodado x gramas na balança) e recalcula a calibração."""
+    cfg = (
+        db.query(models.ReservatorioConfig)
+        .filter(models.ReservatorioConfig.user_id == current.id, models.ReservatorioConfig.frasco == pesagem.frasco)
+        .first()
+    )
+    if not cfg:
+        raise HTTPException(status_code=404, detail="Frasco não configurado")
+    db.add(models.Pesagem(
+        user_id=current.id,
+        frasco=pesagem.frasco,
+        rotulo=cfg.rotulo,
+        segundos=pesagem.segundos,
+        gramas=pesagem.gramas,
+        created_at=now_utc(),
+    ))
+    db.flush()
+    return _recalibrar_usuario(db, current.id)
+
+
+@app.get("/config/robo/calibracao", response_model=List[schemas.CalibracaoOut])
+def get_calibracao(
+    recalcular: bool = Query(False, description="Recalcula agora em vez de usar a última rodada periódica"),
+    db: Session = Depends(get_db),
+    current: models.Usuario = Depends(get_current_user),
+):
+    """g_por_seg sugerido por frasco, com intervalo de confiança (backend/calibration.py)."""
+    if recalcular:
+        return _recalibrar_usuario(db, current.id)
+    return (
+        db.query(models.Calibracao)
+        .filter(models.Calibracao.user_id == current.id)
+        .order_by(models.Calibracao.frasco.asc())
+        .all()
+    )
+
+
+@app.post("/config/robo/calibracao/{frasco}/aplicar", response_model=schemas.ReservatorioConfigOut)
+def aplicar_calibracao(
+    frasco: int,
+    db: Session = Depends(get_db),
+    current: models.Usuario = Depends(get_current_user),
+):
+    """Aceita a proposta de calibração do frasco: g_por_seg passa a ser o sugerido."""
+    cal = db.get(models.Calibracao, (current.id, frasco))
+    if not cal or cal.status != "proposta":
+        raise HTTPException(status_code=404, detail="Nenhuma proposta de calibração para este frasco")
+    cfg = (
+        db.query(models.ReservatorioConfig)
+        .filter(models.ReservatorioConfig.user_id == current.id, models.ReservatorioConfig.frasco == frasco)
+        .first()
+    )
+    if not cfg or cfg.rotulo != cal.rotulo:
+        raise HTTPException(status_code=409, detail="O frasco mudou desde a calibração; recalcule")
+    cfg.g_por_seg = cal.g_por_seg_sugerido
+    cal.g_por_seg_atual = cal.g_por_seg_sugerido
+    cal.status = "aplicada"
+    _bump_rev(db, current.id, "config_robo")
+    db.commit()
+    db.refresh(cfg)
+    return cfg
+
+
 # ---------------------------------------------------------------------
 # Configuração do Motor (por usuário)
 # ---------------------------------------------------------------------
@@ -694,6 +1161,7 @@ def put_config_robo(
 def get_motor_config(
     db: Session = Depends(get_db),
     current: models.Usuario = Depends(get_current_user),
+    _cache: None = Depends(conditional_get("config_motor")),
 ):
     """Retorna configuração do motor do usuário (cria default se não existir)"""
     config = (
@@ -733,7 +1201,14 @@ def update_motor_config(
     config.pre_start_delay_ms = config_in.pre_start_delay_ms
     config.post_stop_delay_ms = config_in.post_stop_delay_ms
     config.max_runtime_sec = config_in.max_runtime_sec
+    config.coalesce_max_jobs = config_in.coalesce_max_jobs
+    config.max_servos_simultaneos = config_in.max_servos_simultaneos
+    config.servo_current_ma = config_in.servo_current_ma
+    config.power_budget_ma = config_in.power_budget_ma
+    if config_in.calibracao_auto is not None:
+        config.calibracao_auto = config_in.calibracao_auto
     
+    _bump_rev(db, current.id, "config_motor")
     db.commit()
     db.refresh(config)
     return config
@@ -756,6 +1231,26 @@ def _resolver_mapeamento(
       - match por rotulo == tempero (case-insensitive)
       - se vários frascos tiverem o mesmo rótulo, prioriza os com g/s definido; desempate por número do frasco.
     """
+    configs = (
+        db.query(models.ReservatorioConfig)
+        .filter(models.ReservatorioConfig.user_id == user_id)
+        .all()
+    )
+    return _mapear_ingredientes(_indice_rotulos(configs), ingredientes)
+
+
+def _indice_rotulos(configs: Iterable[models.ReservatorioConfig]) -> Dict[str, models.ReservatorioConfig]:
+    """rótulo (minúsculo) → frasco escolhido, pelas regras de _resolver_mapeamento."""
+    indice: Dict[str, models.ReservatorioConfig] = {}
+    for cfg in sorted(configs, key=lambda c: (c.g_por_seg is None, c.frasco)):
+        if cfg.rotulo:
+            indice.setdefault(cfg.rotulo.strip().lower(), cfg)
+    return indice
+
+
+def _mapear_ingredientes(
+    indice: Dict[str, models.ReservatorioConfig], ingredientes: Iterable[models.IngredienteReceita]
+) -> Tuple[List[Tuple[int, str, int, float]], List[str], List[str]]:
     itens_mapeados: List[Tuple[int, str, int, float]] = []
     faltam_mapeamento: List[str] = []
     faltam_calibracao: List[str] = []
@@ -764,24 +1259,11 @@ def _resolver_mapeamento(
         nome = ing.tempero.strip()
         q_g = int(ing.quantidade)
 
-        configs = (
-            db.query(models.ReservatorioConfig)
-            .filter(
-                models.ReservatorioConfig.user_id == user_id,
-                func.lower(models.ReservatorioConfig.rotulo) == func.lower(nome),
-            )
-            .order_by(
-                (models.ReservatorioConfig.g_por_seg.isnot(None)).desc(),
-                models.ReservatorioConfig.frasco.asc(),
-            )
-            .all()
-        )
-
-        if not configs:
+        cfg = indice.get(nome.lower())
+        if cfg is None:
             faltam_mapeamento.append(nome)
             continue
 
-        cfg = configs[0]
         if cfg.g_por_seg is None or cfg.g_por_seg <= 0:
             faltam_calibracao.append(nome)
             continue
@@ -791,25 +1273,62 @@ def _resolver_mapeamento(
     return itens_mapeados, faltam_mapeamento, faltam_calibracao
 
 
+def _reservas_por_frasco(db: Session, user_id: int) -> Dict[int, float]:
+    """Gramas já comprometidas por frasco pelos jobs ativos (na fila, arrendados ou rodando)."""
+    rows = (
+        db.query(models.JobItem.frasco, func.sum(models.JobItem.quantidade_g))
+        .join(models.Job, models.Job.id == models.JobItem.job_id)
+        .filter(models.Job.user_id == user_id, models.Job.status.in_(ACTIVE_JOB_STATUSES))
+        .group_by(models.JobItem.frasco)
+        .all()
+    )
+    return {frasco: float(total or 0.0) for frasco, total in rows}
+
+
+def _fila_ordenada(query):
+    """Ordem de saída da fila: prioridade desc, depois chegada."""
+    return query.order_by(models.Job.prioridade.desc(), models.Job.id.asc())
+
+
+def _plano_execucao(itens: List[Dict], motor_config: Optional[models.MotorConfig]) -> Dict:
+    """Plano de dispensa paralela (ver planner.py) com os limites do MotorConfig do usuário."""
+    cfg = motor_config or models.MotorConfig(
+        pre_start_delay_ms=500, post_stop_delay_ms=300, max_servos_simultaneos=1, servo_current_ma=250
+    )
+    k = capacidade_paralela(cfg.max_servos_simultaneos, cfg.power_budget_ma, cfg.servo_current_ma)
+    return planejar(itens, k, cfg.pre_start_delay_ms, cfg.post_stop_delay_ms)
+
+
+def _job_out_com_plano(db: Session, job: models.Job) -> schemas.JobOut:
+    motor_config = db.query(models.MotorConfig).filter(models.MotorConfig.user_id == job.user_id).first()
+    out = schemas.JobOut.model_validate(job)
+    plano = _plano_execucao([it.model_dump() for it in out.itens], motor_config)
+    return out.model_copy(update={
+        "plano": schemas.PlanoExecucao.model_validate(plano),
+        "tempo_estimado_s": plano["makespan_ms"] / 1000.0,
+    })
+
+
 @app.post("/jobs", response_model=schemas.JobOut, status_code=status.HTTP_201_CREATED)
 def criar_job(
     payload: schemas.JobCreateIn,
     current: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    # 1 job por vez
-    ativo = (
-        db.query(models.Job)
+    user_activity.touch(current.id)
+    # fila por usuário (limite só contra abuso)
+    ativos = (
+        db.query(func.count(models.Job.id))
         .filter(
             models.Job.user_id == current.id,
-            models.Job.status.in_(("queued", "running")),
+            models.Job.status.in_(ACTIVE_JOB_STATUSES),
         )
-        .first()
+        .scalar()
     )
-    if ativo:
+    if ativos >= MAX_ACTIVE_JOBS_PER_USER:
         raise HTTPException(
             status_code=409,
-            detail="Robô ocupado: já existe uma execução em andamento ou na fila.",
+            detail=f"Fila cheia: já existem {ativos} execuções na fila ou em andamento.",
         )
 
     receita = _carregar_receita(db, payload.receita_id)
@@ -853,17 +1372,31 @@ def criar_job(
     for frasco, _nome, q_g, _gps in itens_mapeados:
         consumo_por_frasco[frasco] = consumo_por_frasco.get(frasco, 0.0) + (q_g * escala_fator)
 
-    # valida estoque conhecido (None = desconhecido → não bloqueia)
-    for frasco, consumo in consumo_por_frasco.items():
-        cfg = (
+    # valida estoque conhecido (None = desconhecido → não bloqueia), descontando o que
+    # os jobs ainda não executados da fila já reservaram
+    estoques = {
+        cfg.frasco: cfg.estoque_g
+        for cfg in (
             db.query(models.ReservatorioConfig)
-            .filter(models.ReservatorioConfig.user_id == current.id, models.ReservatorioConfig.frasco == frasco)
-            .first()
+            .filter(models.ReservatorioConfig.user_id == current.id)
+            .with_for_update()  # serializa criações concorrentes (Postgres)
+            .all()
         )
-        if cfg and cfg.estoque_g is not None and cfg.estoque_g < consumo:
+    }
+    reservado = _reservas_por_frasco(db, current.id)
+    for frasco, consumo in consumo_por_frasco.items():
+        estoque = estoques.get(frasco)
+        if estoque is None:
+            continue
+        disponivel = float(estoque) - reservado.get(frasco, 0.0)
+        if disponivel < consumo:
+            detalhe = f" ({reservado[frasco]:.1f} g reservados pela fila)" if reservado.get(frasco) else ""
             raise HTTPException(
                 status_code=409,
-                detail=f"Estoque insuficiente no Reservatório {frasco}: precisa {consumo:.1f} g, tem {cfg.estoque_g} g",
+                detail=(
+                    f"Estoque insuficiente no Reservatório {frasco}: precisa {consumo:.1f} g, "
+                    f"disponível {max(0.0, disponivel):.1f} g de {estoque} g{detalhe}"
+                ),
             )
 
     # cria job + itens (NÃO abate estoque aqui!)
@@ -873,6 +1406,7 @@ def criar_job(
         status="queued",
         multiplicador=payload.multiplicador,  # mantém para compatibilidade
         pessoas_solicitadas=pessoas,
+        prioridade=payload.prioridade,
     )
     db.add(job)
     db.flush()
@@ -904,24 +1438,105 @@ def criar_job(
         .filter(models.Job.id == job.id)
         .first()
     )
-    return job
+    _emit_job_status(current.id, job.id, "queued", prioridade=job.prioridade)
+    return _job_out_com_plano(db, job)
 
 
-@app.get("/jobs/{job_id}", response_model=schemas.JobOut)
-def obter_job(
-    job_id: int,
+@app.post("/jobs/plan", response_model=schemas.JobPlanOut)
+def planejar_jobs(
+    payload: schemas.JobPlanIn,
     current: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    job = (
-        db.query(models.Job)
-        .options(selectinload(models.Job.itens))
-        .filter(models.Job.id == job_id, models.Job.user_id == current.id)
-        .first()
+    """
+    Verifica um cardápio inteiro sem criar jobs: mapeamento, calibração e estoque
+    acumulado (fila atual + entradas anteriores do próprio cardápio), com o tempo
+    estimado de cada execução. Uma carga de receitas e uma de configs por chamada.
+    """
+    ids = {e.receita_id for e in payload.itens}
+    receitas = {
+        r.id: r
+        for r in (
+            db.query(models.Receita)
+            .options(selectinload(models.Receita.ingredientes))
+            .filter(models.Receita.id.in_(ids), models.Receita.dono_id == current.id)
+            .all()
+        )
+    }
+    configs = (
+        db.query(models.ReservatorioConfig)
+        .filter(models.ReservatorioConfig.user_id == current.id)
+        .all()
     )
-    if not job:
-        raise HTTPException(status_code=404, detail="Job não encontrado.")
-    return job
+    indice = _indice_rotulos(configs)
+    estoques = {cfg.frasco: cfg.estoque_g for cfg in configs}
+    reservado = _reservas_por_frasco(db, current.id)
+    motor_config = db.query(models.MotorConfig).filter(models.MotorConfig.user_id == current.id).first()
+
+    necessario: Dict[int, float] = {}
+    entradas = []
+    tempo_total = 0.0
+    for i, e in enumerate(payload.itens):
+        out = {"indice": i, "receita_id": e.receita_id, "pessoas_solicitadas": e.pessoas_solicitadas}
+        receita = receitas.get(e.receita_id)
+        erros: List[str] = []
+        if receita is None:
+            erros.append("Receita não encontrada.")
+        elif not receita.porcoes or receita.porcoes <= 0:
+            erros.append("Receita sem porções definidas.")
+        if erros:
+            entradas.append({**out, "viavel": False, "erros": erros})
+            continue
+
+        mapeados, faltam_map, faltam_cal = _mapear_ingredientes(indice, receita.ingredientes)
+        if faltam_map:
+            erros.append(f"Mapeamento ausente: {', '.join(sorted(set(faltam_map), key=str.lower))}")
+        if faltam_cal:
+            erros.append(f"Calibração pendente (g/s): {', '.join(sorted(set(faltam_cal), key=str.lower))}")
+
+        fator = float(e.pessoas_solicitadas) / float(receita.porcoes)
+        itens = []
+        consumo: Dict[int, float] = {}
+        for ordem, (frasco, nome, q_g, gps) in enumerate(mapeados, start=1):
+            total_g = float(q_g) * fator
+            itens.append({"ordem": ordem, "frasco": frasco, "segundos": round(total_g / gps, 3)})
+            consumo[frasco] = consumo.get(frasco, 0.0) + total_g
+        for frasco, g in consumo.items():
+            necessario[frasco] = necessario.get(frasco, 0.0) + g
+
+        faltas = [
+            f for f in sorted(consumo)
+            if estoques.get(f) is not None and reservado.get(f, 0.0) + necessario[f] > float(estoques[f])
+        ]
+        tempo = _plano_execucao(itens, motor_config)["makespan_ms"] / 1000.0 if itens else 0.0
+        tempo_total += tempo
+        entradas.append({
+            **out,
+            "viavel": not erros and not faltas,
+            "erros": erros,
+            "consumo_g": {f: round(g, 3) for f, g in consumo.items()},
+            "faltas": faltas,
+            "tempo_estimado_s": tempo,
+        })
+
+    frascos = []
+    for frasco in sorted(set(necessario) | set(reservado)):
+        estoque = estoques.get(frasco)
+        total = reservado.get(frasco, 0.0) + necessario.get(frasco, 0.0)
+        frascos.append({
+            "frasco": frasco,
+            "estoque_g": estoque,
+            "reservado_g": round(reservado.get(frasco, 0.0), 3),
+            "necessario_g": round(necessario.get(frasco, 0.0), 3),
+            "falta_g": round(max(0.0, total - float(estoque)), 3) if estoque is not None else 0.0,
+        })
+
+    return {
+        "viavel": all(e["viavel"] for e in entradas),
+        "tempo_total_s": round(tempo_total, 3),
+        "entradas": entradas,
+        "frascos": frascos,
+    }
 
 
 # ---------------------------------------------------------------------
@@ -985,49 +1600,232 @@ def device_heartbeat(
     dev: models.Device = Depends(get_current_device),
     db: Session = Depends(get_db),
 ):
-    dev.last_seen = now_utc()                            # <<< mantém online atualizado
-    if data.fw_version:
-        dev.fw_version = data.fw_version
-    if data.status is not None:
-        dev.status_json = json.dumps(data.status)
+    _registrar_heartbeat(db, dev, data.fw_version, data.status)
     db.commit()
     return {"ok": True}
 
 
+def _registrar_heartbeat(db: Session, dev: models.Device, fw_version: Optional[str], status_dev: Optional[dict]) -> None:
+    dev.last_seen = now_utc()                            # <<< mantém online atualizado
+    if fw_version:
+        dev.fw_version = fw_version
+    if status_dev is not None:
+        dev.status_json = json.dumps(status_dev)
+    # heartbeat renova (só estende, nunca encurta) o lease dos jobs deste device
+    renovado = now_utc() + timedelta(seconds=JOB_LEASE_SEC)
+    db.query(models.Job).filter(
+        models.Job.device_id == dev.id,
+        models.Job.status.in_(("leased", "running")),
+        or_(models.Job.lease_until.is_(None), models.Job.lease_until < renovado),
+    ).update({models.Job.lease_until: renovado}, synchronize_session=False)
+
+
+def _lease_deadline(motor_config: Optional[models.MotorConfig]) -> datetime:
+    # o firmware não manda heartbeat enquanto dispensa: o lease cobre a execução inteira
+    max_runtime = motor_config.max_runtime_sec if motor_config else 300
+    return now_utc() + timedelta(seconds=max(JOB_LEASE_SEC, max_runtime + 60))
+
+
+def _lease_next_job(db: Session, dev: models.Device, lease_until: datetime) -> Optional[int]:
+    """
+    Reivindica atomicamente o próximo job "queued" da fila do usuário para este device.
+    UPDATE condicional (status ainda 'queued') garante um único dono mesmo com vários
+    ESP32 do mesmo usuário fazendo poll ao mesmo tempo; no Postgres o SELECT usa
+    FOR UPDATE SKIP LOCKED para que os concorrentes pulem direto para o próximo job.
+    """
+    for _ in range(5):
+        cand = _proximo_da_fila(db, dev.user_id)
+        if cand is None:
+            return None
+        if _claim_job(db, dev, cand, lease_until):
+            return cand
+        # outro device levou este job entre o SELECT e o UPDATE: tenta o próximo
+    return None
+
+
+def _proximo_da_fila(db: Session, user_id: int) -> Optional[int]:
+    cand = (
+        _fila_ordenada(
+            db.query(models.Job.id)
+            .filter(models.Job.user_id == user_id, models.Job.status == "queued")
+        )
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    return cand[0] if cand else None
+
+
+def _claim_job(db: Session, dev: models.Device, job_id: int, lease_until: datetime) -> bool:
+    claimed = (
+        db.query(models.Job)
+        .filter(models.Job.id == job_id, models.Job.status == "queued")
+        .update(
+            {
+                models.Job.status: "leased",
+                models.Job.device_id: dev.id,
+                models.Job.lease_until: lease_until,
+                models.Job.started_at: now_utc(),  # cada lease é uma nova tentativa
+            },
+            synchronize_session=False,
+        )
+    )
+    return claimed == 1
+
+
+# Limites do firmware (esp32/dispenser.ino) para uma execução coalescida:
+#  - MAX_STEP_MS: cada item (frasco) roda no máximo 180 s; além disso é cortado;
+#  - o JSON do job vai para StaticJsonDocument<4096> e jsonPayload[4096] — o pool
+#    do ArduinoJson gasta bem mais que o texto, então o teto do texto fica abaixo.
+FIRMWARE_MAX_STEP_SEC = 180.0
+DEVICE_JOB_MAX_BYTES = int(os.getenv("DEVICE_JOB_MAX_BYTES", "2048"))
+
+
+def _lote_cabe(membros: List[models.Job], motor_config: models.MotorConfig, com_plano: bool = False) -> bool:
+    """O lote (líder primeiro) ainda cabe numa execução do firmware?"""
+    itens = merge_itens(membros)
+    if any(it["segundos"] > FIRMWARE_MAX_STEP_SEC for it in itens):
+        return False
+    # sem plano o firmware roda os itens em série; o reaper falha o que passar do max_runtime
+    if com_plano:
+        duracao_ms = _plano_execucao(itens, motor_config)["makespan_ms"]
+    else:
+        duracao_ms = sum(
+            motor_config.pre_start_delay_ms + it["segundos"] * 1000.0 + motor_config.post_stop_delay_ms
+            for it in itens
+        )
+    if duracao_ms > motor_config.max_runtime_sec * 1000:
+        return False
+    payload = schemas.JobOut.model_validate(_job_payload(membros[0], membros, motor_config, com_plano))
+    return len(payload.model_dump_json()) <= DEVICE_JOB_MAX_BYTES
+
+
+def _lease_lote(db: Session, dev: models.Device, lider_id: int, lease_until: datetime,
+                motor_config: models.MotorConfig, com_plano: bool = False) -> None:
+    """
+    Coalescência: arrenda mais jobs da fila para o mesmo device e os liga ao líder,
+    parando no primeiro que estouraria coalesce_max_jobs ou os limites do firmware.
+    """
+    def carregar(job_id: int) -> models.Job:
+        return db.query(models.Job).options(selectinload(models.Job.itens)).filter(models.Job.id == job_id).one()
+
+    membros = [carregar(lider_id)]
+    tentativas = 0
+    while len(membros) < motor_config.coalesce_max_jobs and tentativas < 5:
+        cand_id = _proximo_da_fila(db, dev.user_id)
+        if cand_id is None:
+            break
+        cand = carregar(cand_id)
+        if not _lote_cabe(membros + [cand], motor_config, com_plano):
+            break  # não pula a fila: o próximo poll leva este job
+        if _claim_job(db, dev, cand_id, lease_until):
+            membros.append(cand)
+        else:
+            tentativas += 1  # outro device levou: tenta o seguinte
+    ids = [m.id for m in membros]
+    if len(ids) > 1:
+        db.query(models.Job).filter(models.Job.id.in_(ids)).update(
+            {models.Job.lote_id: lider_id}, synchronize_session=False
+        )
+
+
+def _membros_do_lote(db: Session, job: models.Job) -> List[models.Job]:
+    """Jobs atendidos pela mesma execução (líder primeiro); [job] se não houve coalescência."""
+    if job.lote_id is None:
+        return [job]
+    membros = (
+        db.query(models.Job)
+        .options(selectinload(models.Job.itens))
+        .filter(models.Job.lote_id == job.lote_id)
+        .order_by((models.Job.id == job.lote_id).desc(), models.Job.prioridade.desc(), models.Job.id.asc())
+        .all()
+    )
+    return membros or [job]
+
+
+# Recursos opcionais que o firmware declara no header X-Device-Caps (lista separada por vírgula):
+#   "plano" = executa os passos de abertura simultânea; sem ele o job vai sem `plano`
+#   (o firmware atual roda `itens` em série e o plano só ocuparia o buffer de 4 KiB)
+DEVICE_CAP_PLANO = "plano"
+
+
+def _device_caps(x_device_caps: Optional[str] = Header(None, alias="X-Device-Caps")) -> Set[str]:
+    return {c.strip().lower() for c in (x_device_caps or "").split(",") if c.strip()}
+
+
 @app.get("/devices/me/next_job", response_model=schemas.JobOut, responses={204: {"description": "Sem job"}})
 def device_next_job(
+    request: Request,
     dev: models.Device = Depends(get_current_device),
     db: Session = Depends(get_db),
+    caps: Set[str] = Depends(_device_caps),
 ):
     dev.last_seen = now_utc()                            # <<< também atualiza aqui
-    job = (
-        db.query(models.Job)
-        .options(selectinload(models.Job.itens), selectinload(models.Job.receita))
-        .join(models.Receita, models.Receita.id == models.Job.receita_id)
-        .filter(models.Receita.dono_id == dev.user_id, models.Job.status == "queued")
-        .order_by(models.Job.id.asc())
-        .first()
-    )
-    if not job:
-        db.commit()
+    job_dict = _proximo_job_payload(db, dev, DEVICE_CAP_PLANO in caps)
+    request.state.poll_hint_ms = _poll_hint(dev, job_dict)
+    if job_dict is None:
         return Response(status_code=204)
+    return job_dict
+
+
+def _poll_hint(dev: models.Device, job: Optional[Dict]) -> int:
+    """
+    Intervalo sugerido a partir do que _proximo_job_payload acabou de fazer, sem
+    nova consulta: sem job devolvido é porque não havia "queued" para arrendar.
+    """
+    return user_activity.hint_ms(dev.user_id, job is not None)
+
+
+def _proximo_job_payload(db: Session, dev: models.Device, com_plano: bool = False) -> Optional[Dict]:
+    """Re-entrega o job arrendado deste device ou arrenda o próximo da fila. Faz commit."""
 
-    # MUDANÇA: NÃO transiciona para "running" aqui
-    # O ESP32 vai reportar de forma offline-first
-    # Apenas marca started_at quando o job é retornado
-    if not job.started_at:
-        job.started_at = now_utc()
-    
-    # NOVO: Buscar configuração do motor do usuário
     motor_config = (
         db.query(models.MotorConfig)
         .filter(models.MotorConfig.user_id == dev.user_id)
         .first()
     )
-    
+    lease_until = _lease_deadline(motor_config)
+
+    # Re-entrega: se este device já tem um job arrendado (resposta anterior perdida,
+    # reboot antes de salvar na flash), devolve o mesmo em vez de pegar outro.
+    job_id = (
+        db.query(func.coalesce(models.Job.lote_id, models.Job.id))
+        .filter(models.Job.device_id == dev.id, models.Job.status == "leased")
+        .order_by(models.Job.id.asc())
+        .limit(1)
+        .scalar()
+    )
+    novo_lease = job_id is None
+    if not novo_lease:
+        db.query(models.Job).filter(
+            models.Job.device_id == dev.id, models.Job.status == "leased"
+        ).update({models.Job.lease_until: lease_until}, synchronize_session=False)
+    else:
+        job_id = _lease_next_job(db, dev, lease_until)
+        if job_id is not None and motor_config and motor_config.coalesce_max_jobs > 1:
+            _lease_lote(db, dev, job_id, lease_until, motor_config, com_plano)
+
+    if job_id is None:
+        db.commit()
+        return None
+
+    # O ESP32 executa offline-first e reporta ao final; o job fica "leased" até lá
     db.commit()
-    db.refresh(job)
-    
+    job = (
+        db.query(models.Job)
+        .options(selectinload(models.Job.itens))
+        .filter(models.Job.id == job_id)
+        .first()
+    )
+    membros = _membros_do_lote(db, job)
+    if novo_lease:
+        for m in membros:
+            _emit_job_status(dev.user_id, m.id, "leased", device_id=dev.id)
+    return _job_payload(job, membros, motor_config, com_plano)
+
+
+def _job_payload(job: models.Job, membros: List[models.Job], motor_config: Optional[models.MotorConfig],
+                 com_plano: bool = False) -> Dict:
+    """Job no formato de schemas.JobOut como o ESP32 recebe (lote coalescido: um item por frasco)."""
     # NOVO: Adicionar motor_config ao response
     job_dict = {
         "id": job.id,
@@ -1035,9 +1833,11 @@ def device_next_job(
         "receita_id": job.receita_id,
         "pessoas_solicitadas": job.pessoas_solicitadas,
         "multiplicador": job.multiplicador,
+        "prioridade": job.prioridade,
         "created_at": job.created_at,
         "started_at": job.started_at,
         "finished_at": job.finished_at,
+        "lease_until": job.lease_until,
         "erro_msg": job.erro_msg,
         "itens": [
             {
@@ -1056,13 +1856,31 @@ def device_next_job(
             "pre_start_delay_ms": motor_config.pre_start_delay_ms,
             "post_stop_delay_ms": motor_config.post_stop_delay_ms,
             "max_runtime_sec": motor_config.max_runtime_sec,
+            "coalesce_max_jobs": motor_config.coalesce_max_jobs,
+            "max_servos_simultaneos": motor_config.max_servos_simultaneos,
+            "servo_current_ma": motor_config.servo_current_ma,
+            "power_budget_ma": motor_config.power_budget_ma,
         } if motor_config else {
             "vibration_intensity": 75,
             "pre_start_delay_ms": 500,
             "post_stop_delay_ms": 300,
             "max_runtime_sec": 300,
+            "coalesce_max_jobs": 1,
+            "max_servos_simultaneos": 1,
+            "servo_current_ma": 250,
+            "power_budget_ma": None,
         },
     }
+
+    # Execução coalescida: um item por frasco somando os jobs do lote
+    if len(membros) > 1:
+        job_dict["itens"] = merge_itens(membros)
+        job_dict["lote_job_ids"] = [m.id for m in membros]
+
+    # Passos de abertura simultânea: só para firmware que declara DEVICE_CAP_PLANO
+    if com_plano:
+        job_dict["plano"] = _plano_execucao(job_dict["itens"], motor_config)
+        job_dict["tempo_estimado_s"] = job_dict["plano"]["makespan_ms"] / 1000.0
     
     return job_dict
 
@@ -1089,18 +1907,42 @@ def device_job_status(
     if dono_id != dev.user_id:
         raise HTTPException(status_code=403, detail="Job não pertence a este usuário/dispositivo.")
 
+    if job.device_id is not None and job.device_id != dev.id:
+        raise HTTPException(status_code=409, detail="Job em posse de outro dispositivo.")
+
     now = now_utc()
+    # execução coalescida: o status vale para o lote. Membros já finalizados ficam
+    # de fora — o firmware repete o "done" quando o POST falha, e o abate,
+    # o log e os rollups não podem contar duas vezes
+    membros = [m for m in _membros_do_lote(db, job) if m.status not in FINAL_JOB_STATUSES]
+    if not membros:
+        return {"ok": True}
+    for m in membros:
+        m.device_id = dev.id
     if payload.status == "running":
-        job.status = "running"
-        if not job.started_at:
-            job.started_at = now
+        for m in membros:
+            if m.status != "running":  # início desta tentativa (repetir "running" não reinicia)
+                m.started_at = now
+            m.status = "running"
     elif payload.status == "done":
-        job.status = "done"
-        job.finished_at = now
+        log_rows = []
+        for m in membros:
+            m.status = "done"
+            m.finished_at = now
+            m.lease_until = None
+            # sem relatório: cada item conta como dispensado no pedido (consumo, não medição)
+            log_rows.extend(execlog.log_rows(
+                m.id, dev.user_id, now, [(it.frasco, it.quantidade_g) for it in m.itens],
+                [{"frasco": it.frasco, "tempero": it.tempero, "quantidade_g": it.quantidade_g,
+                  "segundos": it.segundos, "status": "done"} for it in m.itens],
+                reportado=False,
+            ))
+        execlog.bulk_insert(db, log_rows)
+        rollups.registrar(db, log_rows)
 
         # >>> ABATE ESTOQUE AQUI (após execução bem-sucedida) <<<
         consumo_por_frasco = {}
-        for it in job.itens:
+        for it in (it for m in membros for it in m.itens):
             consumo_por_frasco[it.frasco] = consumo_por_frasco.get(it.frasco, 0.0) + float(it.quantidade_g or 0)
         for frasco, total_g in consumo_por_frasco.items():
             cfg = (
@@ -1113,17 +1955,26 @@ def device_job_status(
             )
             if cfg and cfg.estoque_g is not None:
                 cfg.estoque_g = max(0.0, float(cfg.estoque_g) - float(total_g))
+        _bump_rev(db, dev.user_id, "config_robo")
+        _atualizar_previsao(db, dev.user_id, consumo_por_frasco, now)
     else:
-        job.status = "failed"
-        job.finished_at = now
-        job.erro_msg = payload.error or "erro não especificado"
+        for m in membros:
+            m.status = "failed"
+            m.finished_at = now
+            m.lease_until = None
+            m.erro_msg = payload.error or "erro não especificado"
 
     db.commit()
+    for m in membros:
+        _emit_job_status(dev.user_id, m.id, m.status, device_id=dev.id)
+    if payload.status == "done":
+        _emit_stock(db, dev.user_id)
+        outbox_dispatcher.wake()
     return {"ok": True}
 
 
 @app.post("/devices/me/jobs/{job_id}/complete", response_model=schemas.JobCompleteOut)
-async def device_job_complete(
+def device_job_complete(
     job_id: int,
     payload: schemas.JobCompleteIn,
     dev: models.Device = Depends(get_current_device),
@@ -1136,7 +1987,7 @@ async def device_job_complete(
     - Ao reconectar, envia /devices/me/jobs/{job_id}/complete com logs
     - Backend valida, abate estoque apenas itens com status="done"
     - Oferece proteção contra duplicatas via idempotência
-    - **NOVO**: Faz broadcast dos logs para clientes WebSocket conectados
+    - Broadcast dos logs (WebSocket/SSE) via outbox gravado na mesma transação
     """
     dev.last_seen = now_utc()
     
@@ -1155,21 +2006,19 @@ async def device_job_complete(
         raise HTTPException(status_code=403, detail="Job não pertence a este usuário/dispositivo.")
 
     # Idempotência: se já foi completado, retorna ok sem duplicar
-    if job.status in ("done", "done_partial", "failed"):
+    if job.status in FINAL_JOB_STATUSES:
         return schemas.JobCompleteOut(
             ok=True,
             stock_deducted=True,  # já foi abatido antes
             message="Job já foi completado anteriormente"
         )
 
+    if job.device_id is not None and job.device_id != dev.id:
+        raise HTTPException(status_code=409, detail="Job em posse de outro dispositivo.")
+
     now = now_utc()
-    job.itens_completados = payload.itens_completados
-    job.itens_falhados = payload.itens_falhados
-    job.finished_at = now
-    
-    # Salva relatório de execução (JSON)
-    import json
-    job.execution_report = json.dumps([
+    membros = _membros_do_lote(db, job)
+    logs = [
         {
             "frasco": log.frasco,
             "tempero": log.tempero,
@@ -1177,15 +2026,36 @@ async def device_job_complete(
             "segundos": log.segundos,
             "status": log.status,
             "error": log.error,
+            "medido": log.medido,
         }
         for log in payload.execution_logs
-    ])
-
-    # Define status final
-    if payload.itens_falhados > 0:
-        job.status = "done_partial"  # alguns falharam
+    ]
+    if len(membros) > 1:
+        # execução coalescida: reparte o relatório entre os jobs do lote
+        logs_por_job = split_logs(merge_itens(membros), payload.execution_logs, job.id)
     else:
-        job.status = "done"  # tudo ok
+        logs_por_job = {job.id: logs}
+
+    # Salva relatório de execução (linhas em job_execution_log) e define status final de cada job
+    log_rows = []
+    for m in membros:
+        m_logs = logs_por_job.get(m.id, [])
+        m.device_id = dev.id
+        m.lease_until = None
+        m.finished_at = now
+        if len(membros) > 1:
+            m.itens_completados = sum(1 for l in m_logs if l["status"] == "done")
+            m.itens_falhados = sum(1 for l in m_logs if l["status"] != "done")
+        else:
+            m.itens_completados = payload.itens_completados
+            m.itens_falhados = payload.itens_falhados
+        log_rows.extend(execlog.log_rows(
+            m.id, dev.user_id, now, [(it.frasco, it.quantidade_g) for it in m.itens], m_logs
+        ))
+        m.status = "done_partial" if m.itens_falhados > 0 else "done"  # alguns falharam / tudo ok
+
+    execlog.bulk_insert(db, log_rows)
+    rollups.registrar(db, log_rows)
 
     # ABATE ESTOQUE (apenas aqui, após confirmação de execução)
     stock_deducted = True
@@ -1208,43 +2078,117 @@ async def device_job_complete(
             )
             if cfg and cfg.estoque_g is not None:
                 cfg.estoque_g = max(0.0, float(cfg.estoque_g) - float(total_g))
+        _bump_rev(db, dev.user_id, "config_robo")
+        _atualizar_previsao(db, dev.user_id, consumo_por_frasco, now)
     except Exception as e:
         stock_deducted = False
         job.erro_msg = f"Falha ao abater estoque: {str(e)}"
         print(f"[ERROR] Falha ao abater estoque para job {job_id}: {e}")
 
+    # ===== BROADCAST VIA OUTBOX (mesma transação; o device não espera o envio) =====
+    outbox.enqueue(db, "stock_changed", {}, user_id=dev.user_id)
+    for m in membros:
+        outbox.enqueue(db, "job_completed", {
+            "status": m.status,
+            "device_id": dev.id,
+            "logs": logs_por_job.get(m.id, []),
+            "result": {
+                "ok": True,
+                "stock_deducted": stock_deducted,
+                "itens_completados": m.itens_completados,
+                "itens_falhados": m.itens_falhados,
+                "job_status": m.status,
+            },
+        }, user_id=dev.user_id, job_id=m.id)
+
     db.commit()
-    
-    # ===== BROADCAST WEBSOCKET (agora funciona em async endpoint) =====
-    print(f"[WS] Broadcasting logs do job {job_id} para clientes conectados...")
-    
-    # Broadcast de cada log entry
-    for log in payload.execution_logs:
-        await job_exec_manager.broadcast_log_entry(job_id, {
-            "frasco": log.frasco,
-            "tempero": log.tempero,
-            "quantidade_g": log.quantidade_g,
-            "segundos": log.segundos,
-            "status": log.status,
-            "error": log.error,
-        })
-    
-    # Broadcast de conclusão
-    await job_exec_manager.broadcast_completion(job_id, {
-        "ok": True,
-        "stock_deducted": stock_deducted,
-        "itens_completados": job.itens_completados,
-        "itens_falhados": job.itens_falhados,
-        "job_status": job.status,
-    })
-    
-    print(f"[WS] Broadcast concluído para job {job_id}")
+    outbox_dispatcher.wake()
     
     return schemas.JobCompleteOut(
         ok=True,
         stock_deducted=stock_deducted,
-        message="Job completado e estoque abatido" if stock_deducted else "Job registrado, mas houve erro ao abater estoque"
+        message="Job completado e estoque abatido" if stock_deducted else "Job registrado, mas houve erro ao abater estoque",
+        next_job_pending=_tem_job_na_fila(db, dev.user_id),
+    )
+
+@app.post("/devices/me/sync", response_model=schemas.DeviceSyncOut)
+def device_sync(
+    request: Request,
+    payload: schemas.DeviceSyncIn,
+    dev: models.Device = Depends(get_current_device),
+    db: Session = Depends(get_db),
+    caps: Set[str] = Depends(_device_caps),
+):
+    """
+    Uma requisição (um handshake TLS no ESP32) no lugar de heartbeat + next_job +
+    status/complete: aplica os acks e relatórios pendentes, registra a telemetria
+    e devolve o job a executar só se ele mudou, com o intervalo até o próximo sync.
+    """
+    resultados = []
+    for st in payload.status_jobs:
+        try:
+            device_job_status(st.job_id, schemas.JobStatusIn(status=st.status, error=st.error), dev, db)
+            resultados.append({"job_id": st.job_id, "ok": True})
+        except HTTPException as e:
+            db.rollback()
+            resultados.append({"job_id": st.job_id, "ok": False, "status_code": e.status_code, "detail": e.detail})
+    for rel in payload.relatorios:
+        try:
+            out = device_job_complete(
+                rel.job_id, schemas.JobCompleteIn(**rel.model_dump(exclude={"job_id"})), dev, db
+            )
+            resultados.append({"job_id": rel.job_id, "ok": out.ok, "detail": out.message})
+        except HTTPException as e:
+            db.rollback()
+            resultados.append({"job_id": rel.job_id, "ok": False, "status_code": e.status_code, "detail": e.detail})
+
+    _registrar_heartbeat(db, dev, payload.fw_version, payload.status)
+    job = _proximo_job_payload(db, dev, DEVICE_CAP_PLANO in caps)  # faz commit
+
+    changed = (job["id"] if job else None) != payload.job_atual_id
+    poll_ms = request.state.poll_hint_ms = _poll_hint(dev, job)
+    return {
+        "job": job if changed else None,
+        "job_changed": changed,
+        "resultados": resultados,
+        "poll_ms": poll_ms,
+    }
+
+
+def _emit_job_status(user_id: int, job_id: int, status_: str, **extra) -> None:
+    """Transição de estado do job para o tópico "jobs" do /ws/me."""
+    user_hub.emit(user_id, "jobs", "job_status", {"job_id": job_id, "status": status_, **extra})
+
+
+def _emit_stock(db: Session, user_id: int) -> None:
+    """Estoque atual por frasco para o tópico "stock" (só consulta se houver assinante)."""
+    if user_id not in user_hub.users():
+        return
+    rows = (
+        db.query(models.ReservatorioConfig.frasco, models.ReservatorioConfig.rotulo, models.ReservatorioConfig.estoque_g)
+        .filter(models.ReservatorioConfig.user_id == user_id)
+        .order_by(models.ReservatorioConfig.frasco.asc())
+        .all()
     )
+    user_hub.emit(user_id, "stock", "stock", {
+        "frascos": [{"frasco": f, "rotulo": r, "estoque_g": e} for f, r, e in rows],
+    })
+
+
+def _atualizar_previsao(db: Session, user_id: int, consumo_por_frasco: Dict[int, float], agora: datetime) -> None:
+    """Taxa de consumo + alertas de estoque baixo (outbox "low_stock"), na transação do abate."""
+    if consumo_por_frasco:
+        forecast.registrar_consumo(db, user_id, consumo_por_frasco, agora)
+    for alerta in forecast.avaliar_alertas(db, user_id, agora):
+        outbox.enqueue(db, "low_stock", alerta, user_id=user_id)
+
+
+def _tem_job_na_fila(db: Session, user_id: int) -> bool:
+    return db.query(
+        db.query(models.Job.id)
+        .filter(models.Job.user_id == user_id, models.Job.status == "queued")
+        .exists()
+    ).scalar()
 
 # ---------------------------------------------------------------------
 # Utilitários: devices do usuário e controle do job ativo
@@ -1256,8 +2200,20 @@ def _is_online(dev: models.Device) -> bool:
     except Exception:
         return False
 
+def _presence_rows(user_ids: List[int]) -> List[Tuple[int, int, bool]]:
+    """(device_id, user_id, online) dos devices destes usuários — para a varredura de presença."""
+    db = database.SessionLocal()
+    try:
+        rows = db.query(models.Device).filter(models.Device.user_id.in_(user_ids)).all()
+        return [(d.id, d.user_id, _is_online(d)) for d in rows]
+    finally:
+        db.close()
+
 def _list_user_devices(db: Session, user_id: int):
     rows = db.query(models.Device).filter(models.Device.user_id == user_id).all()
+    return _devices_payload(rows)
+
+def _devices_payload(rows: List[models.Device]) -> Dict:
     out: List[Dict] = []
     for d in rows:
         out.append({
@@ -1271,10 +2227,19 @@ def _list_user_devices(db: Session, user_id: int):
 
 @app.get("/me/devices")
 def my_devices(
+    request: Request,
+    response: Response,
     current: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    return _list_user_devices(db, current.id)
+    user_activity.touch(current.id)  # aba Execução / checagem antes de executar
+    rows = db.query(models.Device).filter(models.Device.user_id == current.id).all()
+    # last_seen muda a cada poll: a versão considera só online/offline e o minuto
+    etag = _etag("devices", current.id, *[
+        (d.id, d.uid, d.fw_version, _is_online(d), (iso_utc(d.last_seen) or "")[:16]) for d in rows
+    ])
+    _check_not_modified(request, response, etag)
+    return _devices_payload(rows)
 
 # Alias para compatibilidade: alguns front-ends chamam /devices
 @app.get("/devices")
@@ -1289,10 +2254,12 @@ def jobs_active(
     current: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
+    user_activity.touch(current.id)
+    # o que está com o robô (arrendado/rodando) vem antes do que ainda espera na fila
     job = (
         db.query(models.Job)
-        .filter(models.Job.user_id == current.id, models.Job.status.in_(("queued", "running")))
-        .order_by(models.Job.id.asc())
+        .filter(models.Job.user_id == current.id, models.Job.status.in_(ACTIVE_JOB_STATUSES))
+        .order_by((models.Job.status == "queued").asc(), models.Job.prioridade.desc(), models.Job.id.asc())
         .first()
     )
     if not job:
@@ -1306,20 +2273,228 @@ def cancel_active_job(
 ):
     jobs = (
         db.query(models.Job)
-        .filter(models.Job.user_id == current.id, models.Job.status.in_(("queued", "running")))
+        .filter(models.Job.user_id == current.id, models.Job.status.in_(ACTIVE_JOB_STATUSES))
         .all()
     )
     now = now_utc()
     count = 0
     for j in jobs:
-        j.status = "failed"
+        j.status = "canceled"
         j.finished_at = now
+        j.lease_until = None
         j.erro_msg = "cancelado pelo usuário"
         count += 1
     db.commit()
+    for j in jobs:
+        _emit_job_status(current.id, j.id, "canceled")
     return {"ok": True, "cancelled": count}
 
 
+JOBS_PAGE_MAX = 200
+
+
+@app.get("/jobs", response_model=schemas.JobHistoricoOut)
+def listar_jobs(
+    current: models.Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    status_: Optional[str] = Query(None, alias="status", description="Um status ou lista separada por vírgula"),
+    receita_id: Optional[int] = Query(None),
+    before: Optional[int] = Query(None, ge=1, description="Cursor: só jobs com id menor (next_before da página anterior)"),
+    limit: int = Query(50, ge=1, le=JOBS_PAGE_MAX),
+    expand: Optional[Literal["itens"]] = Query(None),
+):
+    """
+    Histórico de jobs, mais recentes primeiro, paginado por keyset (id < before)
+    sobre ix_jobs_user_id_desc: o custo de uma página não depende da profundidade.
+    """
+    # caminho rápido: tuplas em vez de ORM + resposta pronta (sem revalidar o response_model)
+    rows = (
+        db.query(
+            models.Job.id, models.Job.status, models.Job.receita_id, models.Receita.nome,
+            models.Job.pessoas_solicitadas, models.Job.prioridade, models.Job.created_at,
+            models.Job.started_at, models.Job.finished_at, models.Job.itens_completados,
+            models.Job.itens_falhados, models.Job.lote_id, models.Job.erro_msg,
+        )
+        .outerjoin(models.Receita, models.Receita.id == models.Job.receita_id)
+        .filter(models.Job.user_id == current.id)
+    )
+    if status_:
+        rows = rows.filter(models.Job.status.in_([s.strip() for s in status_.split(",") if s.strip()]))
+    if receita_id is not None:
+        rows = rows.filter(models.Job.receita_id == receita_id)
+    if before is not None:
+        rows = rows.filter(models.Job.id < before)
+    rows = rows.order_by(models.Job.id.desc()).limit(limit + 1).all()
+
+    mais = len(rows) > limit
+    rows = rows[:limit]
+    jobs = [
+        {
+            "id": r[0], "status": r[1], "receita_id": r[2], "receita_nome": r[3],
+            "pessoas_solicitadas": r[4], "prioridade": r[5], "created_at": r[6],
+            "started_at": r[7], "finished_at": r[8], "itens_completados": r[9],
+            "itens_falhados": r[10], "lote_id": r[11], "erro_msg": r[12],
+        }
+        for r in rows
+    ]
+    if expand == "itens" and jobs:
+        item_rows = (
+            db.query(
+                models.JobItem.job_id, models.JobItem.id, models.JobItem.ordem, models.JobItem.frasco,
+                models.JobItem.tempero, models.JobItem.quantidade_g, models.JobItem.segundos, models.JobItem.status,
+            )
+            .filter(models.JobItem.job_id.in_([j["id"] for j in jobs]))
+            .order_by(models.JobItem.job_id.asc(), models.JobItem.ordem.asc())
+            .all()
+        )
+        por_job = group_rows(item_rows)
+        for j in jobs:
+            j["itens"] = [
+                {"id": iid, "ordem": ordem, "frasco": frasco, "tempero": tempero,
+                 "quantidade_g": qtd, "segundos": seg, "status": st}
+                for _jid, iid, ordem, frasco, tempero, qtd, seg, st in por_job.get(j["id"], ())
+            ]
+    return fast_json({"jobs": jobs, "next_before": jobs[-1]["id"] if mais else None})
+
+
+@app.get("/jobs/fila", response_model=List[schemas.JobQueueItem])
+def job_queue(
+    current: models.Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Jobs ativos do usuário na ordem em que serão entregues ao(s) robô(s)."""
+    user_activity.touch(current.id)
+    rows = (
+        db.query(
+            models.Job.id, models.Job.status, models.Job.prioridade,
+            models.Job.receita_id, models.Job.pessoas_solicitadas, models.Job.created_at,
+        )
+        .filter(models.Job.user_id == current.id, models.Job.status.in_(ACTIVE_JOB_STATUSES))
+        .order_by((models.Job.status == "queued").asc(), models.Job.prioridade.desc(), models.Job.id.asc())
+        .all()
+    )
+    return [
+        {
+            "id": r[0], "posicao": i, "status": r[1], "prioridade": r[2],
+            "receita_id": r[3], "pessoas_solicitadas": r[4], "created_at": r[5],
+        }
+        for i, r in enumerate(rows, start=1)
+    ]
+
+
+@app.put("/jobs/{job_id}/prioridade", response_model=schemas.JobQueueItem)
+def set_job_priority(
+    job_id: int,
+    payload: schemas.JobPrioridadeIn,
+    current: models.Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    n = (
+        db.query(models.Job)
+        .filter(models.Job.id == job_id, models.Job.user_id == current.id, models.Job.status == "queued")
+        .update({models.Job.prioridade: payload.prioridade}, synchronize_session=False)
+    )
+    if not n:
+        raise HTTPException(status_code=409, detail="Só é possível repriorizar jobs que ainda estão na fila.")
+    db.commit()
+    fila = job_queue(current=current, db=db)
+    return next(item for item in fila if item["id"] == job_id)
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(
+    job_id: int,
+    current: models.Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Cancela um job que ainda não foi pego por um robô (libera a reserva de estoque)."""
+    n = (
+        db.query(models.Job)
+        .filter(models.Job.id == job_id, models.Job.user_id == current.id, models.Job.status == "queued")
+        .update(
+            {
+                models.Job.status: "canceled",
+                models.Job.finished_at: now_utc(),
+                models.Job.erro_msg: "cancelado pelo usuário",
+            },
+            synchronize_session=False,
+        )
+    )
+    if not n:
+        raise HTTPException(status_code=409, detail="Job não está na fila (já foi entregue ao robô ou finalizado).")
+    db.commit()
+    _emit_job_status(current.id, job_id, "canceled")
+    return {"ok": True}
+
+
+# (declarada depois de /jobs/active e /jobs/fila, senão elas casam como {job_id})
+@app.get("/jobs/{job_id}", response_model=schemas.JobOut)
+def obter_job(
+    job_id: int,
+    current: models.Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    job = (
+        db.query(models.Job)
+        .options(selectinload(models.Job.itens))
+        .filter(models.Job.id == job_id, models.Job.user_id == current.id)
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return _job_out_com_plano(db, job)
+
+
+# ---------------------------------------------------------------------
+# Estatísticas de consumo (rollups por hora/dia — backend/rollups.py)
+# ---------------------------------------------------------------------
+STATS_MAX_BUCKETS = {"hour": 24 * 31, "day": 366 * 2}
+
+
+@app.get("/stats/consumo", response_model=schemas.ConsumoOut)
+def stats_consumo(
+    desde: Optional[datetime] = Query(default=None, alias="from"),
+    ate: Optional[datetime] = Query(default=None, alias="to"),
+    bucket: Literal["hour", "day"] = Query(default="day"),
+    frasco: Optional[int] = Query(default=None, ge=1, le=4),
+    current: models.Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Consumo por (frasco, tempero) em baldes de hora ou dia (UTC), direto dos rollups.
+    Padrão: últimos 30 dias até agora. Intervalo limitado a STATS_MAX_BUCKETS baldes.
+    """
+    ate = _ensure_aware_utc(ate) or now_utc()
+    desde = _ensure_aware_utc(desde) or (ate - timedelta(days=30))
+    if desde > ate:
+        raise HTTPException(status_code=422, detail="'from' deve ser anterior a 'to'.")
+    passo = timedelta(hours=1) if bucket == "hour" else timedelta(days=1)
+    if (ate - desde) / passo > STATS_MAX_BUCKETS[bucket]:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Intervalo grande demais para bucket={bucket} (máx. {STATS_MAX_BUCKETS[bucket]} baldes).",
+        )
+
+    series, totais = [], {}
+    for r in rollups.consultar(db, current.id, bucket, desde, ate, frasco):
+        series.append({
+            "inicio": _ensure_aware_utc(r.inicio), "frasco": r.frasco, "tempero": r.tempero,
+            "gramas": round(r.gramas, 2), "doses": r.doses, "falhas": r.falhas,
+        })
+        t = totais.setdefault((r.frasco, r.tempero), {
+            "frasco": r.frasco, "tempero": r.tempero, "gramas": 0.0, "doses": 0, "falhas": 0,
+        })
+        t["gramas"] += r.gramas
+        t["doses"] += r.doses
+        t["falhas"] += r.falhas
+    for t in totais.values():
+        t["gramas"] = round(t["gramas"], 2)
+    return {
+        "bucket": bucket, "desde": desde, "ate": ate,
+        "series": series, "totais": sorted(totais.values(), key=lambda t: (t["frasco"], t["tempero"])),
+    }
+
+
 # =====================================================================
 # WebSocket: Monitorar execução de jobs em tempo real
 # =====================================================================
@@ -1333,8 +2508,11 @@ async def websocket_job_monitor(
     WebSocket para monitorar execução de job em tempo real.
     
     O cliente (frontend) conecta e recebe updates:
-    - { type: "execution_log_entry", data: {frasco, status, ms, error}, timestamp }
-    - { type: "execution_complete", data: {ok, stock_deducted, itens_completados, ...}, timestamp }
+    - { seq, type: "execution_log_entry", data: {frasco, status, ms, error}, timestamp }
+    - { seq, type: "execution_complete", data: {ok, stock_deducted, itens_completados, ...}, timestamp }
+
+    `?since=<seq>`: reenvia primeiro os eventos com seq maior ainda no buffer
+    (0 = linha do tempo inteira), depois segue ao vivo.
     
     Autenticação: Opcional via cookie, validação de ownership do job
     """
@@ -1343,11 +2521,13 @@ async def websocket_job_monitor(
     token = websocket.cookies.get(COOKIE_NAME)
     if token:
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = _decode_token(token)
             uid = int(payload.get("sub"))
             current_user = db.query(models.Usuario).filter(models.Usuario.id == uid).first()
-        except (JWTError, ValueError, TypeError):
+        except (ValueError, TypeError):
             pass
+    if current_user:
+        user_activity.touch(current_user.id)  # acompanhando a execução
     
     # SEMPRE aceita a conexão primeiro (obrigatório)
     await websocket.accept()
@@ -1370,14 +2550,20 @@ async def websocket_job_monitor(
             await websocket.close(code=4003, reason="Job not owned by this user")
             return
     
-    # Conecta ao manager
-    print(f"[WS] Conectando job {job_id} ao manager")
-    await job_exec_manager.connect(job_id, websocket)
+    # Conecta ao manager (com ?since=<seq>, reenvia o que o cliente perdeu)
+    since = _to_int_or_none(websocket.query_params.get("since"))
+    job_user_id = job.user_id  # teto de conexões conta para o dono do job
+    db.close()  # a conexão pode durar minutos: não segura sessão
+    print(f"[WS] Conectando job {job_id} ao manager (since={since})")
+    if not await job_exec_manager.connect(job_id, websocket, job_user_id, since=since):
+        await websocket.close(code=CLOSE_TOO_MANY, reason="Too many connections")
+        return
     
     try:
         # Mantém conexão aberta, aguardando heartbeat/ping
         while True:
             data = await websocket.receive_text()
+            ws_registry.touch(websocket)
             if data and data.strip().lower() == "ping":
                 await websocket.send_json({"type": "pong"})
     except WebSocketDisconnect:
@@ -1387,6 +2573,159 @@ async def websocket_job_monitor(
         await job_exec_manager.disconnect(job_id, websocket)
 
 
+SSE_KEEPALIVE_SEC = 15.0
+
+
+def _sse_format(event: dict) -> str:
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events_stream(
+    job_id: int,
+    request: Request,
+    since: Optional[int] = Query(default=None, ge=0),
+    last_event_id: Optional[str] = Header(default=None),
+    current: models.Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Server-Sent Events com os mesmos eventos do /ws/jobs/{id} (mesmo log e fan-out),
+    para redes cujo proxy derruba o upgrade de WebSocket.
+
+    Retomada: header Last-Event-ID (o EventSource manda sozinho ao reconectar) ou
+    ?since=<seq>; sem nenhum dos dois, a linha do tempo inteira ainda em memória.
+    O stream termina após execution_complete.
+    """
+    job = db.query(models.Job).filter(models.Job.id == job_id, models.Job.user_id == current.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    final = None
+    if job.status not in ACTIVE_JOB_STATUSES:
+        final = {
+            "ok": job.status in ("done", "done_partial"),
+            "itens_completados": job.itens_completados,
+            "itens_falhados": job.itens_falhados,
+            "job_status": job.status,
+            "error": job.erro_msg,
+        }
+    db.close()  # o stream pode durar minutos: não segura sessão
+    user_activity.touch(current.id)
+
+    desde = _to_int_or_none(last_event_id) if last_event_id else since
+    queue, perdidos = job_exec_manager.subscribe_stream(job_id, desde if desde is not None else 0)
+    ultimo = job_exec_manager.events.last_seq(job_id)
+    if final is not None and last_event_id and not perdidos and ultimo is not None and desde >= ultimo:
+        # reconexão de quem já viu a conclusão: 204 faz o EventSource parar de reconectar
+        job_exec_manager.unsubscribe_stream(job_id, queue)
+        return Response(status_code=204)
+
+    async def _stream():
+        try:
+            yield "retry: 3000\n\n"
+            for event in perdidos:
+                yield _sse_format(event)
+                if event["type"] == "execution_complete":
+                    return
+            if final is not None:
+                # já terminou e o buffer não tem a conclusão (ex.: reinício): resume do banco
+                yield f"event: execution_complete\ndata: {json.dumps({'type': 'execution_complete', 'data': final})}\n\n"
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SEC)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse_format(event)
+                if event["type"] == "execution_complete":
+                    return
+        finally:
+            job_exec_manager.unsubscribe_stream(job_id, queue)
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/ws/me")
+async def websocket_user_channel(websocket: WebSocket, db: Session = Depends(get_db)):
+    """
+    Canal único por aba: eventos do usuário logado (cookie) nos tópicos pedidos.
+
+    `?topics=devices,jobs,progress,stock` (padrão: todos). Mensagens do cliente:
+    "ping" → {"type": "pong"}; {"subscribe": [...]} / {"unsubscribe": [...]}.
+    Ao conectar recebe {"type": "hello", "data": {"topics": [...], "devices": {...}}}
+    com o snapshot de devices (mesmo formato de /me/devices).
+    """
+    uid = None
+    token = websocket.cookies.get(COOKIE_NAME)
+    if token:
+        try:
+            uid = int(_decode_token(token).get("sub"))
+        except (ValueError, TypeError):
+            uid = None
+    await websocket.accept()
+    if uid is None:
+        await websocket.close(code=4401, reason="Not authenticated")
+        return
+
+    conn = ws_registry.register(websocket, uid)
+    if conn is None:
+        await websocket.close(code=CLOSE_TOO_MANY, reason="Too many connections")
+        return
+
+    pedidos = websocket.query_params.get("topics")
+    topics = [t.strip() for t in pedidos.split(",")] if pedidos else list(TOPICS)
+    sub = user_hub.subscribe(uid, topics)
+    user_activity.touch(uid)
+    snapshot = _list_user_devices(db, uid)
+    for d in snapshot["devices"]:
+        device_presence.seed(d["id"], d["online"])
+    db.close()  # a conexão pode durar horas: não segura sessão
+
+    async def _writer():
+        while True:
+            event = await sub.queue.get()
+            async with conn.lock:  # divide o socket com o ping do liveness
+                await websocket.send_json(event)
+
+    async def _reader():
+        while True:
+            msg = await websocket.receive_text()
+            ws_registry.touch(websocket)
+            if msg.strip().lower() == "ping":
+                await websocket.send_json({"type": "pong"})
+                continue
+            try:
+                cmd = json.loads(msg)
+            except ValueError:
+                continue
+            if isinstance(cmd, dict):
+                sub.topics |= {t for t in cmd.get("subscribe", []) if t in TOPICS}
+                sub.topics -= set(cmd.get("unsubscribe", []))
+
+    try:
+        await websocket.send_json({"type": "hello", "data": {"topics": sorted(sub.topics), "devices": snapshot}})
+        tasks = [asyncio.create_task(_writer()), asyncio.create_task(_reader())]
+        try:
+            done, _pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                t.exception()  # desconexão do cliente: só encerra
+        finally:
+            for t in tasks:
+                t.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        user_hub.unsubscribe(sub)
+        ws_registry.unregister(websocket)
+
+
 # =====================================================================
 # TESTING: Mock ESP32 Execution Simulator
 # =====================================================================
@@ -1421,7 +2760,7 @@ async def test_simulate_esp32_execution(
     if not job:
         raise HTTPException(status_code=404, detail="Job não encontrado")
     
-    if job.status not in ("queued", "running"):
+    if job.status not in ACTIVE_JOB_STATUSES:
         raise HTTPException(status_code=400, detail=f"Job está em status {job.status}")
     
     # Prepara itens para simulação
@@ -0,0 +1,367 @@
+"""
+Migrações versionadas do schema (SQLite e PostgreSQL).
+
+Cada migração tem um número de versão e uma função que recebe a conexão;
+cada uma roda (e é registrada) na sua própria transação. As versões aplicadas ficam registradas na
+tabela `schema_migrations`, então cada passo roda uma única vez por banco.
+
+Regras para escrever migrações:
+  - usar DDL do SQLAlchemy (compila para o dialeto do banco em uso);
+  - ser idempotente (IF NOT EXISTS / checar coluna antes de adicionar),
+    porque bancos antigos — criados pelo create_all do startup — podem já
+    ter parte do schema.
+
+Banco novo (sem tabelas): cria o schema atual via metadata e marca todas as
+versões como aplicadas, sem rodar passo a passo.
+
+Uso:
+  python -m backend.migrate            # aplica pendentes
+  python -m backend.migrate current    # mostra versão atual / head
+"""
+import json
+import sys
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from . import execlog, models
+
+# Tabela de controle fica fora do Base.metadata (não é um modelo da aplicação)
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _meta,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(120), nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+# chave arbitrária para o advisory lock do Postgres (vários workers subindo juntos)
+_PG_LOCK_KEY = 7_420_026
+
+Migration = Tuple[int, str, Callable[[Connection], None]]
+
+
+# ---------------------------------------------------------------------
+# Helpers de DDL portáveis
+# ---------------------------------------------------------------------
+def _add_column_if_missing(
+    conn: Connection, table: str, column_name: str, ddl: Optional[str] = None
+) -> None:
+    """
+    Adiciona ao banco a coluna declarada no modelo, se ainda não existir.
+    `ddl` sobrescreve a definição gerada (ex.: NOT NULL precisa de DEFAULT no SQLite).
+    """
+    existentes = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column_name in existentes:
+        return
+    if ddl is None:
+        col = models.Base.metadata.tables[table].c[column_name]
+        ddl = str(CreateColumn(col).compile(dialect=conn.dialect))
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {ddl}"))
+
+
+def _create_indexes(conn: Connection, *names: str) -> None:
+    """Cria (IF NOT EXISTS) índices declarados em models.py, buscando pelo nome."""
+    por_nome = {
+        ix.name: ix
+        for t in models.Base.metadata.tables.values()
+        for ix in t.indexes
+    }
+    for name in names:
+        conn.execute(CreateIndex(por_nome[name], if_not_exists=True))
+
+
+# ---------------------------------------------------------------------
+# Migrações (em ordem; nunca renumerar versões já publicadas)
+# ---------------------------------------------------------------------
+def _m001_baseline(conn: Connection) -> None:
+    # bancos legados: tabelas que o create_all do startup criaria
+    models.Base.metadata.create_all(bind=conn, checkfirst=True)
+
+
+def _m002_porcoes_pessoas(conn: Connection) -> None:
+    # equivalente portável de backend/migrations/001_add_porcoes_pessoas.sql
+    _add_column_if_missing(conn, "receitas", "porcoes", "porcoes INTEGER NOT NULL DEFAULT 1")
+    _add_column_if_missing(
+        conn, "jobs", "pessoas_solicitadas", "pessoas_solicitadas INTEGER NOT NULL DEFAULT 1"
+    )
+    conn.execute(text(
+        "UPDATE jobs SET pessoas_solicitadas = multiplicador "
+        "WHERE pessoas_solicitadas = 1 AND multiplicador > 1"
+    ))
+
+
+def _m003_performance_indexes(conn: Connection) -> None:
+    _create_indexes(
+        conn,
+        "ix_jobs_user_status_id",
+        "ix_reservatorio_user_rotulo_lower",
+        "ix_device_claims_code_unused",
+        "ix_ingredientes_receita_tempero",
+    )
+
+
+def _m004_resource_revisions(conn: Connection) -> None:
+    models.ResourceRevision.__table__.create(bind=conn, checkfirst=True)
+
+
+def _m005_job_leases(conn: Connection) -> None:
+    _add_column_if_missing(conn, "jobs", "device_id")
+    _add_column_if_missing(conn, "jobs", "lease_until")
+    _create_indexes(conn, "ix_jobs_device_status")
+
+
+def _m006_job_queue_priority(conn: Connection) -> None:
+    _add_column_if_missing(conn, "jobs", "prioridade", "prioridade INTEGER NOT NULL DEFAULT 0")
+    _create_indexes(conn, "ix_jobs_user_status_prio")
+
+
+def _m007_job_coalescing(conn: Connection) -> None:
+    _add_column_if_missing(
+        conn, "motor_config", "coalesce_max_jobs", "coalesce_max_jobs INTEGER NOT NULL DEFAULT 1"
+    )
+    _add_column_if_missing(conn, "jobs", "lote_id", "lote_id INTEGER REFERENCES jobs(id) ON DELETE SET NULL")
+    _create_indexes(conn, "ix_jobs_lote_id")
+
+
+def _m008_parallel_dispense(conn: Connection) -> None:
+    _add_column_if_missing(
+        conn, "motor_config", "max_servos_simultaneos", "max_servos_simultaneos INTEGER NOT NULL DEFAULT 1"
+    )
+    _add_column_if_missing(
+        conn, "motor_config", "servo_current_ma", "servo_current_ma INTEGER NOT NULL DEFAULT 250"
+    )
+    _add_column_if_missing(conn, "motor_config", "power_budget_ma")
+
+
+def _m009_idempotency_keys(conn: Connection) -> None:
+    models.IdempotencyKey.__table__.create(bind=conn, checkfirst=True)
+
+
+def _m010_outbox_events(conn: Connection) -> None:
+    models.OutboxEvent.__table__.create(bind=conn, checkfirst=True)
+
+
+BACKFILL_CHUNK = 500
+
+
+def _m011_job_execution_log(conn: Connection) -> None:
+    models.JobExecutionLog.__table__.create(bind=conn, checkfirst=True)
+
+    # backfill a partir dos blobs de Job.execution_report, em blocos por id
+    # (nunca carrega a tabela de jobs inteira); jobs já presentes no log são pulados
+    jobs = models.Job.__table__
+    itens = models.JobItem.__table__
+    log = models.JobExecutionLog.__table__
+    ultimo_id = 0
+    while True:
+        bloco = conn.execute(
+            select(jobs.c.id, jobs.c.user_id, jobs.c.finished_at, jobs.c.created_at, jobs.c.execution_report)
+            .where(
+                jobs.c.id > ultimo_id,
+                jobs.c.execution_report.is_not(None),
+                ~select(log.c.id).where(log.c.job_id == jobs.c.id).exists(),
+            )
+            .order_by(jobs.c.id)
+            .limit(BACKFILL_CHUNK)
+        ).all()
+        if not bloco:
+            break
+        ultimo_id = bloco[-1].id
+        pedidos = {}
+        for job_id, frasco, qtd in conn.execute(
+            select(itens.c.job_id, itens.c.frasco, itens.c.quantidade_g)
+            .where(itens.c.job_id.in_([j.id for j in bloco]))
+            .order_by(itens.c.job_id, itens.c.ordem)
+        ):
+            pedidos.setdefault(job_id, []).append((frasco, qtd))
+        rows = []
+        for j in bloco:
+            try:
+                logs = json.loads(j.execution_report)
+            except ValueError:
+                continue
+            if not isinstance(logs, list):
+                continue
+            logs = [l for l in logs if isinstance(l, dict) and l.get("frasco") is not None]
+            rows.extend(execlog.log_rows(j.id, j.user_id, j.finished_at or j.created_at, pedidos.get(j.id, []), logs))
+        execlog.bulk_insert(conn, rows)
+
+
+def _m012_consumo_rollups(conn: Connection) -> None:
+    models.ConsumoHora.__table__.create(bind=conn, checkfirst=True)
+    models.ConsumoDia.__table__.create(bind=conn, checkfirst=True)
+    _execlog_consumo(conn)  # rebuild_conn lê consumo_g (coluna da migração 16)
+    from .rollups import rebuild_conn
+    rebuild_conn(conn)  # histórico já normalizado pela migração 11
+
+
+def _m013_previsao_estoque(conn: Connection) -> None:
+    models.PrevisaoEstoque.__table__.create(bind=conn, checkfirst=True)
+    from .forecast import semear_de_rollups
+    if conn.execute(select(func.count()).select_from(models.PrevisaoEstoque.__table__)).scalar() == 0:
+        semear_de_rollups(conn, datetime.now(timezone.utc))
+
+
+def _m014_calibracao(conn: Connection) -> None:
+    models.Pesagem.__table__.create(bind=conn, checkfirst=True)
+    models.Calibracao.__table__.create(bind=conn, checkfirst=True)
+    _add_column_if_missing(
+        conn, "motor_config", "calibracao_auto", "calibracao_auto BOOLEAN NOT NULL DEFAULT FALSE"
+    )
+
+
+def _m015_job_history_index(conn: Connection) -> None:
+    _create_indexes(conn, "ix_jobs_user_id_desc")
+
+
+def _execlog_consumo(conn: Connection) -> None:
+    """Coluna consumo_g do job_execution_log, preenchida com a quantidade reportada (idempotente)."""
+    if "consumo_g" in {c["name"] for c in inspect(conn).get_columns("job_execution_log")}:
+        return
+    _add_column_if_missing(conn, "job_execution_log", "consumo_g", "consumo_g FLOAT NOT NULL DEFAULT 0")
+    log = models.JobExecutionLog.__table__
+    conn.execute(
+        log.update()
+        .where(log.c.status == "done", log.c.quantidade_real_g.is_not(None))
+        .values(consumo_g=log.c.quantidade_real_g)
+    )
+
+
+def _m016_execlog_consumo(conn: Connection) -> None:
+    _execlog_consumo(conn)
+
+
+def _m017_execlog_medido(conn: Connection) -> None:
+    # linhas antigas ficam False: nenhum firmware até aqui reportava medição
+    _add_column_if_missing(conn, "job_execution_log", "medido", "medido BOOLEAN NOT NULL DEFAULT FALSE")
+
+
+MIGRATIONS: List[Migration] = [
+    (1, "baseline", _m001_baseline),
+    (2, "porcoes_pessoas", _m002_porcoes_pessoas),
+    (3, "performance_indexes", _m003_performance_indexes),
+    (4, "resource_revisions", _m004_resource_revisions),
+    (5, "job_leases", _m005_job_leases),
+    (6, "job_queue_priority", _m006_job_queue_priority),
+    (7, "job_coalescing", _m007_job_coalescing),
+    (8, "parallel_dispense", _m008_parallel_dispense),
+    (9, "idempotency_keys", _m009_idempotency_keys),
+    (10, "outbox_events", _m010_outbox_events),
+    (11, "job_execution_log", _m011_job_execution_log),
+    (12, "consumo_rollups", _m012_consumo_rollups),
+    (13, "previsao_estoque", _m013_previsao_estoque),
+    (14, "calibracao", _m014_calibracao),
+    (15, "job_history_index", _m015_job_history_index),
+    (16, "execlog_consumo", _m016_execlog_consumo),
+    (17, "execlog_medido", _m017_execlog_medido),
+]
+
+HEAD_VERSION = MIGRATIONS[-1][0]
+
+
+# ---------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------
+def _applied_versions(conn: Connection) -> set:
+    return {row[0] for row in conn.execute(select(schema_migrations.c.version))}
+
+
+def _record(conn: Connection, version: int, name: str) -> None:
+    conn.execute(
+        schema_migrations.insert().values(
+            version=version, name=name, applied_at=datetime.now(timezone.utc)
+        )
+    )
+
+
+def current_version(engine: Engine) -> Optional[int]:
+    """Maior versão aplicada (None se o banco ainda não tem controle de versão)."""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(schema_migrations.name):
+            return None
+        return conn.execute(select(schema_migrations.c.version).order_by(
+            schema_migrations.c.version.desc()
+        ).limit(1)).scalar()
+
+
+def verify(engine: Engine) -> int:
+    """
+    Checagem rápida para o startup: uma única consulta à schema_migrations.
+    Levanta RuntimeError se o banco não estiver no head (rode `python -m backend.migrate`).
+    """
+    with engine.connect() as conn:
+        try:
+            version = conn.execute(select(func.max(schema_migrations.c.version))).scalar()
+        except DBAPIError:
+            version = None
+    if version is None or version < HEAD_VERSION:
+        raise RuntimeError(
+            f"Schema desatualizado (versão {version}, esperado {HEAD_VERSION}). "
+            "Execute: python -m backend.migrate"
+        )
+    return version
+
+
+def upgrade(engine: Engine) -> List[int]:
+    """Aplica migrações pendentes. Retorna as versões aplicadas nesta chamada."""
+    aplicadas_agora: List[int] = []
+    with engine.connect() as conn:
+        pg = conn.dialect.name == "postgresql"
+        if pg:
+            # serializa workers subindo ao mesmo tempo (lock de sessão)
+            conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _PG_LOCK_KEY})
+            conn.commit()
+        try:
+            banco_novo = not inspect(conn).has_table("usuarios")
+            schema_migrations.create(bind=conn, checkfirst=True)
+
+            if banco_novo:
+                # schema atual completo (inclui índices) + marca tudo como aplicado
+                models.Base.metadata.create_all(bind=conn)
+                for version, name, _fn in MIGRATIONS:
+                    _record(conn, version, name)
+                conn.commit()
+                return [v for v, _n, _f in MIGRATIONS]
+            conn.commit()
+
+            feitas = _applied_versions(conn)
+            for version, name, fn in MIGRATIONS:
+                if version in feitas:
+                    continue
+                # uma transação por migração: falha no meio não deixa versão "meio aplicada"
+                try:
+                    fn(conn)
+                    _record(conn, version, name)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                aplicadas_agora.append(version)
+                print(f"[MIGRATE] {version:03d}_{name} aplicada")
+        finally:
+            if pg:
+                conn.rollback()
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _PG_LOCK_KEY})
+                conn.commit()
+
+    return aplicadas_agora
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if cmd == "current":
+        print(f"versão atual: {current_version(engine)} | head: {HEAD_VERSION}")
+    elif cmd == "upgrade":
+        feitas = upgrade(engine)
+        print(f"✅ {len(feitas)} migração(ões) aplicada(s); head = {HEAD_VERSION}")
+    else:
+        print(f"Comando desconhecido: {cmd} (use: upgrade | current)")
+        sys.exit(2)
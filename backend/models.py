@@ -5,8 +5,11 @@ from sqlalchemy import (
     Float,
     ForeignKey,
     UniqueConstraint,
+    Index,
     DateTime,
     Text,
+    LargeBinary,
+    Boolean,
     func,
 )
 from sqlalchemy.orm import relationship
@@ -116,6 +119,17 @@ class MotorConfig(Base):
     # Timeout de segurança (segundos)
     max_runtime_sec = Column(Integer, nullable=False, default=300)  # 5 minutos
 
+    # Coalescência: quantos jobs da fila o device pode juntar numa execução (1 = desligado)
+    coalesce_max_jobs = Column(Integer, nullable=False, default=1, server_default="1")
+
+    # Dispensa paralela: servos abertos ao mesmo tempo (1 = sequencial) e orçamento de corrente
+    max_servos_simultaneos = Column(Integer, nullable=False, default=1, server_default="1")
+    servo_current_ma = Column(Integer, nullable=False, default=250, server_default="250")
+    power_budget_ma = Column(Integer, nullable=True)  # None = sem limite além do número de servos
+
+    # Calibração: aplica sozinho o g_por_seg sugerido quando o intervalo de confiança é estreito
+    calibracao_auto = Column(Boolean, nullable=False, default=False, server_default="0")
+
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
     dono = relationship("Usuario", backref="motor_config")
@@ -161,12 +175,15 @@ class Job(Base):
     user_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), index=True, nullable=False)
     receita_id = Column(Integer, ForeignKey("receitas.id", ondelete="SET NULL"), nullable=True, index=True)
 
-    status = Column(String(20), nullable=False, default="queued", index=True)  # queued|running|done|failed|canceled
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued|leased|running|done|failed|canceled
     multiplicador = Column(Integer, nullable=False, default=1)  # DEPRECATED: usar pessoas_solicitadas
     
     # Escalamento baseado em porções
     pessoas_solicitadas = Column(Integer, nullable=False, default=1)  # Para quantas pessoas executar
 
+    # Fila por usuário: maior prioridade sai primeiro; empate pela ordem de criação (id)
+    prioridade = Column(Integer, nullable=False, default=0, server_default="0")
+
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     started_at = Column(DateTime, nullable=True)
     finished_at = Column(DateTime, nullable=True)
@@ -174,10 +191,17 @@ class Job(Base):
     # ===== NOVAS COLUNAS para offline-first model =====
     itens_completados = Column(Integer, nullable=True)   # quantos itens completaram com sucesso
     itens_falhados = Column(Integer, nullable=True)      # quantos falharam
-    execution_report = Column(Text, nullable=True)       # JSON array com log per-frasco
+    execution_report = Column(Text, nullable=True)       # legado: JSON per-frasco (hoje em job_execution_log)
     # =================================================
 
-    # futuro: device_id/mac, logs etc.
+    # Lease: qual dispositivo pegou o job e até quando (renovado pelo heartbeat)
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="SET NULL"), nullable=True)
+    lease_until = Column(DateTime(timezone=True), nullable=True)
+
+    # Coalescência: jobs entregues juntos numa única execução apontam para o job líder
+    # (o próprio líder inclusive); o device só conhece o id do líder
+    lote_id = Column(Integer, ForeignKey("jobs.id", ondelete="SET NULL"), nullable=True, index=True)
+
     erro_msg = Column(String(255), nullable=True)
 
     dono = relationship("Usuario", back_populates="jobs")
@@ -211,3 +235,183 @@ class JobItem(Base):
     erro_msg = Column(String(255), nullable=True)
 
     job = relationship("Job", back_populates="itens")
+
+
+class JobExecutionLog(Base):
+    """Resultado por frasco de cada execução (antes só no JSON de Job.execution_report)."""
+    __tablename__ = "job_execution_log"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id", ondelete="CASCADE"), index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), nullable=False)
+    frasco = Column(Integer, nullable=False)
+    tempero = Column(String(60), nullable=False)
+    quantidade_pedida_g = Column(Float, nullable=True)  # do JobItem (None se não casou)
+    quantidade_real_g = Column(Float, nullable=True)    # reportada pelo device; None se falhou ou não reportou
+    # gramas abatidas do estoque: a reportada ou, sem relatório (status "done"), a pedida
+    consumo_g = Column(Float, nullable=False, default=0.0, server_default="0")
+    # quantidade_real_g veio de medição no device (ExecutionLogEntry.medido); só estas calibram
+    medido = Column(Boolean, nullable=False, default=False, server_default="0")
+    segundos = Column(Float, nullable=True)
+    status = Column(String(20), nullable=False)         # done|failed
+    error = Column(String(255), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=False)
+
+
+# =========================
+# Rollups de consumo (mantidos na conclusão do job; ver backend/rollups.py)
+# =========================
+class ConsumoHora(Base):
+    __tablename__ = "consumo_hora"
+
+    user_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), primary_key=True)
+    inicio = Column(DateTime(timezone=True), primary_key=True)  # início do balde (UTC)
+    frasco = Column(Integer, primary_key=True)
+    tempero = Column(String(60), primary_key=True)
+    gramas = Column(Float, nullable=False, default=0.0)
+    doses = Column(Integer, nullable=False, default=0)   # entradas "done"
+    falhas = Column(Integer, nullable=False, default=0)  # entradas "failed"
+
+
+class ConsumoDia(Base):
+    __tablename__ = "consumo_dia"
+
+    user_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), primary_key=True)
+    inicio = Column(DateTime(timezone=True), primary_key=True)
+    frasco = Column(Integer, primary_key=True)
+    tempero = Column(String(60), primary_key=True)
+    gramas = Column(Float, nullable=False, default=0.0)
+    doses = Column(Integer, nullable=False, default=0)
+    falhas = Column(Integer, nullable=False, default=0)
+
+
+class PrevisaoEstoque(Base):
+    """Taxa de consumo (média exponencial, g/dia) por frasco; ver backend/forecast.py."""
+    __tablename__ = "previsao_estoque"
+
+    user_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), primary_key=True)
+    frasco = Column(Integer, primary_key=True)
+    rotulo = Column(String(80), nullable=True)  # tempero a que a taxa se refere
+    taxa_g_dia = Column(Float, nullable=False, default=0.0)
+    atualizado_em = Column(DateTime(timezone=True), nullable=True)
+    alerta_ativo = Column(Boolean, nullable=False, default=False, server_default="0")
+
+
+# =========================
+# Calibração de g_por_seg (ver backend/calibration.py)
+# =========================
+class Pesagem(Base):
+    """Pesagem manual: o frasco rodou `segundos` e a balança mediu `gramas`."""
+    __tablename__ = "pesagens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), nullable=False)
+    frasco = Column(Integer, nullable=False)
+    rotulo = Column(String(80), nullable=True)  # tempero no frasco na hora da pesagem
+    segundos = Column(Float, nullable=False)
+    gramas = Column(Float, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class Calibracao(Base):
+    __tablename__ = "calibracao"
+
+    user_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), primary_key=True)
+    frasco = Column(Integer, primary_key=True)
+    rotulo = Column(String(80), nullable=True)
+    g_por_seg_atual = Column(Float, nullable=True)
+    g_por_seg_sugerido = Column(Float, nullable=True)
+    ic_min = Column(Float, nullable=True)
+    ic_max = Column(Float, nullable=True)
+    amostras = Column(Integer, nullable=False, default=0)
+    fonte = Column(String(20), nullable=True)   # pesagem|execucao
+    status = Column(String(20), nullable=False)  # ok|proposta|aplicada|insuficiente
+    calculado_em = Column(DateTime(timezone=True), nullable=False)
+
+
+# =========================
+# Revisões por (usuário, recurso) — base do ETag/GET condicional
+# =========================
+class ResourceRevision(Base):
+    __tablename__ = "resource_revisions"
+
+    user_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), primary_key=True)
+    resource = Column(String(40), primary_key=True)  # receitas|config_robo|config_motor
+    rev = Column(Integer, nullable=False, default=0)
+
+
+# =========================
+# Idempotency-Key: resposta guardada por (identidade, chave) até expirar
+# =========================
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String(40), primary_key=True)   # "user:<id>" | "dev:<id>"
+    key = Column(String(100), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)  # sha256(método + path + corpo)
+    status_code = Column(Integer, nullable=False)
+    content_type = Column(String(100), nullable=False)
+    body = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class OutboxEvent(Base):
+    """Efeito colateral gravado na transação do job; o OutboxDispatcher entrega e apaga."""
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(40), nullable=False)
+    user_id = Column(Integer, nullable=True)
+    job_id = Column(Integer, nullable=True)
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    available_at = Column(DateTime(timezone=True), nullable=False)  # próxima tentativa / fim da reivindicação
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    claimed_by = Column(String(32), nullable=True)
+    last_error = Column(String(300), nullable=True)
+    dead = Column(Boolean, nullable=False, default=False, server_default="0")
+
+
+# =========================
+# Índices compostos/parciais (padrões de acesso da API)
+#  - criados pelo create_all em bancos novos e pela migração 3 em bancos existentes
+# =========================
+# fila do usuário: "job ativo" / próximo job por status, em ordem de id
+Index("ix_jobs_user_status_id", Job.user_id, Job.status, Job.id)
+
+# mapeamento tempero -> frasco (comparação case-insensitive do rótulo)
+Index(
+    "ix_reservatorio_user_rotulo_lower",
+    ReservatorioConfig.user_id,
+    func.lower(ReservatorioConfig.rotulo),
+)
+
+# histórico (GET /jobs): paginação por keyset, mais recentes primeiro
+Index("ix_jobs_user_id_desc", Job.user_id, Job.id.desc())
+
+# fila: próximo job do usuário por prioridade e ordem de chegada
+Index("ix_jobs_user_status_prio", Job.user_id, Job.status, Job.prioridade.desc(), Job.id)
+
+# lease: re-entrega ao mesmo device e renovação no heartbeat
+Index("ix_jobs_device_status", Job.device_id, Job.status)
+
+# claim de dispositivo: só interessam códigos ainda não usados
+Index(
+    "ix_device_claims_code_unused",
+    DeviceClaim.code,
+    sqlite_where=DeviceClaim.used_at.is_(None),
+    postgresql_where=DeviceClaim.used_at.is_(None),
+)
+
+# catálogo/mapeamento: temperos de uma receita
+Index("ix_ingredientes_receita_tempero", IngredienteReceita.receita_id, IngredienteReceita.tempero)
+
+# consumo/falhas/tempo por frasco ao longo do tempo
+Index("ix_job_exec_log_user_frasco_fin", JobExecutionLog.user_id, JobExecutionLog.frasco, JobExecutionLog.finished_at)
+
+# calibração: pesagens recentes do frasco
+Index("ix_pesagens_user_frasco_created", Pesagem.user_id, Pesagem.frasco, Pesagem.created_at)
+
+# outbox: pendentes em ordem de disponibilidade
+Index("ix_outbox_pending", OutboxEvent.dead, OutboxEvent.available_at, OutboxEvent.id)
@@ -0,0 +1,244 @@
+"""
+Outbox transacional para os efeitos colaterais da conclusão de um job.
+
+A rota grava o evento (`enqueue`) na mesma transação que atualiza o job e
+o estoque; depois do commit só acorda o dispatcher e responde — o ESP32
+espera um commit, não o broadcast. Se o processo cair entre o commit e o
+envio, o evento continua na tabela e sai no próximo ciclo.
+
+OutboxDispatcher (tarefa asyncio):
+  - reivindica um lote (até OUTBOX_BATCH) com UPDATE condicional em
+    `available_at`/`claimed_by`, como o reaper: vários workers não entregam
+    o mesmo evento ao mesmo tempo;
+  - chama, em ordem de id, todos os handlers registrados para o `kind`;
+  - sucesso → apaga a linha; falha → attempts+1 e nova tentativa com
+    backoff exponencial; após OUTBOX_MAX_ATTEMPTS fica `dead` (só
+    inspeção). Falhou um evento de um job, os seguintes do mesmo job no
+    lote esperam a vez dele (ordem por job preservada).
+
+Entrega é "pelo menos uma vez": um handler pode ver o mesmo evento de
+novo se outro handler do mesmo kind falhou.
+
+Configuração (env):
+  OUTBOX_ENABLED=1|0
+  OUTBOX_INTERVAL_SEC=5      (varredura de segurança; o caminho normal é wake())
+  OUTBOX_BATCH=100
+  OUTBOX_MAX_ATTEMPTS=8
+  OUTBOX_CLAIM_SEC=60
+"""
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1") == "1"
+OUTBOX_INTERVAL_SEC = float(os.getenv("OUTBOX_INTERVAL_SEC", "5"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "100"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_CLAIM_SEC = int(os.getenv("OUTBOX_CLAIM_SEC", "60"))
+MAX_BACKOFF_SEC = 300
+
+
+class OutboxMessage(NamedTuple):
+    id: int
+    kind: str
+    user_id: Optional[int]
+    job_id: Optional[int]
+    payload: Dict[str, Any]
+    attempts: int
+
+
+Handler = Callable[[OutboxMessage], Awaitable[None]]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def enqueue(db: Session, kind: str, payload: Dict[str, Any], user_id: Optional[int] = None,
+            job_id: Optional[int] = None) -> models.OutboxEvent:
+    """Adiciona o evento à sessão (sem commit: entra na transação de quem chamou)."""
+    now = _now()
+    ev = models.OutboxEvent(
+        kind=kind, user_id=user_id, job_id=job_id,
+        payload=json.dumps(payload, ensure_ascii=False),
+        created_at=now, available_at=now,
+    )
+    db.add(ev)
+    return ev
+
+
+def backoff_sec(attempts: int) -> int:
+    return min(MAX_BACKOFF_SEC, 2 ** attempts)
+
+
+class OutboxDispatcher:
+    def __init__(self, session_factory: Callable[[], Session], interval_sec: float = OUTBOX_INTERVAL_SEC,
+                 batch_size: int = OUTBOX_BATCH, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.interval_sec = interval_sec
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.handlers: Dict[str, List[Handler]] = {}
+        self.token = uuid.uuid4().hex
+        self.delivered = 0
+        self.failed = 0
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()  # run_once do loop e chamadas diretas não se sobrepõem
+        self._task: Optional[asyncio.Task] = None
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self.handlers.setdefault(kind, []).append(handler)
+
+    def wake(self) -> None:
+        """Chamado depois do commit que gravou eventos (de qualquer thread)."""
+        loop = self._event_loop
+        if loop is None:
+            return
+        try:
+            no_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            no_loop = False
+        if no_loop:
+            self._wake.set()
+        else:
+            try:
+                loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:  # loop encerrado (shutdown)
+                pass
+
+    # --- banco (síncrono, em thread) ---
+    def _claim_sync(self) -> List[OutboxMessage]:
+        db = self.session_factory()
+        try:
+            now = _now()
+            ids = [
+                i for (i,) in db.query(models.OutboxEvent.id)
+                .filter(models.OutboxEvent.dead.is_(False), models.OutboxEvent.available_at <= now)
+                .order_by(models.OutboxEvent.id.asc())
+                .limit(self.batch_size)
+                .all()
+            ]
+            if not ids:
+                return []
+            lease = now + timedelta(seconds=OUTBOX_CLAIM_SEC)
+            db.query(models.OutboxEvent).filter(
+                models.OutboxEvent.id.in_(ids),
+                models.OutboxEvent.dead.is_(False),
+                models.OutboxEvent.available_at <= now,  # repete a condição: outro worker pode ter levado
+            ).update({models.OutboxEvent.available_at: lease, models.OutboxEvent.claimed_by: self.token},
+                     synchronize_session=False)
+            db.commit()
+            rows = (
+                db.query(models.OutboxEvent)
+                .filter(models.OutboxEvent.id.in_(ids), models.OutboxEvent.claimed_by == self.token,
+                        models.OutboxEvent.available_at == lease)
+                .order_by(models.OutboxEvent.id.asc())
+                .all()
+            )
+            return [OutboxMessage(r.id, r.kind, r.user_id, r.job_id, json.loads(r.payload), r.attempts) for r in rows]
+        finally:
+            db.close()
+
+    def _finish_sync(self, ok_ids: List[int], falhas: List[Tuple[OutboxMessage, str]],
+                     adiados: List[OutboxMessage]) -> None:
+        db = self.session_factory()
+        try:
+            now = _now()
+            retry_por_job: Dict[int, datetime] = {}
+            if ok_ids:
+                db.query(models.OutboxEvent).filter(models.OutboxEvent.id.in_(ok_ids)).delete(
+                    synchronize_session=False
+                )
+            for msg, erro in falhas:
+                tentativas = msg.attempts + 1
+                retry_at = now + timedelta(seconds=backoff_sec(tentativas))
+                if msg.job_id is not None:
+                    retry_por_job[msg.job_id] = retry_at
+                db.query(models.OutboxEvent).filter(models.OutboxEvent.id == msg.id).update({
+                    models.OutboxEvent.attempts: tentativas,
+                    models.OutboxEvent.last_error: erro[:300],
+                    models.OutboxEvent.available_at: retry_at,
+                    models.OutboxEvent.claimed_by: None,
+                    models.OutboxEvent.dead: tentativas >= self.max_attempts,
+                }, synchronize_session=False)
+            for msg in adiados:
+                # volta junto com o evento que falhou antes dele (a ordem por id desempata)
+                db.query(models.OutboxEvent).filter(models.OutboxEvent.id == msg.id).update({
+                    models.OutboxEvent.available_at: retry_por_job[msg.job_id],
+                    models.OutboxEvent.claimed_by: None,
+                }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    # --- entrega ---
+    async def run_once(self) -> int:
+        """Entrega o que estiver pendente (lote a lote); devolve quantos eventos saíram."""
+        total = 0
+        async with self._lock:
+            while True:
+                batch = await asyncio.to_thread(self._claim_sync)
+                if not batch:
+                    return total
+                ok_ids, falhas, adiados = [], [], []
+                jobs_travados = set()
+                for msg in batch:
+                    if msg.job_id is not None and msg.job_id in jobs_travados:
+                        adiados.append(msg)
+                        continue
+                    try:
+                        for handler in self.handlers.get(msg.kind, ()):
+                            await handler(msg)
+                        ok_ids.append(msg.id)
+                    except Exception as e:
+                        print(f"[OUTBOX] evento {msg.id} ({msg.kind}) falhou: {e}")
+                        falhas.append((msg, str(e) or e.__class__.__name__))
+                        if msg.job_id is not None:
+                            jobs_travados.add(msg.job_id)
+                await asyncio.to_thread(self._finish_sync, ok_ids, falhas, adiados)
+                self.delivered += len(ok_ids)
+                self.failed += len(falhas)
+                total += len(ok_ids)
+                if len(batch) < self.batch_size:
+                    return total
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval_sec)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.run_once()
+            except Exception as e:  # nunca derruba o loop
+                print(f"[OUTBOX ERROR] {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            # primitivas do loop atual (o app pode subir de novo em outro loop, ex.: testes)
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._wake.set()  # drena o que sobrou de antes do reinício
+            self._event_loop = asyncio.get_running_loop()
+            self._task = self._event_loop.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"delivered_total": self.delivered, "failed_total": self.failed}
@@ -0,0 +1,72 @@
+"""
+Planejador de dispensa paralela.
+
+O firmware abre um frasco por vez: o tempo total é a soma de todos os
+`segundos` mais pre/post delay por item. Com vários servos abertos ao mesmo
+tempo o job termina em ~tempo do item mais longo.
+
+O plano agrupa os itens em passos (servos abertos juntos):
+  - no máximo `max_simultaneos` frascos por passo, limitado também pelo
+    orçamento de corrente (power_budget_ma // servo_current_ma);
+  - o mesmo frasco nunca aparece duas vezes no mesmo passo (é um servo só);
+  - first-fit decreasing: itens mais longos primeiro, cada um no primeiro
+    passo com vaga. É uma heurística: junta os longos para reduzir o
+    makespan, mas com conflito de frasco e teto de corrente não garante o
+    ótimo.
+
+O plano só vai no next_job/sync de firmware que declara o recurso
+"plano" (header X-Device-Caps); o firmware atual roda `itens` em série.
+
+Cada passo custa pre_start + maior `segundos` do passo + post_stop.
+Com max_simultaneos=1 o plano é exatamente a execução sequencial atual.
+"""
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+
+def capacidade_paralela(max_simultaneos: int, power_budget_ma: Optional[int], servo_current_ma: int) -> int:
+    """Quantos servos podem ficar abertos juntos (sempre >= 1)."""
+    k = max(1, int(max_simultaneos or 1))
+    if power_budget_ma and servo_current_ma and servo_current_ma > 0:
+        k = min(k, max(1, int(power_budget_ma) // int(servo_current_ma)))
+    return k
+
+
+def planejar(
+    itens: Sequence[Mapping[str, Any]],
+    max_simultaneos: int = 1,
+    pre_start_delay_ms: int = 0,
+    post_stop_delay_ms: int = 0,
+) -> Dict[str, Any]:
+    """
+    `itens`: dicts com ao menos ordem, frasco e segundos (formato de JobItemOut).
+    Retorna {"max_simultaneos", "passos": [...], "makespan_ms", "sequencial_ms"}.
+    """
+    k = max(1, int(max_simultaneos))
+    overhead = int(pre_start_delay_ms) + int(post_stop_delay_ms)
+
+    passos: List[List[Mapping[str, Any]]] = []
+    for it in sorted(itens, key=lambda i: (-float(i["segundos"]), i["ordem"])):
+        for passo in passos:
+            if len(passo) < k and all(p["frasco"] != it["frasco"] for p in passo):
+                passo.append(it)
+                break
+        else:
+            passos.append([it])
+
+    out_passos: List[Dict[str, Any]] = []
+    t = 0
+    for n, passo in enumerate(passos, start=1):
+        dur = overhead + round(max(float(p["segundos"]) for p in passo) * 1000)
+        out_passos.append({
+            "passo": n,
+            "inicio_ms": t,
+            "duracao_ms": dur,
+            "itens": [
+                {"ordem": p["ordem"], "frasco": p["frasco"], "segundos": p["segundos"]}
+                for p in sorted(passo, key=lambda p: p["ordem"])
+            ],
+        })
+        t += dur
+
+    sequencial = sum(overhead + round(float(i["segundos"]) * 1000) for i in itens)
+    return {"max_simultaneos": k, "passos": out_passos, "makespan_ms": t, "sequencial_ms": sequencial}
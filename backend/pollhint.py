@@ -0,0 +1,88 @@
+"""
+Intervalo de poll sugerido aos dispositivos, conforme a atividade do usuário.
+
+O firmware faz poll a cada 1 s mesmo com o usuário longe do app. Aqui as
+respostas de /devices/me/next_job e /devices/me/sync (o poll) levam
+`X-Poll-Interval-Ms`, calculado no handler a partir do job que ele acabou
+de arrendar — sem consulta extra na autenticação de cada chamada:
+  - job entregue na resposta (havia fila), ou usuário ativo há menos de ACTIVE_WINDOW_SEC
+    (criou job, abriu a aba Execução, acompanha um job) → POLL_FAST_MS;
+  - depois disso o intervalo dobra a cada ACTIVE_WINDOW_SEC ocioso, até
+    POLL_IDLE_MS.
+
+A atividade fica em memória do processo (como o MemoryBucketStore do rate
+limit); sem registro — reinício, outro worker — vale o intervalo ocioso,
+mas job na fila sempre reduz para o rápido porque vem do arrendamento.
+
+Configuração (env):
+  POLL_FAST_MS=1000
+  POLL_IDLE_MS=30000
+  POLL_ACTIVE_WINDOW_SEC=120
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+POLL_FAST_MS = int(os.getenv("POLL_FAST_MS", "1000"))
+POLL_IDLE_MS = int(os.getenv("POLL_IDLE_MS", "30000"))
+ACTIVE_WINDOW_SEC = float(os.getenv("POLL_ACTIVE_WINDOW_SEC", "120"))
+
+HEADER = "X-Poll-Interval-Ms"
+
+
+class ActivityTracker:
+    """Último instante de atividade por usuário (LRU com teto de chaves)."""
+
+    def __init__(self, max_users: int = 50_000):
+        self.max_users = max_users
+        self._last: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, user_id: int) -> None:
+        with self._lock:
+            self._last[user_id] = time.monotonic()
+            self._last.move_to_end(user_id)
+            if len(self._last) > self.max_users:
+                self._last.popitem(last=False)
+
+    def idle_sec(self, user_id: int) -> Optional[float]:
+        with self._lock:
+            t = self._last.get(user_id)
+        return None if t is None else time.monotonic() - t
+
+    def hint_ms(self, user_id: int, pending: bool) -> int:
+        if pending:
+            return POLL_FAST_MS
+        idle = self.idle_sec(user_id)
+        if idle is None:
+            return POLL_IDLE_MS
+        if idle < ACTIVE_WINDOW_SEC:
+            return POLL_FAST_MS
+        dobras = min(16, int(idle // ACTIVE_WINDOW_SEC))
+        return min(POLL_IDLE_MS, POLL_FAST_MS * (2 ** dobras))
+
+
+class PollHintMiddleware:
+    """Copia o hint calculado pelo handler de poll (request.state) para o header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                hint = scope.get("state", {}).get("poll_hint_ms")
+                if hint is not None:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (HEADER.lower().encode(), str(hint).encode())
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, _send)
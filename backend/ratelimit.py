@@ -0,0 +1,192 @@
+"""
+Rate limiting por token bucket (por dispositivo ou por usuário).
+
+Cada política casa método + path e define a chave ("device" ou "user"),
+a rajada máxima (capacity) e a taxa de reposição (tokens/s). Estourou o
+balde → 429 com Retry-After, antes de abrir sessão de banco.
+
+Stores:
+  - MemoryBucketStore: dict em memória do processo (1 worker).
+  - SQLiteBucketStore: arquivo SQLite compartilhado (WAL) entre workers
+    da mesma máquina; atualização atômica com BEGIN IMMEDIATE.
+
+Configuração (env):
+  RATE_LIMIT_ENABLED=1|0
+  RATE_LIMIT_BACKEND=memory|sqlite
+  RATE_LIMIT_SQLITE_PATH=./ratelimit.db
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Optional, Pattern, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+
+class Policy(NamedTuple):
+    name: str
+    method: str
+    path: Pattern
+    key: str                # "device" | "user"
+    capacity: float         # rajada máxima
+    refill_per_sec: float   # reposição contínua
+
+
+DEFAULT_POLICIES: List[Policy] = [
+    # firmware faz poll a cada 1 s; o dobro absorve o "lastPoll = 0" pós-job/reconexão
+    Policy("next_job", "GET", re.compile(r"^/devices/me/next_job$"), "device", 10, 2.0),
+    Policy("heartbeat", "POST", re.compile(r"^/devices/me/heartbeat$"), "device", 5, 0.2),
+    Policy("job_report", "POST", re.compile(r"^/devices/me/jobs/\d+/(status|complete)$"), "device", 10, 1.0),
+    # sync substitui os três acima: ritmo do poll, que é o mais frequente
+    Policy("sync", "POST", re.compile(r"^/devices/me/sync$"), "device", 10, 2.0),
+    # autocomplete: várias teclas por segundo, mas não um loop
+    Policy("sugestoes", "GET", re.compile(r"^/receitas/sugestoes$"), "user", 20, 5.0),
+]
+
+
+def _take(tokens: float, last: float, capacity: float, rate: float, now: float) -> Tuple[bool, float, float]:
+    """
+    Aplica reposição e tenta consumir 1 token.
+    Retorna (permitido, tokens_restantes, retry_after_s).
+    """
+    tokens = min(capacity, tokens + max(0.0, now - last) * rate)
+    if tokens >= 1.0:
+        return True, tokens - 1.0, 0.0
+    return False, tokens, (1.0 - tokens) / rate if rate > 0 else 60.0
+
+
+class MemoryBucketStore:
+    """Baldes em memória, com teto de chaves (LRU) para não crescer sem limite."""
+    blocking = False
+
+    def __init__(self, max_keys: int = 50_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, capacity: float, rate: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (capacity, now))
+            ok, tokens, retry = _take(tokens, last, capacity, rate, now)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return ok, retry
+
+
+class SQLiteBucketStore:
+    """Baldes num arquivo SQLite compartilhado pelos workers (relógio de parede)."""
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key: str, capacity: float, rate: float) -> Tuple[bool, float]:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, ts FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, last = row if row else (capacity, now)
+            ok, tokens, retry = _take(tokens, last, capacity, rate, now)
+            conn.execute(
+                "INSERT INTO rate_buckets (key, tokens, ts) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, ts = excluded.ts",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return ok, retry
+
+
+def store_from_env():
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()
+    if backend == "sqlite":
+        return SQLiteBucketStore(os.getenv("RATE_LIMIT_SQLITE_PATH", "./ratelimit.db"))
+    return MemoryBucketStore()
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI. `identify(kind, request)` devolve a chave do cliente
+    (ex.: "dev:12", "user:3") ou None — sem identidade não limita aqui
+    (a dependência de auth da rota responde 401).
+    """
+
+    def __init__(
+        self,
+        app,
+        identify: Callable[[str, Request], Optional[str]],
+        policies: Optional[List[Policy]] = None,
+        store=None,
+        enabled: bool = True,
+    ):
+        self.app = app
+        self.identify = identify
+        self.policies = policies if policies is not None else DEFAULT_POLICIES
+        self.store = store if store is not None else store_from_env()
+        self.enabled = enabled
+
+    def _match(self, method: str, path: str) -> Optional[Policy]:
+        for p in self.policies:
+            if p.method == method and p.path.match(path):
+                return p
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        policy = self._match(scope["method"], scope["path"])
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        ident = self.identify(policy.key, Request(scope))
+        if ident is None:
+            await self.app(scope, receive, send)
+            return
+
+        bucket = f"{policy.name}:{ident}"
+        if self.store.blocking:
+            ok, retry = await run_in_threadpool(
+                self.store.consume, bucket, policy.capacity, policy.refill_per_sec
+            )
+        else:
+            ok, retry = self.store.consume(bucket, policy.capacity, policy.refill_per_sec)
+
+        if ok:
+            await self.app(scope, receive, send)
+            return
+
+        resp = JSONResponse(
+            status_code=429,
+            content={"detail": "Muitas requisições. Tente novamente em instantes."},
+            headers={"Retry-After": str(max(1, math.ceil(retry)))},
+        )
+        await resp(scope, receive, send)
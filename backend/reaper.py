@@ -0,0 +1,149 @@
+"""
+Reaper de jobs presos: tarefa asyncio periódica dentro da aplicação.
+
+A cada ciclo:
+  - lease vencido (status "leased", lease_until < agora): volta para a fila
+    ("queued", sem device, lote nem started_at) — o device nunca confirmou a
+    execução;
+  - "running" há mais que started_at + MotorConfig.max_runtime_sec + folga:
+    marca "failed" (o firmware caiu no meio ou nunca reportou).
+
+As atualizações são em lote (UPDATE ... WHERE id IN (...)) e repetem a
+condição de estado, então vários workers rodando o reaper não conflitam.
+
+Configuração (env):
+  JOB_REAPER_ENABLED=1|0
+  JOB_REAPER_INTERVAL_SEC=30
+  JOB_REAPER_GRACE_SEC=60
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+REAPER_ENABLED = os.getenv("JOB_REAPER_ENABLED", "1") == "1"
+REAPER_INTERVAL_SEC = float(os.getenv("JOB_REAPER_INTERVAL_SEC", "30"))
+REAPER_GRACE_SEC = int(os.getenv("JOB_REAPER_GRACE_SEC", "60"))
+DEFAULT_MAX_RUNTIME_SEC = 300
+
+STALE_RUNNING_MSG = "tempo máximo de execução excedido (dispositivo não reportou)"
+
+
+def _aware(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def reap_once(db: Session, now: Optional[datetime] = None) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+    """
+    Executa um ciclo. Retorna (requeued, failed) como listas de (job_id, user_id).
+    Faz commit.
+    """
+    now = now or datetime.now(timezone.utc)
+
+    # 1) leases vencidos -> fila
+    expirados = (
+        db.query(models.Job.id, models.Job.user_id)
+        .filter(models.Job.status == "leased", models.Job.lease_until < now)
+        .all()
+    )
+    if expirados:
+        db.query(models.Job).filter(
+            models.Job.id.in_([j for j, _u in expirados]),
+            models.Job.status == "leased",
+            models.Job.lease_until < now,
+        ).update(
+            {
+                models.Job.status: "queued",
+                models.Job.device_id: None,
+                models.Job.lease_until: None,
+                models.Job.lote_id: None,  # desfaz a coalescência; o próximo lease remonta
+                models.Job.started_at: None,  # a próxima tentativa conta o max_runtime do zero
+            },
+            synchronize_session=False,
+        )
+
+    # 2) "running" além do max_runtime do usuário -> failed
+    rows = (
+        db.query(models.Job.id, models.Job.user_id, models.Job.started_at, models.MotorConfig.max_runtime_sec)
+        .outerjoin(models.MotorConfig, models.MotorConfig.user_id == models.Job.user_id)
+        .filter(models.Job.status == "running")
+        .all()
+    )
+    travados = []
+    for job_id, user_id, started_at, max_runtime in rows:
+        inicio = _aware(started_at)
+        limite = timedelta(seconds=(max_runtime or DEFAULT_MAX_RUNTIME_SEC) + REAPER_GRACE_SEC)
+        if inicio is None or now - inicio > limite:
+            travados.append((job_id, user_id))
+    if travados:
+        db.query(models.Job).filter(
+            models.Job.id.in_([j for j, _u in travados]),
+            models.Job.status == "running",
+        ).update(
+            {
+                models.Job.status: "failed",
+                models.Job.finished_at: now,
+                models.Job.lease_until: None,
+                models.Job.erro_msg: STALE_RUNNING_MSG,
+            },
+            synchronize_session=False,
+        )
+
+    db.commit()
+    return expirados, travados
+
+
+Notifier = Callable[[List[Tuple[int, int]], List[Tuple[int, int]]], Awaitable[None]]
+
+
+class JobReaper:
+    """Loop asyncio que chama reap_once (em thread, a sessão é síncrona) e notifica."""
+
+    def __init__(self, session_factory: Callable[[], Session], notify: Optional[Notifier] = None,
+                 interval_sec: float = REAPER_INTERVAL_SEC):
+        self.session_factory = session_factory
+        self.notify = notify
+        self.interval_sec = interval_sec
+        self._task: Optional[asyncio.Task] = None
+
+    def _run_once_sync(self):
+        db = self.session_factory()
+        try:
+            return reap_once(db)
+        finally:
+            db.close()
+
+    async def run_once(self) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+        requeued, failed = await asyncio.to_thread(self._run_once_sync)
+        if (requeued or failed) and self.notify:
+            await self.notify(requeued, failed)
+        if requeued or failed:
+            print(f"[REAPER] re-enfileirados={len(requeued)} falhados={len(failed)}")
+        return requeued, failed
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            try:
+                await self.run_once()
+            except Exception as e:  # nunca derruba o loop
+                print(f"[REAPER ERROR] {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
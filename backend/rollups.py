@@ -0,0 +1,189 @@
+"""
+Rollups de consumo por (usuário, frasco, tempero) em baldes de hora e dia.
+
+Mantidos de forma incremental na mesma transação em que o job abate o
+estoque (device_job_complete / device_job_status "done"): as linhas do
+job_execution_log daquela execução são agregadas em memória e gravadas
+com um upsert em lote por tabela (INSERT ... ON CONFLICT DO UPDATE
+somando gramas/doses/falhas — SQLite e PostgreSQL).
+
+GET /stats/consumo lê só os baldes do intervalo (PK começa por
+user_id, inicio), então o custo é proporcional ao número de baldes,
+não ao histórico de jobs.
+
+Reconstrução a partir do histórico (job_execution_log), em blocos de
+ROLLUP_CHUNK linhas, cada bloco agregado e gravado de uma vez. A agregação
+do bloco é vetorizada com NumPy quando instalado (dependência opcional,
+importada só aqui): início do balde por aritmética inteira sobre o epoch,
+np.unique nas chaves e np.bincount para somar; sem NumPy, o mesmo
+resultado em Python puro.
+  python -m backend.rollups rebuild            # todos os usuários
+  python -m backend.rollups rebuild <user_id>  # um usuário
+"""
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from . import models
+
+ROLLUP_CHUNK = int(os.getenv("ROLLUP_CHUNK", "5000"))
+
+BUCKETS = {"hour": models.ConsumoHora, "day": models.ConsumoDia}
+
+Chave = Tuple[int, datetime, int, str]
+
+
+def bucket_start(dt: datetime, bucket: str) -> datetime:
+    """Início do balde em UTC (datetimes sem tz são tratados como UTC)."""
+    dt = dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+    dt = dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0) if bucket == "day" else dt
+
+
+def aggregate(rows: Iterable[Dict[str, Any]]) -> Dict[str, Dict[Chave, List[float]]]:
+    """Linhas do job_execution_log → {bucket: {(user, inicio, frasco, tempero): [gramas, doses, falhas]}}."""
+    acc: Dict[str, Dict[Chave, List[float]]] = {b: {} for b in BUCKETS}
+    for r in rows:
+        done = r["status"] == "done"
+        for bucket, baldes in acc.items():
+            k = (r["user_id"], bucket_start(r["finished_at"], bucket), r["frasco"], r["tempero"])
+            v = baldes.setdefault(k, [0.0, 0, 0])
+            if done:
+                v[0] += float(r["consumo_g"] or 0.0)
+                v[1] += 1
+            else:
+                v[2] += 1
+    return acc
+
+
+def aggregate_lote(rows: List[Dict[str, Any]]) -> Dict[str, Dict[Chave, List[float]]]:
+    """Como `aggregate`, vetorizado com NumPy quando disponível (blocos do rebuild)."""
+    try:
+        import numpy as np
+    except ImportError:  # dependência opcional
+        return aggregate(rows)
+    if not rows:
+        return aggregate(rows)
+
+    temperos: Dict[str, int] = {}
+    codigo = np.array([temperos.setdefault(r["tempero"], len(temperos)) for r in rows], dtype=np.int64)
+    nomes = list(temperos)
+    epoch = np.array([int(bucket_start(r["finished_at"], "hour").timestamp()) for r in rows], dtype=np.int64)
+    user = np.array([r["user_id"] for r in rows], dtype=np.int64)
+    frasco = np.array([r["frasco"] for r in rows], dtype=np.int64)
+    done = np.array([r["status"] == "done" for r in rows])
+    gramas = np.where(done, np.array([float(r["consumo_g"] or 0.0) for r in rows]), 0.0)
+
+    acc: Dict[str, Dict[Chave, List[float]]] = {}
+    for bucket, passo in (("hour", 3600), ("day", 86400)):
+        chaves = np.stack([user, epoch // passo * passo, frasco, codigo], axis=1)
+        unicas, grupo = np.unique(chaves, axis=0, return_inverse=True)
+        grupo = grupo.ravel()
+        n = len(unicas)
+        soma_g = np.bincount(grupo, weights=gramas, minlength=n)
+        doses = np.bincount(grupo, weights=done, minlength=n)
+        falhas = np.bincount(grupo, weights=~done, minlength=n)
+        acc[bucket] = {
+            (u, datetime.fromtimestamp(inicio, timezone.utc), f, nomes[c]): [float(soma_g[k]), int(doses[k]), int(falhas[k])]
+            for k, (u, inicio, f, c) in enumerate(unicas.tolist())
+        }
+    return acc
+
+
+def _insert_for(bind):
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _upsert(conn, model, baldes: Dict[Chave, List[float]]) -> None:
+    if not baldes:
+        return
+    bind = conn.get_bind() if isinstance(conn, Session) else conn
+    t = model.__table__
+    stmt = _insert_for(bind)(t)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[t.c.user_id, t.c.inicio, t.c.frasco, t.c.tempero],
+        set_={
+            "gramas": t.c.gramas + stmt.excluded.gramas,
+            "doses": t.c.doses + stmt.excluded.doses,
+            "falhas": t.c.falhas + stmt.excluded.falhas,
+        },
+    )
+    conn.execute(stmt, [
+        {"user_id": u, "inicio": i, "frasco": f, "tempero": te, "gramas": g, "doses": d, "falhas": x}
+        for (u, i, f, te), (g, d, x) in baldes.items()
+    ])
+
+
+def registrar(conn, rows: List[Dict[str, Any]], lote: bool = False) -> None:
+    """Soma linhas de log nos rollups (sem commit). `lote`: bloco grande do rebuild."""
+    for bucket, baldes in (aggregate_lote(rows) if lote else aggregate(rows)).items():
+        _upsert(conn, BUCKETS[bucket], baldes)
+
+
+def consultar(db: Session, user_id: int, bucket: str, desde: datetime, ate: datetime,
+              frasco: Optional[int] = None) -> List[Any]:
+    model = BUCKETS[bucket]
+    q = db.query(model).filter(
+        model.user_id == user_id,
+        model.inicio >= bucket_start(desde, bucket),
+        model.inicio <= ate,
+    )
+    if frasco is not None:
+        q = q.filter(model.frasco == frasco)
+    return q.order_by(model.inicio.asc(), model.frasco.asc(), model.tempero.asc()).all()
+
+
+def rebuild_conn(conn: Connection, user_id: Optional[int] = None, chunk: int = ROLLUP_CHUNK) -> int:
+    """Apaga e recalcula os rollups a partir do job_execution_log. Retorna as linhas lidas."""
+    log = models.JobExecutionLog.__table__
+    for model in BUCKETS.values():
+        d = model.__table__.delete()
+        if user_id is not None:
+            d = d.where(model.__table__.c.user_id == user_id)
+        conn.execute(d)
+
+    lidas, ultimo_id = 0, 0
+    while True:
+        q = (
+            select(log.c.id, log.c.user_id, log.c.frasco, log.c.tempero, log.c.consumo_g,
+                   log.c.status, log.c.finished_at)
+            .where(log.c.id > ultimo_id)
+            .order_by(log.c.id)
+            .limit(chunk)
+        )
+        if user_id is not None:
+            q = q.where(log.c.user_id == user_id)
+        bloco = [dict(r._mapping) for r in conn.execute(q)]
+        if not bloco:
+            return lidas
+        ultimo_id = bloco[-1]["id"]
+        lidas += len(bloco)
+        registrar(conn, bloco, lote=True)
+
+
+def rebuild(engine: Engine, user_id: Optional[int] = None) -> int:
+    """Reconstrução numa transação: quem lê /stats vê os rollups antigos até o commit."""
+    with engine.begin() as conn:
+        return rebuild_conn(conn, user_id)
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "rebuild":
+        uid = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        n = rebuild(engine, uid)
+        print(f"✅ rollups reconstruídos a partir de {n} linha(s) de log")
+    else:
+        print(f"Comando desconhecido: {cmd} (use: rebuild [user_id])")
+        sys.exit(2)
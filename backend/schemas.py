@@ -1,4 +1,4 @@
-from typing import List, Optional, Literal
+from typing import Dict, List, Optional, Literal
 from datetime import datetime
 from pydantic import BaseModel, Field, field_validator, ConfigDict
 
@@ -99,6 +99,26 @@ class ReservatorioConfigOut(ReservatorioConfigIn):
     model_config = ConfigDict(from_attributes=True)
 
 
+class PesagemIn(BaseModel):
+    frasco: int = Field(..., ge=1, le=4)
+    segundos: float = Field(..., gt=0, le=600, description="Tempo que o frasco rodou (s)")
+    gramas: float = Field(..., gt=0, description="Peso medido na balança (g)")
+
+
+class CalibracaoOut(BaseModel):
+    frasco: int
+    rotulo: Optional[str] = None
+    g_por_seg_atual: Optional[float] = None
+    g_por_seg_sugerido: Optional[float] = None
+    ic_min: Optional[float] = None  # intervalo de confiança (~95%) do sugerido
+    ic_max: Optional[float] = None
+    amostras: int
+    fonte: Optional[str] = None     # pesagem | execucao
+    status: str                     # ok | proposta | aplicada | insuficiente
+    calculado_em: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+
 # =========================
 # Configuração do Motor
 # =========================
@@ -107,6 +127,14 @@ class MotorConfigIn(BaseModel):
     pre_start_delay_ms: int = Field(default=500, ge=0, le=5000, description="Delay antes de abrir servos (ms)")
     post_stop_delay_ms: int = Field(default=300, ge=0, le=5000, description="Delay após fechar servos (ms)")
     max_runtime_sec: int = Field(default=300, ge=30, le=600, description="Timeout máximo de execução (s)")
+    coalesce_max_jobs: int = Field(
+        default=1, ge=1, le=10, description="Jobs da fila juntados numa única execução (1 = desligado)"
+    )
+    max_servos_simultaneos: int = Field(default=1, ge=1, le=4, description="Frascos abertos ao mesmo tempo (1 = sequencial)")
+    servo_current_ma: int = Field(default=250, ge=1, le=5000, description="Corrente de um servo aberto (mA)")
+    power_budget_ma: Optional[int] = Field(default=None, ge=1, le=20000, description="Corrente máxima para servos (mA)")
+    # None = mantém o valor salvo (clientes antigos não mandam o campo)
+    calibracao_auto: Optional[bool] = Field(default=None, description="Aplicar sozinho o g_por_seg calibrado")
 
 
 class MotorConfigOut(MotorConfigIn):
@@ -122,10 +150,18 @@ class MotorConfigOut(MotorConfigIn):
 class JobCreateIn(BaseModel):
     receita_id: int
     pessoas_solicitadas: int = Field(default=1, ge=1, le=100, description="Para quantas pessoas executar")
+    prioridade: int = Field(default=0, ge=0, le=9, description="Prioridade na fila (maior = executa antes)")
     # Mantém multiplicador para backwards compatibility (será ignorado)
     multiplicador: Optional[int] = Field(default=None, ge=1, deprecated=True)
 
 
+class JobItemOrigem(BaseModel):
+    """Parcela de um item coalescido que pertence a um job da fila."""
+    job_id: int
+    item_id: int
+    quantidade_g: float
+
+
 class JobItemOut(BaseModel):
     id: int
     ordem: int
@@ -134,20 +170,47 @@ class JobItemOut(BaseModel):
     quantidade_g: float
     segundos: float
     status: str
+    origem: Optional[List[JobItemOrigem]] = None  # só em execuções coalescidas
     model_config = ConfigDict(from_attributes=True)
 
 
+class PlanoPassoItem(BaseModel):
+    ordem: int
+    frasco: int
+    segundos: float
+
+
+class PlanoPasso(BaseModel):
+    """Frascos abertos juntos; o passo dura pre_start + maior `segundos` + post_stop."""
+    passo: int
+    inicio_ms: int
+    duracao_ms: int
+    itens: List[PlanoPassoItem]
+
+
+class PlanoExecucao(BaseModel):
+    max_simultaneos: int
+    passos: List[PlanoPasso]
+    makespan_ms: int     # duração estimada com o paralelismo
+    sequencial_ms: int   # duração estimada um frasco por vez
+
+
 class JobOut(BaseModel):
     id: int
     status: str
     receita_id: Optional[int] = None
     pessoas_solicitadas: int  # Novo campo principal
     multiplicador: int  # Deprecated mas mantido para compatibilidade
+    prioridade: int = 0
     created_at: datetime
     started_at: Optional[datetime] = None
     finished_at: Optional[datetime] = None
+    lease_until: Optional[datetime] = None  # até quando o device que pegou o job tem a posse
     erro_msg: Optional[str] = None
     itens: List[JobItemOut] = []
+    lote_job_ids: Optional[List[int]] = None  # jobs atendidos por esta execução (coalescência)
+    plano: Optional[PlanoExecucao] = None
+    tempo_estimado_s: Optional[float] = None  # makespan do plano
     motor_config: Optional[MotorConfigIn] = None  # NOVO: Configuração de motor enviada ao ESP32
     model_config = ConfigDict(from_attributes=True)
 
@@ -161,6 +224,9 @@ class ExecutionLogEntry(BaseModel):
     segundos: float
     status: Literal["done", "failed"]  # executado com sucesso ou falhou
     error: Optional[str] = None
+    # True só se quantidade_g veio de uma medição (balança/célula de carga); sem isso
+    # o firmware ecoa o pedido e o valor não serve para calibrar g_por_seg
+    medido: bool = False
 
 
 class JobCompleteIn(BaseModel):
@@ -175,9 +241,122 @@ class JobCompleteOut(BaseModel):
     ok: bool
     stock_deducted: bool  # se estoque foi abatido com sucesso
     message: Optional[str] = None
+    next_job_pending: bool = False  # há outro job na fila: o device pode fazer poll imediato
 # ======================================================
 
 
+class JobQueueItem(BaseModel):
+    """Posição de um job ativo na fila do usuário (GET /jobs/fila)"""
+    id: int
+    posicao: int
+    status: str
+    prioridade: int
+    receita_id: Optional[int] = None
+    pessoas_solicitadas: int
+    created_at: datetime
+
+
+class JobResumo(BaseModel):
+    """Projeção compacta de um job no histórico (GET /jobs); `itens` só com ?expand=itens."""
+    id: int
+    status: str
+    receita_id: Optional[int] = None
+    receita_nome: Optional[str] = None
+    pessoas_solicitadas: int
+    prioridade: int = 0
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    itens_completados: Optional[int] = None
+    itens_falhados: Optional[int] = None
+    lote_id: Optional[int] = None
+    erro_msg: Optional[str] = None
+    itens: Optional[List[JobItemOut]] = None
+
+
+class JobHistoricoOut(BaseModel):
+    jobs: List[JobResumo]
+    next_before: Optional[int] = None  # passe em ?before= para a próxima página (None = acabou)
+
+
+class JobPrioridadeIn(BaseModel):
+    prioridade: int = Field(..., ge=0, le=9)
+
+
+class JobPlanEntrada(BaseModel):
+    receita_id: int
+    pessoas_solicitadas: int = Field(default=1, ge=1, le=100)
+
+
+class JobPlanIn(BaseModel):
+    """Cardápio a verificar (POST /jobs/plan), na ordem em que seria executado"""
+    itens: List[JobPlanEntrada] = Field(..., min_length=1, max_length=100)
+
+
+class JobPlanEntradaOut(BaseModel):
+    indice: int
+    receita_id: int
+    pessoas_solicitadas: int
+    viavel: bool
+    erros: List[str] = []
+    consumo_g: Dict[int, float] = {}          # frasco -> gramas desta entrada
+    faltas: List[int] = []                    # frascos sem estoque acumulado até esta entrada
+    tempo_estimado_s: Optional[float] = None
+
+
+class JobPlanFrasco(BaseModel):
+    frasco: int
+    estoque_g: Optional[float] = None
+    reservado_g: float        # jobs já na fila
+    necessario_g: float       # soma do cardápio
+    falta_g: float
+
+
+class JobPlanOut(BaseModel):
+    viavel: bool
+    tempo_total_s: float
+    entradas: List[JobPlanEntradaOut]
+    frascos: List[JobPlanFrasco]
+
+
+# =========================
+# Estatísticas de consumo (rollups)
+# =========================
+class ConsumoBalde(BaseModel):
+    inicio: datetime
+    frasco: int
+    tempero: str
+    gramas: float
+    doses: int
+    falhas: int
+
+
+class ConsumoTotal(BaseModel):
+    frasco: int
+    tempero: str
+    gramas: float
+    doses: int
+    falhas: int
+
+
+class ConsumoOut(BaseModel):
+    bucket: Literal["hour", "day"]
+    desde: datetime
+    ate: datetime
+    series: List[ConsumoBalde]
+    totais: List[ConsumoTotal]
+
+
+class PrevisaoFrascoOut(BaseModel):
+    frasco: int
+    rotulo: Optional[str] = None
+    estoque_g: Optional[float] = None
+    taxa_g_dia: float                        # consumo médio recente (média exponencial)
+    dias_restantes: Optional[float] = None   # None: sem consumo recente ou estoque desconhecido
+    esgota_em: Optional[datetime] = None
+    baixo: bool
+
+
 # =========================
 # Dispositivos (ESP32)
 # =========================
@@ -210,3 +389,34 @@ class HeartbeatIn(BaseModel):
 class JobStatusIn(BaseModel):
     status: Literal["running", "done", "error"]
     error: Optional[str] = None
+
+
+class SyncJobStatus(JobStatusIn):
+    job_id: int
+
+
+class SyncRelatorio(JobCompleteIn):
+    job_id: int
+
+
+class DeviceSyncIn(BaseModel):
+    """POST /devices/me/sync: heartbeat + relatórios pendentes + poll numa requisição"""
+    fw_version: Optional[str] = None
+    status: Optional[dict] = None                  # telemetria (como no heartbeat)
+    status_jobs: List[SyncJobStatus] = Field(default=[], max_length=20)  # ack de início/erro
+    relatorios: List[SyncRelatorio] = Field(default=[], max_length=10)  # execuções offline a reportar
+    job_atual_id: Optional[int] = None             # job que o device já tem (flash)
+
+
+class SyncResultado(BaseModel):
+    job_id: int
+    ok: bool
+    status_code: int = 200
+    detail: Optional[str] = None
+
+
+class DeviceSyncOut(BaseModel):
+    job: Optional[JobOut] = None     # só quando difere de job_atual_id
+    job_changed: bool
+    resultados: List[SyncResultado] = []
+    poll_ms: int                     # quando sincronizar de novo
@@ -0,0 +1,167 @@
+"""
+Canal WebSocket único por usuário (/ws/me), multiplexado por tópicos:
+
+  - devices : device_online / device_offline (transições de last_seen)
+  - jobs    : job_status (criado, arrendado, rodando, concluído, cancelado...)
+  - progress: execution_log_entry / execution_complete de qualquer job do usuário
+  - stock   : stock (estoque por frasco após abatimento ou edição)
+
+UserHub.emit é thread-safe: as rotas síncronas (threadpool) publicam sem
+await; a entrega acontece no event loop. Cada assinante tem uma fila
+limitada — cliente lento perde os eventos mais antigos, nunca trava o
+publicador nem cresce sem limite.
+
+DevicePresence varre, só para usuários com canal aberto, quem ficou
+offline (ninguém avisa quando um device some; online é emitido na hora,
+na autenticação do device).
+"""
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+TOPICS = ("devices", "jobs", "progress", "stock")
+
+
+class Subscriber:
+    __slots__ = ("user_id", "topics", "queue", "dropped")
+
+    def __init__(self, user_id: int, topics: Iterable[str], max_queue: int):
+        self.user_id = user_id
+        self.topics: Set[str] = set(topics)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+
+class UserHub:
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._subs: Dict[int, Set[Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+
+    # --- assinatura (sempre no event loop) ---
+    def subscribe(self, user_id: int, topics: Iterable[str]) -> Subscriber:
+        if self._loop is None:
+            self.bind_loop(asyncio.get_running_loop())
+        sub = Subscriber(user_id, [t for t in topics if t in TOPICS], self.max_queue)
+        self._subs.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        subs = self._subs.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.user_id]
+
+    def users(self) -> List[int]:
+        return list(self._subs)
+
+    def connections(self) -> int:
+        return sum(len(s) for s in self._subs.values())
+
+    # --- publicação ---
+    def emit(self, user_id: int, topic: str, event_type: str, data: Dict[str, Any]) -> None:
+        """Publica para os assinantes do tópico. Pode ser chamado de qualquer thread."""
+        if self._loop is None or user_id not in self._subs:
+            return
+        event = {
+            "topic": topic,
+            "type": event_type,
+            "data": data,
+            "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        }
+        if threading.get_ident() == self._loop_thread:
+            self._deliver(user_id, topic, event)
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, user_id, topic, event)
+            except RuntimeError:  # loop encerrado (shutdown)
+                pass
+
+    def _deliver(self, user_id: int, topic: str, event: Dict[str, Any]) -> None:
+        for sub in list(self._subs.get(user_id, ())):
+            if topic not in sub.topics:
+                continue
+            if sub.queue.full():
+                sub.queue.get_nowait()  # descarta o mais antigo
+                sub.dropped += 1
+            sub.queue.put_nowait(event)
+
+
+class DevicePresence:
+    """
+    Estado online/offline conhecido por device; `sweep(rows)` recebe
+    (device_id, user_id, online) e emite as transições.
+    """
+
+    def __init__(self, hub: UserHub):
+        self.hub = hub
+        self._online: Dict[int, bool] = {}
+
+    def seed(self, device_id: int, online: bool) -> None:
+        """Estado inicial (snapshot enviado ao abrir o canal)."""
+        self._online.setdefault(device_id, online)
+
+    def came_online(self, device_id: int, user_id: int) -> None:
+        """Device offline voltou a falar com o servidor (detectado na autenticação)."""
+        self._online[device_id] = True
+        self.hub.emit(user_id, "devices", "device_online", {"device_id": device_id, "online": True})
+
+    def sweep(self, rows: Iterable[tuple]) -> None:
+        vistos = set()
+        for device_id, user_id, online in rows:
+            vistos.add(device_id)
+            before = self._online.get(device_id)
+            self._online[device_id] = online
+            if before is not None and before != online:
+                self.hub.emit(user_id, "devices", "device_online" if online else "device_offline",
+                              {"device_id": device_id, "online": online})
+        # devices de usuários sem canal aberto saem do mapa (não cresce sem limite)
+        for device_id in [d for d in self._online if d not in vistos]:
+            del self._online[device_id]
+
+    def __len__(self) -> int:
+        return len(self._online)
+
+
+class PresenceLoop:
+    """Varredura periódica (asyncio) chamando `load_rows()` em thread."""
+
+    def __init__(self, presence: DevicePresence, load_rows: Callable[[List[int]], List[tuple]],
+                 interval_sec: float = 15.0):
+        self.presence = presence
+        self.load_rows = load_rows
+        self.interval_sec = interval_sec
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> None:
+        users = self.presence.hub.users()
+        rows = await asyncio.to_thread(self.load_rows, users) if users else []
+        self.presence.sweep(rows)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            try:
+                await self.run_once()
+            except Exception as e:  # nunca derruba o loop
+                print(f"[PRESENCE ERROR] {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
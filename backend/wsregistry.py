@@ -0,0 +1,158 @@
+"""
+Registro das conexões WebSocket (/ws/jobs/{id} e /ws/me) com ciclo de vida
+explícito, para o processo não crescer com o número de jobs já assistidos.
+
+  - índice por job só existe enquanto há socket nele (vazio → removido);
+  - cada socket guarda dono, canal, lock de envio e último sinal de vida;
+  - teto de conexões simultâneas por usuário (WS_MAX_PER_USER);
+  - LivenessLoop: a cada WS_PING_INTERVAL_SEC manda {"type": "ping"} a quem
+    está quieto e fecha quem não fala nada há WS_IDLE_TIMEOUT_SEC (o front
+    já manda "ping" a cada 30 s). Envio que falha também derruba o socket.
+
+Tudo roda no event loop (sem locks de thread). `stats()` alimenta o
+/health/realtime.
+
+Configuração (env):
+  WS_MAX_PER_USER=10
+  WS_PING_INTERVAL_SEC=20
+  WS_IDLE_TIMEOUT_SEC=75
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+WS_MAX_PER_USER = int(os.getenv("WS_MAX_PER_USER", "10"))
+WS_PING_INTERVAL_SEC = float(os.getenv("WS_PING_INTERVAL_SEC", "20"))
+WS_IDLE_TIMEOUT_SEC = float(os.getenv("WS_IDLE_TIMEOUT_SEC", "75"))
+
+CLOSE_TOO_MANY = 4429
+CLOSE_IDLE = 4408
+
+
+class Connection:
+    __slots__ = ("ws", "user_id", "job_id", "lock", "last_seen", "opened_at")
+
+    def __init__(self, ws, user_id: Optional[int], job_id: Optional[int]):
+        self.ws = ws
+        self.user_id = user_id
+        self.job_id = job_id  # None = canal do usuário (/ws/me)
+        self.lock = asyncio.Lock()  # replay e broadcasts não se intercalam
+        self.last_seen = self.opened_at = time.monotonic()
+
+
+class ConnectionRegistry:
+    def __init__(self, max_per_user: int = WS_MAX_PER_USER):
+        self.max_per_user = max_per_user
+        self._conns: Dict[Any, Connection] = {}
+        self._by_job: Dict[int, Set[Any]] = {}
+        self._by_user: Dict[int, Set[Any]] = {}
+        self.rejected = 0
+        self.reaped = 0
+
+    def register(self, ws, user_id: Optional[int], job_id: Optional[int] = None) -> Optional[Connection]:
+        """Registra o socket; None se o usuário já está no teto de conexões."""
+        if user_id is not None and len(self._by_user.get(user_id, ())) >= self.max_per_user:
+            self.rejected += 1
+            return None
+        conn = self._conns[ws] = Connection(ws, user_id, job_id)
+        if job_id is not None:
+            self._by_job.setdefault(job_id, set()).add(ws)
+        if user_id is not None:
+            self._by_user.setdefault(user_id, set()).add(ws)
+        return conn
+
+    def unregister(self, ws) -> Optional[Connection]:
+        """Remove o socket de todos os índices (idempotente)."""
+        conn = self._conns.pop(ws, None)
+        if conn is None:
+            return None
+        for index, key in ((self._by_job, conn.job_id), (self._by_user, conn.user_id)):
+            if key is None:
+                continue
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.discard(ws)
+                if not bucket:
+                    del index[key]
+        return conn
+
+    def get(self, ws) -> Optional[Connection]:
+        return self._conns.get(ws)
+
+    def job_sockets(self, job_id: int) -> List[Any]:
+        return list(self._by_job.get(job_id, ()))
+
+    def touch(self, ws) -> None:
+        conn = self._conns.get(ws)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+
+    def connections(self) -> List[Connection]:
+        return list(self._conns.values())
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sockets": len(self._conns),
+            "jobs_watched": len(self._by_job),
+            "users": len(self._by_user),
+            "rejected_total": self.rejected,
+            "reaped_total": self.reaped,
+        }
+
+
+class LivenessLoop:
+    """Ping periódico e fechamento dos sockets ociosos (asyncio)."""
+
+    def __init__(self, registry: ConnectionRegistry, interval_sec: float = WS_PING_INTERVAL_SEC,
+                 idle_timeout_sec: float = WS_IDLE_TIMEOUT_SEC):
+        self.registry = registry
+        self.interval_sec = interval_sec
+        self.idle_timeout_sec = idle_timeout_sec
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> int:
+        """Uma varredura; devolve quantos sockets foram derrubados."""
+        now = time.monotonic()
+        mortos = 0
+        for conn in self.registry.connections():
+            quieto = now - conn.last_seen
+            try:
+                if quieto >= self.idle_timeout_sec:
+                    raise ConnectionError("idle")
+                if quieto >= self.interval_sec:
+                    async with conn.lock:
+                        await conn.ws.send_json({"type": "ping"})
+            except Exception:
+                mortos += 1
+                self.registry.reaped += 1
+                self.registry.unregister(conn.ws)
+                try:  # o receive pendente do endpoint acorda e encerra
+                    await conn.ws.close(code=CLOSE_IDLE)
+                except Exception:
+                    pass
+        return mortos
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            try:
+                await self.run_once()
+            except Exception as e:  # nunca derruba o loop
+                print(f"[WS LIVENESS ERROR] {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: serialização de GET /receitas/
+
+Compara o caminho antigo (ORM + selectinload → validação do response_model
+→ json stdlib) com o caminho rápido (tuplas → dicts → FastJSONResponse).
+
+Uso: python bench_list_endpoints.py [n_receitas] [repeticoes]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+from pydantic import TypeAdapter
+from sqlalchemy.orm import selectinload
+
+from backend import database, migrate, models, schemas
+from backend.fastjson import dumps, orjson
+from backend.main import _listar_receitas_rows
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+REPS = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+TEMPEROS = ["Sal", "Pimenta", "Alho em pó", "Orégano"]
+
+
+def seed(db) -> int:
+    user = models.Usuario(nome="bench", senha_hash="x")
+    db.add(user)
+    db.flush()
+    for i in range(N):
+        r = models.Receita(nome=f"Receita {i}", porcoes=2, dono_id=user.id)
+        r.ingredientes = [
+            models.IngredienteReceita(tempero=t, quantidade=float(5 + j)) for j, t in enumerate(TEMPEROS)
+        ]
+        db.add(r)
+    db.commit()
+    return user.id
+
+
+def caminho_antigo(db, user_id: int) -> bytes:
+    objs = (
+        db.query(models.Receita)
+        .options(selectinload(models.Receita.ingredientes))
+        .filter(models.Receita.dono_id == user_id)
+        .order_by(models.Receita.id.asc())
+        .limit(N)
+        .all()
+    )
+    adapter = TypeAdapter(list[schemas.Receita])
+    validated = adapter.validate_python(objs, from_attributes=True)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def caminho_rapido(db, user_id: int) -> bytes:
+    return dumps(_listar_receitas_rows(db, user_id, N, 0))
+
+
+def medir(fn, user_id: int) -> float:
+    tempos = []
+    for _ in range(REPS):
+        db = database.SessionLocal()
+        try:
+            t0 = time.perf_counter()
+            fn(db, user_id)
+            tempos.append(time.perf_counter() - t0)
+        finally:
+            db.close()
+    tempos.sort()
+    return tempos[len(tempos) // 2] * 1000.0
+
+
+if __name__ == "__main__":
+    migrate.upgrade(database.engine)
+    db = database.SessionLocal()
+    uid = seed(db)
+    assert json.loads(caminho_antigo(db, uid)) == json.loads(caminho_rapido(db, uid)), "saídas diferentes"
+    db.close()
+
+    antigo = medir(caminho_antigo, uid)
+    rapido = medir(caminho_rapido, uid)
+    print(f"receitas={N} (4 ingredientes cada), repetições={REPS}, orjson={'sim' if orjson else 'não'}")
+    print(f"  ORM + response_model + json : {antigo:8.2f} ms (mediana)")
+    print(f"  tuplas + FastJSONResponse   : {rapido:8.2f} ms (mediana)")
+    print(f"  ganho                       : {antigo / rapido:8.2f}x")
@@ -16,6 +16,7 @@ class JobExecutionMonitor {
     this.api_base_url = api_base_url;
     this.ws = null;
     this.execution_logs = [];
+    this.lastSeq = 0; // último evento recebido (replay com ?since= ao reconectar)
     this.callbacks = {
       onLogEntry: null,      // (entry) => {}
       onCompletion: null,    // (result) => {}
@@ -42,7 +43,7 @@ class JobExecutionMonitor {
     
     const proto = this.api_base_url.startsWith('https') ? 'wss' : 'ws';
     const host = this.api_base_url.replace(/^https?:\/\//, '');
-    const url = `${proto}://${host}/ws/jobs/${this.job_id}`;
+    const url = `${proto}://${host}/ws/jobs/${this.job_id}?since=${this.lastSeq}`;
     
     console.log(`[JobMonitor] Conectando a ${url} (tentativa ${this.reconnectAttempts + 1})`);
     
@@ -62,29 +63,7 @@ class JobExecutionMonitor {
       }, 30000);
     };
     
-    this.ws.onmessage = (event) => {
-      try {
-        const msg = JSON.parse(event.data);
-        
-        if (msg.type === 'execution_log_entry') {
-          console.log(`[JobMonitor] Log entry:`, msg.data);
-          this.execution_logs.push(msg.data);
-          this.callbacks.onLogEntry?.(msg.data);
-        } else if (msg.type === 'execution_complete') {
-          console.log(`[JobMonitor] Execução concluída:`, msg.data);
-          this.completedSuccessfully = true; // Marca como concluído com sucesso
-          this.callbacks.onCompletion?.(msg.data);
-          this.shouldReconnect = false; // Job finalizado, não reconectar
-          // Frontend fecha após processar a mensagem
-          setTimeout(() => this.close(), 100);
-        } else if (msg.type === 'pong') {
-          // Heartbeat response, ignore
-        }
-      } catch (e) {
-        console.error(`[JobMonitor] Erro ao processar mensagem:`, e);
-        this.callbacks.onError?.(e);
-      }
-    };
+    this.ws.onmessage = (event) => this._handleMessage(event);
     
     this.ws.onerror = (event) => {
       console.error(`[JobMonitor] ✗ WebSocket erro:`, event);
@@ -100,11 +79,11 @@ class JobExecutionMonitor {
         this.callbacks.onConnectionChange?.(false);
       }
       
-      // Circuit breaker: para após max tentativas
+      // Circuit breaker: após max tentativas, tenta SSE (proxy que bloqueia WebSocket)
       if (this.reconnectAttempts >= this.maxReconnectAttempts) {
-        console.error(`[JobMonitor] ⚠️ Circuit breaker: ${this.maxReconnectAttempts} tentativas falharam. Parando reconnect.`);
+        console.error(`[JobMonitor] ⚠️ Circuit breaker: ${this.maxReconnectAttempts} tentativas falharam. Tentando SSE.`);
         this.shouldReconnect = false;
-        this.callbacks.onError?.({ message: 'Falha persistente de conexão. Recarregue a página.' });
+        this._connectSSE();
         return;
       }
       
@@ -122,9 +101,58 @@ class JobExecutionMonitor {
     };
   }
 
+  _handleMessage(event) {
+    try {
+      const msg = JSON.parse(event.data);
+
+      // eventos numerados: ignora duplicatas do replay
+      if (typeof msg.seq === 'number') {
+        if (msg.seq <= this.lastSeq) return;
+        this.lastSeq = msg.seq;
+      }
+      
+      if (msg.type === 'execution_log_entry') {
+        console.log(`[JobMonitor] Log entry:`, msg.data);
+        this.execution_logs.push(msg.data);
+        this.callbacks.onLogEntry?.(msg.data);
+      } else if (msg.type === 'execution_complete') {
+        console.log(`[JobMonitor] Execução concluída:`, msg.data);
+        this.completedSuccessfully = true; // Marca como concluído com sucesso
+        this.callbacks.onCompletion?.(msg.data);
+        this.shouldReconnect = false; // Job finalizado, não reconectar
+        // Frontend fecha após processar a mensagem
+        setTimeout(() => this.close(), 100);
+      } else if (msg.type === 'pong' || msg.type === 'ping') {
+        // Heartbeat (resposta ou liveness do servidor), ignore
+      }
+    } catch (e) {
+      console.error(`[JobMonitor] Erro ao processar mensagem:`, e);
+      this.callbacks.onError?.(e);
+    }
+  }
+
+  /** Fallback: mesmos eventos via Server-Sent Events (retoma sozinho com Last-Event-ID) */
+  _connectSSE() {
+    if (this.manuallyClose || typeof EventSource === 'undefined') {
+      this.callbacks.onError?.({ message: 'Falha persistente de conexão. Recarregue a página.' });
+      return;
+    }
+    const url = `${this.api_base_url}/jobs/${this.job_id}/events?since=${this.lastSeq}`;
+    this.sse = new EventSource(url, { withCredentials: true });
+    this.sse.onopen = () => this.callbacks.onConnectionChange?.(true);
+    const handle = (event) => this._handleMessage(event);
+    this.sse.addEventListener('execution_log_entry', handle);
+    this.sse.addEventListener('execution_complete', handle);
+    this.sse.onerror = () => {
+      if (this.completedSuccessfully) this.sse?.close();
+    };
+  }
+
   close() {
     this.manuallyClose = true;
     this.shouldReconnect = false;
+    this.sse?.close();
+    this.sse = null;
     
     if (this.reconnectTimer) {
       clearTimeout(this.reconnectTimer);
@@ -144,6 +172,51 @@ class JobExecutionMonitor {
   }
 }
 
+// =====================================================================
+// Canal único por usuário (/ws/me): devices, jobs, progresso e estoque
+// =====================================================================
+class UserChannel {
+  constructor(onEvent, api_base_url = API_URL) {
+    this.onEvent = onEvent;          // (msg) => {}  msg = {topic, type, data, timestamp}
+    this.api_base_url = api_base_url;
+    this.ws = null;
+    this.retryDelay = 1000;
+    this.closed = false;
+  }
+
+  connect() {
+    this.closed = false;
+    const proto = this.api_base_url.startsWith('https') ? 'wss' : 'ws';
+    const host = this.api_base_url.replace(/^https?:\/\//, '');
+    this.ws = new WebSocket(`${proto}://${host}/ws/me`);
+    this.ws.onopen = () => {
+      this.retryDelay = 1000;
+      this._ping = setInterval(() => this.ws?.readyState === WebSocket.OPEN && this.ws.send('ping'), 30000);
+    };
+    this.ws.onmessage = (event) => {
+      try {
+        const msg = JSON.parse(event.data);
+        if (msg.type !== 'pong' && msg.type !== 'ping') this.onEvent?.(msg);  // ping: liveness do servidor
+      } catch (e) {
+        console.error('[UserChannel] Mensagem inválida:', e);
+      }
+    };
+    this.ws.onclose = (event) => {
+      clearInterval(this._ping);
+      if (this.closed || event.code === 4401) return;  // logout / sem sessão
+      setTimeout(() => this.connect(), this.retryDelay);
+      this.retryDelay = Math.min(this.retryDelay * 2, 30000);
+    };
+  }
+
+  close() {
+    this.closed = true;
+    clearInterval(this._ping);
+    this.ws?.close(1000, 'Logout');
+    this.ws = null;
+  }
+}
+
 // =====================================================================
 // Gerenciador de Preferências de Porções (localStorage)
 // =====================================================================
@@ -550,12 +623,31 @@ class App {
       const me = await jfetch(`${API_URL}/auth/me`);
       this.user = me;
       this.renderAuthBox();
+      this._openUserChannel();
     } catch (e) {
       this.user = null;
       this.renderAuthBox();
     }
   }
 
+  /** Eventos do /ws/me no lugar de recarregar devices/estoque por conta própria */
+  _openUserChannel() {
+    if (this.userChannel) return;
+    this.userChannel = new UserChannel((msg) => {
+      if (msg.topic === 'devices') {
+        this._updateDeviceStatusBanner();
+      } else if (msg.topic === 'stock') {
+        this.state.roboLoaded = false; // estoque mudou: recarrega ao abrir a aba Robô
+        if (msg.type === 'low_stock') {
+          const d = msg.data;
+          const quando = d.dias_restantes != null ? ` (~${Math.max(0, d.dias_restantes).toFixed(1)} dia(s))` : '';
+          this.toast(`Frasco ${d.frasco}${d.rotulo ? ` (${d.rotulo})` : ''} acabando${quando}. Reabasteça.`, 'err');
+        }
+      }
+    });
+    this.userChannel.connect();
+  }
+
   openAuthDialog(mode = 'login') {
     if (!this.authDlg) {
       const dlg = document.createElement('dialog');
@@ -631,6 +723,8 @@ class App {
 
   async logout() {
     try { await jfetch(`${API_URL}/auth/logout`, { method: 'POST' }); } catch {}
+    this.userChannel?.close();
+    this.userChannel = null;
     this.user = null;
     this.renderAuthBox();
     this.toast('Sessão encerrada.', 'ok');
@@ -1481,6 +1575,7 @@ class App {
   async loadMotorConfig() {
     try {
       const data = await jfetch(`${API_URL}/config/motor`);
+      this.motorConfig = data;  // campos sem controle na UI voltam como estão no save
       
       // Preencher campos da UI
       const vibrationIntensity = document.getElementById('vibrationIntensity');
@@ -1518,14 +1613,16 @@ class App {
       const postStopDelay = document.getElementById('postStopDelay');
       const maxRuntime = document.getElementById('maxRuntime');
       
+      const { id, user_id, updated_at, ...atual } = this.motorConfig || {};
       const payload = {
+        ...atual,  // coalescência, servos, calibracao_auto etc. não são zerados
         vibration_intensity: Number(vibrationIntensity?.value || 75),
         pre_start_delay_ms: Number(preStartDelay?.value || 500),
         post_stop_delay_ms: Number(postStopDelay?.value || 300),
         max_runtime_sec: Number(maxRuntime?.value || 300),
       };
       
-      await jfetch(`${API_URL}/config/motor`, {
+      this.motorConfig = await jfetch(`${API_URL}/config/motor`, {
         method: 'PUT',
         body: JSON.stringify(payload),
       });
@@ -1693,15 +1790,15 @@ class App {
         this.runDlg.close('ok');
       } catch (e) {
         const msg = e?.data?.detail || e.message || 'Falha ao iniciar execução';
-        if (e.status === 409 && /Robô ocupado/i.test(msg)) {
-          hint.innerHTML = `${msg} <button id="btnCancelActive" class="ghost" type="button">Cancelar execução atual</button>`;
+        if (e.status === 409 && /Fila cheia/i.test(msg)) {
+          hint.innerHTML = `${msg} <button id="btnCancelActive" class="ghost" type="button">Cancelar execuções pendentes</button>`;
           const btnCancel = this.runDlg.querySelector('#btnCancelActive');
           btnCancel?.addEventListener('click', async () => {
             try {
               btnCancel.disabled = true;
               await jfetch(`${API_URL}/jobs/active/cancel`, { method: 'POST' });
-              this.toast('Execução atual cancelada. Você pode tentar novamente.', 'ok');
-              hint.textContent = 'Execução anterior cancelada. Clique em "Executar" de novo.';
+              this.toast('Execuções pendentes canceladas. Você pode tentar novamente.', 'ok');
+              hint.textContent = 'Fila cancelada. Clique em "Executar" de novo.';
             } catch (e2) {
               this.toast(e2?.data?.detail || e2.message || 'Falha ao cancelar', 'err');
             } finally {
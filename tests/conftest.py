@@ -0,0 +1,75 @@
+"""
+Fixtures compartilhadas dos testes da API.
+
+O banco é um SQLite temporário: DATABASE_URL precisa ser definido antes de
+importar backend.database (o engine é criado no import).
+"""
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="dispenser-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP_DIR}/api.db"
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.main import app, outbox_dispatcher
+
+
+@pytest.fixture(scope="session")
+def tmp_dir() -> str:
+    return _TMP_DIR
+
+
+@pytest.fixture()
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture()
+def user_client(client):
+    """Cliente autenticado com um usuário novo (cookie de sessão)."""
+    nome = f"user-{uuid.uuid4().hex[:8]}"
+    client.post("/auth/register", json={"nome": nome, "senha": "segredo"})
+    r = client.post("/auth/login", json={"nome": nome, "senha": "segredo"})
+    assert r.status_code == 200
+    client.user_id = r.json()["id"]
+    return client
+
+
+@pytest.fixture()
+def drain_outbox(client):
+    """Entrega agora, no loop do app, o que o outbox tiver pendente (sem esperar o dispatcher)."""
+    return lambda: client.portal.call(outbox_dispatcher.run_once)
+
+
+@pytest.fixture()
+def make_device(user_client):
+    """Fábrica: vincula um device novo ao usuário logado e devolve os headers Bearer."""
+    def _make():
+        code = user_client.post("/devices/claims").json()["code"]
+        r = user_client.post("/devices/claim", json={"uid": f"esp32-{uuid.uuid4().hex[:10]}", "claim_code": code})
+        assert r.status_code == 200
+        return {"Authorization": f"Bearer {r.json()['device_token']}"}
+    return _make
+
+
+@pytest.fixture()
+def receita_pronta(user_client):
+    """Receita com 2 temperos já mapeados/calibrados nos frascos 1 e 2 (estoque 100 g)."""
+    user_client.put("/config/robo", json=[
+        {"frasco": 1, "rotulo": "Sal", "g_por_seg": 2.0, "estoque_g": 100},
+        {"frasco": 2, "rotulo": "Pimenta", "g_por_seg": 1.0, "estoque_g": 100},
+    ])
+    r = user_client.post("/receitas/", json={
+        "nome": "Tempero base", "porcoes": 1,
+        "ingredientes": [{"tempero": "Sal", "quantidade": 10}, {"tempero": "Pimenta", "quantidade": 4}],
+    })
+    assert r.status_code == 201
+    return r.json()["id"]
@@ -0,0 +1,15 @@
+"""Testes de fumaça da API (TestClient + SQLite temporário)."""
+
+
+def test_login_e_me(user_client):
+    r = user_client.get("/auth/me")
+    assert r.status_code == 200
+    assert r.json()["id"] == user_client.user_id
+
+
+def test_relatorio_de_startup(client):
+    r = client.get("/health/startup")
+    assert r.status_code == 200
+    body = r.json()
+    assert body["schema_mode"] == "upgrade"
+    assert body["total_ms"] >= body["import_ms"]
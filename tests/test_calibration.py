@@ -0,0 +1,101 @@
+"""Testes da calibração automática de g_por_seg."""
+import sys
+from datetime import datetime, timezone
+
+from backend import calibration, database, models
+
+
+def test_ajuste_robusto_ignora_outlier():
+    amostras = {(1, 1): [2.0, 2.1, 1.9, 2.0, 2.05, 1.95, 2.0, 2.02, 1.98, 2.0, 9.0], (1, 2): [1.0, 1.1]}
+    ajuste = calibration.ajustar_lote(amostras)
+    assert (1, 2) not in ajuste  # poucas amostras
+    mediana, ic_min, ic_max, n = ajuste[(1, 1)]
+    assert mediana == 2.0 and n == 11
+    assert ic_min <= mediana <= ic_max < 9.0
+
+
+def test_ajuste_em_lote_igual_ao_python_puro(monkeypatch):
+    amostras = {(u, f): [0.5 * f + 0.01 * ((i * 7 + u) % 11) for i in range(5 + u)] for u in range(1, 4) for f in (1, 2)}
+    lote = calibration.ajustar_lote(amostras)
+    monkeypatch.setitem(sys.modules, "numpy", None)  # força o caminho sem NumPy
+    assert calibration.ajustar_lote(amostras) == lote
+
+
+def test_pesagens_geram_proposta_e_aplicar(user_client, receita_pronta):
+    # Sal configurado a 2 g/s, mas a balança mostra ~2,5 g/s
+    for gramas in (5.0, 5.1, 4.9, 5.0, 5.05):
+        r = user_client.post("/config/robo/pesagens", json={"frasco": 1, "segundos": 2.0, "gramas": gramas})
+        assert r.status_code == 201
+    cal = {c["frasco"]: c for c in r.json()}
+    assert cal[1]["status"] == "proposta" and cal[1]["fonte"] == "pesagem" and cal[1]["amostras"] == 5
+    assert cal[1]["g_por_seg_sugerido"] == 2.5 and cal[1]["ic_min"] <= 2.5 <= cal[1]["ic_max"]
+    assert cal[2]["status"] == "insuficiente"
+
+    assert user_client.post("/config/robo/calibracao/2/aplicar").status_code == 404
+    r = user_client.post("/config/robo/calibracao/1/aplicar")
+    assert r.status_code == 200 and r.json()["g_por_seg"] == 2.5
+    cal = {c["frasco"]: c for c in user_client.get("/config/robo/calibracao?recalcular=1").json()}
+    assert cal[1]["status"] == "ok" and cal[1]["g_por_seg_atual"] == 2.5
+
+
+def test_execucoes_medidas_com_auto_aplicacao(user_client, make_device, receita_pronta):
+    motor = user_client.get("/config/motor").json()
+    user_client.put("/config/motor", json={**motor, "calibracao_auto": True})
+    motor.pop("calibracao_auto")
+    user_client.put("/config/motor", json=motor)  # cliente que não manda o campo não desliga
+    assert user_client.get("/config/motor").json()["calibracao_auto"] is True
+    user_client.put("/config/robo", json=[
+        {"frasco": 1, "rotulo": "Sal", "g_por_seg": 2.0, "estoque_g": 500},
+        {"frasco": 2, "rotulo": "Pimenta", "g_por_seg": 1.0, "estoque_g": 500},
+    ])
+    dev = make_device()
+
+    # só "done" (eco do pedido, sem medição): nunca vira amostra
+    for _ in range(calibration.CALIB_MIN_AMOSTRAS):
+        job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+        user_client.get("/devices/me/next_job", headers=dev)
+        user_client.post(f"/devices/me/jobs/{job_id}/status", json={"status": "done"}, headers=dev)
+    cal = {c["frasco"]: c for c in user_client.get("/config/robo/calibracao?recalcular=1").json()}
+    assert cal[1]["status"] == cal[2]["status"] == "insuficiente"
+
+    # balança no device: 12 g de sal em 5 s → 2,4 g/s; pimenta "medida" igual ao pedido é eco
+    for _ in range(calibration.CALIB_MIN_AMOSTRAS):
+        job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+        user_client.get("/devices/me/next_job", headers=dev)
+        logs = [
+            {"frasco": 1, "tempero": "Sal", "quantidade_g": 12.0, "segundos": 5.0, "status": "done", "medido": True},
+            {"frasco": 2, "tempero": "Pimenta", "quantidade_g": 4.0, "segundos": 4.0, "status": "done", "medido": True},
+        ]
+        user_client.post(f"/devices/me/jobs/{job_id}/complete", headers=dev,
+                         json={"itens_completados": 2, "itens_falhados": 0, "execution_logs": logs})
+
+    db = database.SessionLocal()
+    try:
+        assert calibration.calibrar(db, datetime.now(timezone.utc)) == [(user_client.user_id, 1)]
+        db.commit()
+        cfg = db.query(models.ReservatorioConfig).filter_by(user_id=user_client.user_id, frasco=1).one()
+        assert cfg.g_por_seg == 2.4
+        assert db.get(models.Calibracao, (user_client.user_id, 1)).fonte == "execucao"
+        assert db.get(models.Calibracao, (user_client.user_id, 2)).status == "insuficiente"
+    finally:
+        db.close()
+
+
+def test_receita_com_grafia_diferente_do_rotulo_calibra(user_client, make_device, receita_pronta):
+    # receita diz "sal" e o frasco é "Sal": o mapeamento casa, a calibração também tem de casar
+    r = user_client.post("/receitas/", json={
+        "nome": "Só sal", "porcoes": 1, "ingredientes": [{"tempero": "sal ", "quantidade": 10}],
+    })
+    receita = r.json()["id"]
+    dev = make_device()
+    for _ in range(calibration.CALIB_MIN_AMOSTRAS):
+        job_id = user_client.post("/jobs", json={"receita_id": receita}).json()["id"]
+        item = user_client.get("/devices/me/next_job", headers=dev).json()["itens"][0]
+        assert item["frasco"] == 1
+        logs = [{"frasco": 1, "tempero": item["tempero"], "quantidade_g": 12.0, "segundos": 5.0,
+                 "status": "done", "medido": True}]
+        user_client.post(f"/devices/me/jobs/{job_id}/complete", headers=dev,
+                         json={"itens_completados": 1, "itens_falhados": 0, "execution_logs": logs})
+    cal = {c["frasco"]: c for c in user_client.get("/config/robo/calibracao?recalcular=1").json()}
+    assert cal[1]["fonte"] == "execucao" and cal[1]["amostras"] == calibration.CALIB_MIN_AMOSTRAS
+    assert cal[1]["g_por_seg_sugerido"] == 2.4
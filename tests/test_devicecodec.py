@@ -0,0 +1,46 @@
+"""Testes da negociação CBOR/MessagePack nas rotas do dispositivo."""
+import pytest
+
+from backend.devicecodec import LONG_KEYS, SHORT_KEYS, _rekey
+
+
+def test_tabela_de_chaves_sem_colisao():
+    assert len(LONG_KEYS) == len(SHORT_KEYS)
+    assert not set(SHORT_KEYS.values()) & set(SHORT_KEYS)
+
+
+def test_telemetria_livre_nao_tem_chaves_trocadas():
+    telemetria = {"wifi": -60, "frasco": 2, "error": None, "status": "idle"}
+    curto = _rekey({"fw_version": "1.2", "status": telemetria}, SHORT_KEYS)
+    assert curto == {"fw": "1.2", "s": telemetria}
+    assert _rekey(curto, LONG_KEYS) == {"fw_version": "1.2", "status": telemetria}
+    # status de job continua abreviado como campo de schema
+    assert _rekey({"job": {"id": 1, "status": "leased"}}, SHORT_KEYS) == {"jb": {"i": 1, "s": "leased"}}
+
+
+def test_next_job_em_cbor_e_relatorio_em_msgpack(user_client, make_device, receita_pronta):
+    cbor2 = pytest.importorskip("cbor2")
+    msgpack = pytest.importorskip("msgpack")
+
+    dev = make_device()
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+
+    json_body = user_client.get("/devices/me/next_job", headers=dev)
+    r = user_client.get("/devices/me/next_job", headers={**dev, "Accept": "application/cbor"})
+    assert r.headers["content-type"] == "application/cbor"
+    assert len(r.content) < len(json_body.content)
+    job = cbor2.loads(r.content)
+    assert job["i"] == job_id and job["it"][0]["f"] == 1 and job["mc"]["vi"] == 75
+
+    logs = [{"f": it["f"], "t": it["t"], "g": it["g"], "sg": it["sg"], "s": "done"} for it in job["it"]]
+    body = msgpack.packb({"ic": len(logs), "if": 0, "el": logs})
+    r = user_client.post(
+        f"/devices/me/jobs/{job_id}/complete", content=body,
+        headers={**dev, "Content-Type": "application/msgpack", "Accept": "application/msgpack"},
+    )
+    assert r.status_code == 200 and r.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(r.content)["sk"] is True
+
+    # sem Accept binário: JSON como sempre
+    assert user_client.get(f"/jobs/{job_id}").json()["status"] == "done"
+    assert user_client.get("/devices/me/next_job", headers=dev).status_code == 204
@@ -0,0 +1,22 @@
+"""Testes do caminho rápido de serialização (backend/fastjson.py)."""
+import json
+from datetime import datetime
+
+from backend import fastjson, schemas
+
+
+def test_dumps_sem_orjson(monkeypatch):
+    monkeypatch.setattr(fastjson, "orjson", None)
+    out = fastjson.dumps({"t": datetime(2025, 1, 2, 3, 4, 5), "nome": "Orégano"})
+    assert json.loads(out) == {"t": "2025-01-02T03:04:05", "nome": "Orégano"}
+
+
+def test_listagem_rapida_respeita_schema(user_client):
+    user_client.post("/receitas/", json={
+        "nome": "Molho", "porcoes": 2,
+        "ingredientes": [{"tempero": "Sal", "quantidade": 3}, {"tempero": "Pimenta", "quantidade": 1}],
+    })
+    r = user_client.get("/receitas/", params={"q": "molho"})
+    assert r.status_code == 200 and "ETag" in r.headers
+    [receita] = [schemas.Receita.model_validate(x) for x in r.json()]
+    assert [i.tempero for i in receita.ingredientes] == ["Sal", "Pimenta"]
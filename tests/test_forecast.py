@@ -0,0 +1,75 @@
+"""Testes da previsão de esgotamento e do alerta de estoque baixo."""
+import math
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, select
+
+from backend import forecast, models
+
+
+def _proximo(ws, tipo):
+    while True:
+        msg = ws.receive_json()
+        if msg.get("type") == tipo:
+            return msg
+
+
+def test_taxa_exponencial_decai_com_o_tempo():
+    t0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    taxa = forecast.acumular(0.0, None, 14.0, t0, tau_dias=7)
+    assert taxa == 2.0
+    taxa = forecast.acumular(taxa, t0, 14.0, t0 + timedelta(days=7), tau_dias=7)
+    assert math.isclose(taxa, 2.0 * math.exp(-1) + 2.0)
+    assert forecast.decair(taxa, t0 + timedelta(days=7), t0 + timedelta(days=14), tau_dias=7) < taxa
+    assert forecast.dias_restantes(10.0, 2.0) == 5.0 and forecast.dias_restantes(10.0, 0.0) is None
+
+
+def test_alerta_ao_cruzar_limite_e_rearme(user_client, make_device, receita_pronta, drain_outbox):
+    dev = make_device()
+    # Sal com 12 g: depois de um job de 10 g sobram 2 g para ~1,4 dia de consumo
+    user_client.put("/config/robo", json=[
+        {"frasco": 1, "rotulo": "Sal", "g_por_seg": 2.0, "estoque_g": 12},
+        {"frasco": 2, "rotulo": "Pimenta", "g_por_seg": 1.0, "estoque_g": 100},
+    ])
+    with user_client.websocket_connect("/ws/me?topics=stock") as ws:
+        ws.receive_json()  # hello
+        job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+        user_client.get("/devices/me/next_job", headers=dev)
+        user_client.post(f"/devices/me/jobs/{job_id}/status", json={"status": "done"}, headers=dev)
+        drain_outbox()
+        alerta = _proximo(ws, "low_stock")["data"]
+    assert alerta["frasco"] == 1 and alerta["estoque_g"] == 2.0
+    assert 1.0 < alerta["dias_restantes"] < 3.0
+
+    prev = {p["frasco"]: p for p in user_client.get("/config/robo/previsao").json()}
+    assert prev[1]["baixo"] and math.isclose(prev[1]["taxa_g_dia"], 10 / 7, rel_tol=1e-2)
+    assert not prev[2]["baixo"] and prev[2]["dias_restantes"] > 3
+
+    # reabastecido: sai do estado baixo e o alerta rearma
+    user_client.put("/config/robo", json=[{"frasco": 1, "rotulo": "Sal", "g_por_seg": 2.0, "estoque_g": 500}])
+    from backend import database, models
+    db = database.SessionLocal()
+    try:
+        p = db.get(models.PrevisaoEstoque, (user_client.user_id, 1))
+        assert p.alerta_ativo is False
+    finally:
+        db.close()
+
+
+def test_semente_casa_tempero_sem_diferenciar_caixa():
+    engine = create_engine("sqlite://", future=True)
+    models.Base.metadata.create_all(engine)
+    agora = datetime(2025, 1, 10, tzinfo=timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(models.ReservatorioConfig.__table__.insert(), [
+            {"user_id": 1, "frasco": 1, "rotulo": "Sal"},
+            {"user_id": 1, "frasco": 2, "rotulo": "Pimenta"},
+        ])
+        conn.execute(models.ConsumoDia.__table__.insert(), [
+            {"user_id": 1, "frasco": 1, "tempero": "sal ", "inicio": agora - timedelta(days=1), "gramas": 20.0, "doses": 2},
+            {"user_id": 1, "frasco": 2, "tempero": "Cominho", "inicio": agora - timedelta(days=1), "gramas": 5.0, "doses": 1},
+        ])
+        forecast.semear_de_rollups(conn, agora)
+        prev = models.PrevisaoEstoque.__table__
+        taxas = dict(conn.execute(select(prev.c.frasco, prev.c.taxa_g_dia)).all())
+    assert taxas[1] > 0 and 2 not in taxas  # frasco 2 trocou de tempero: sem semente
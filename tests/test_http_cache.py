@@ -0,0 +1,39 @@
+"""Testes de ETag/GET condicional e compressão."""
+
+
+def _receita(nome="Frango", n=1):
+    return {"nome": nome, "porcoes": 1, "ingredientes": [{"tempero": "Sal", "quantidade": 5}] * n}
+
+
+def test_receitas_304_ate_haver_escrita(user_client):
+    user_client.post("/receitas/", json=_receita())
+    r1 = user_client.get("/receitas/")
+    etag = r1.headers["ETag"]
+    assert r1.status_code == 200 and etag.startswith('W/"')
+
+    r2 = user_client.get("/receitas/", headers={"If-None-Match": etag})
+    assert r2.status_code == 304
+    assert r2.content == b""
+
+    user_client.post("/receitas/", json=_receita("Peixe"))
+    r3 = user_client.get("/receitas/", headers={"If-None-Match": etag})
+    assert r3.status_code == 200
+    assert r3.headers["ETag"] != etag
+    assert len(r3.json()) == 2
+
+
+def test_config_robo_muda_etag_no_put(user_client):
+    etag = user_client.get("/config/robo").headers["ETag"]
+    user_client.put("/config/robo", json=[{"frasco": 1, "rotulo": "Sal", "g_por_seg": 2.0}])
+    r = user_client.get("/config/robo", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json()[0]["rotulo"] == "Sal"
+
+
+def test_listas_grandes_saem_comprimidas(user_client):
+    for i in range(20):
+        user_client.post("/receitas/", json=_receita(f"Receita {i}", 4))
+    r = user_client.get("/receitas/", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert len(r.json()) == 20
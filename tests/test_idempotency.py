@@ -0,0 +1,35 @@
+"""Testes do Idempotency-Key (POST /jobs e relatórios do device)."""
+
+
+def test_post_jobs_repetido_devolve_a_mesma_resposta(user_client, receita_pronta):
+    headers = {"Idempotency-Key": "cozinha-123"}
+    body = {"receita_id": receita_pronta, "pessoas_solicitadas": 2}
+
+    r1 = user_client.post("/jobs", json=body, headers=headers)
+    r2 = user_client.post("/jobs", json=body, headers=headers)
+    assert r1.status_code == r2.status_code == 201
+    assert r2.headers.get("idempotent-replayed") == "true"
+    assert r1.json()["id"] == r2.json()["id"]
+    assert len(user_client.get("/jobs/fila").json()) == 1
+
+    # mesma chave, outro corpo
+    r3 = user_client.post("/jobs", json={**body, "pessoas_solicitadas": 3}, headers=headers)
+    assert r3.status_code == 422
+
+
+def test_resposta_sobrevive_ao_cache_em_memoria(user_client, receita_pronta):
+    from backend.main import app
+    from backend.idempotency import IdempotencyMiddleware
+
+    headers = {"Idempotency-Key": "reinicio-1"}
+    body = {"receita_id": receita_pronta}
+    job_id = user_client.post("/jobs", json=body, headers=headers).json()["id"]
+
+    # simula outro worker/reinício: esvazia o LRU, a tabela responde
+    stack = app.middleware_stack
+    while not isinstance(stack, IdempotencyMiddleware):
+        stack = stack.app
+    stack.store._mem.clear()
+
+    r = user_client.post("/jobs", json=body, headers=headers)
+    assert r.json()["id"] == job_id and r.headers.get("idempotent-replayed") == "true"
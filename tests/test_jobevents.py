@@ -0,0 +1,77 @@
+"""Testes do log de eventos por job (seq + replay com ?since=)."""
+from backend.jobevents import JobEventLog
+
+
+def test_ring_buffer_e_lru_de_jobs():
+    log = JobEventLog(buffer_size=3, max_jobs=2)
+    for i in range(5):
+        log.append(1, "execution_log_entry", {"i": i})
+    assert [e["seq"] for e in log.since(1, 0)] == [3, 4, 5]
+    assert [e["data"]["i"] for e in log.since(1, 4)] == [4]
+
+    log.append(2, "x", {})
+    log.append(3, "x", {})  # job 1 é o menos recente: sai
+    assert log.since(1, 0) == [] and len(log) == 2
+
+
+def test_reconexao_recebe_eventos_perdidos(user_client, make_device, receita_pronta, drain_outbox):
+    dev = make_device()
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+    job = user_client.get("/devices/me/next_job", headers=dev).json()
+    logs = [{**{k: it[k] for k in ("frasco", "tempero", "quantidade_g", "segundos")}, "status": "done"}
+            for it in job["itens"]]
+    user_client.post(
+        f"/devices/me/jobs/{job_id}/complete",
+        json={"itens_completados": 2, "itens_falhados": 0, "execution_logs": logs}, headers=dev,
+    )
+    drain_outbox()
+
+    # espectador atrasado: linha do tempo inteira
+    with user_client.websocket_connect(f"/ws/jobs/{job_id}?since=0") as ws:
+        eventos = [ws.receive_json() for _ in range(3)]
+    assert [e["type"] for e in eventos] == ["execution_log_entry", "execution_log_entry", "execution_complete"]
+    assert [e["seq"] for e in eventos] == [1, 2, 3]
+
+    # reconexão depois do seq 2: só o que faltou
+    with user_client.websocket_connect(f"/ws/jobs/{job_id}?since=2") as ws:
+        assert ws.receive_json()["seq"] == 3
+
+
+def _sse_eventos(resp):
+    eventos, atual = [], {}
+    for linha in resp.iter_lines():
+        if not linha:
+            if "event" in atual:
+                eventos.append(atual)
+            atual = {}
+            continue
+        campo, _, valor = linha.partition(": ")
+        atual[campo] = valor
+    return eventos
+
+
+def test_sse_com_last_event_id(user_client, make_device, receita_pronta, drain_outbox):
+    dev = make_device()
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+    job = user_client.get("/devices/me/next_job", headers=dev).json()
+    logs = [{**{k: it[k] for k in ("frasco", "tempero", "quantidade_g", "segundos")}, "status": "done"}
+            for it in job["itens"]]
+    user_client.post(
+        f"/devices/me/jobs/{job_id}/complete",
+        json={"itens_completados": 2, "itens_falhados": 0, "execution_logs": logs}, headers=dev,
+    )
+    drain_outbox()
+
+    with user_client.stream("GET", f"/jobs/{job_id}/events") as r:
+        assert r.headers["content-type"].startswith("text/event-stream")
+        eventos = _sse_eventos(r)
+    assert [(e["id"], e["event"]) for e in eventos] == [
+        ("1", "execution_log_entry"), ("2", "execution_log_entry"), ("3", "execution_complete"),
+    ]
+
+    with user_client.stream("GET", f"/jobs/{job_id}/events", headers={"Last-Event-ID": "2"}) as r:
+        assert [e["id"] for e in _sse_eventos(r)] == ["3"]
+
+    # já viu a conclusão: 204 encerra as reconexões do EventSource
+    r = user_client.get(f"/jobs/{job_id}/events", headers={"Last-Event-ID": "3"})
+    assert r.status_code == 204
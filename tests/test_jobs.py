@@ -0,0 +1,291 @@
+"""Testes do fluxo de jobs: criação, lease pelo dispositivo e conclusão."""
+
+
+def _complete_payload(job):
+    logs = [
+        {"frasco": it["frasco"], "tempero": it["tempero"], "quantidade_g": it["quantidade_g"],
+         "segundos": it["segundos"], "status": "done"}
+        for it in job["itens"]
+    ]
+    return {"itens_completados": len(logs), "itens_falhados": 0, "execution_logs": logs}
+
+
+def test_lease_entrega_job_a_um_unico_device(user_client, make_device, receita_pronta):
+    dev_a, dev_b = make_device(), make_device()
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+
+    r_a = user_client.get("/devices/me/next_job", headers=dev_a)
+    assert r_a.status_code == 200
+    assert r_a.json()["id"] == job_id and r_a.json()["status"] == "leased"
+    assert r_a.json()["lease_until"] is not None
+
+    # o segundo device não recebe o mesmo job
+    assert user_client.get("/devices/me/next_job", headers=dev_b).status_code == 204
+    # o dono do lease recebe de novo (resposta anterior pode ter se perdido)
+    assert user_client.get("/devices/me/next_job", headers=dev_a).json()["id"] == job_id
+
+    payload = _complete_payload(r_a.json())
+    assert user_client.post(f"/devices/me/jobs/{job_id}/complete", json=payload, headers=dev_b).status_code == 409
+    r = user_client.post(f"/devices/me/jobs/{job_id}/complete", json=payload, headers=dev_a)
+    assert r.status_code == 200 and r.json()["stock_deducted"]
+
+    job = user_client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "done" and job["lease_until"] is None
+
+
+def test_reaper_reenfileira_lease_vencido_e_falha_running_travado(user_client, make_device, receita_pronta):
+    from datetime import datetime, timedelta, timezone
+
+    from backend import database, models
+    from backend.reaper import reap_once
+
+    dev = make_device()
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+    assert user_client.get("/devices/me/next_job", headers=dev).status_code == 200
+
+    db = database.SessionLocal()
+    try:
+        futuro = datetime.now(timezone.utc) + timedelta(hours=1)
+        requeued, failed = reap_once(db, now=futuro)
+        assert (job_id, user_client.user_id) in requeued
+        job = db.get(models.Job, job_id)
+        assert job.status == "queued" and job.device_id is None
+
+        # agora o device reporta "running" e some
+        user_client.get("/devices/me/next_job", headers=dev)
+        user_client.post(f"/devices/me/jobs/{job_id}/status", json={"status": "running"}, headers=dev)
+        db.expire_all()
+        _requeued, failed = reap_once(db, now=futuro + timedelta(hours=1))
+        assert (job_id, user_client.user_id) in failed
+        db.expire_all()
+        assert db.get(models.Job, job_id).status == "failed"
+    finally:
+        db.close()
+
+    # usuário não fica bloqueado com "Robô ocupado"
+    assert user_client.post("/jobs", json={"receita_id": receita_pronta}).status_code == 201
+
+
+def test_fila_com_prioridade_e_reserva_de_estoque(user_client, make_device, receita_pronta):
+    dev = make_device()
+    # Sal: 10 g/pessoa, estoque 100 g → 4 + 4 pessoas reservam 80 g
+    baixa = user_client.post("/jobs", json={"receita_id": receita_pronta, "pessoas_solicitadas": 4})
+    alta = user_client.post("/jobs", json={"receita_id": receita_pronta, "pessoas_solicitadas": 4, "prioridade": 5})
+    assert baixa.status_code == 201 and alta.status_code == 201
+
+    r = user_client.post("/jobs", json={"receita_id": receita_pronta, "pessoas_solicitadas": 3})
+    assert r.status_code == 409 and "reservados" in r.json()["detail"]
+
+    fila = user_client.get("/jobs/fila").json()
+    assert [j["id"] for j in fila] == [alta.json()["id"], baixa.json()["id"]]
+    assert [j["posicao"] for j in fila] == [1, 2]
+
+    # o device recebe primeiro o de maior prioridade
+    job = user_client.get("/devices/me/next_job", headers=dev).json()
+    assert job["id"] == alta.json()["id"]
+    r = user_client.post(f"/devices/me/jobs/{job['id']}/complete", json=_complete_payload(job), headers=dev)
+    assert r.json()["next_job_pending"] is True
+
+    # cancelar o que está na fila libera a reserva
+    assert user_client.post(f"/jobs/{baixa.json()['id']}/cancel").json()["ok"]
+    assert user_client.get("/jobs/fila").json() == []
+    assert user_client.get(f"/jobs/{baixa.json()['id']}").json()["status"] == "canceled"
+    assert user_client.post("/jobs", json={"receita_id": receita_pronta, "pessoas_solicitadas": 3}).status_code == 201
+
+
+def test_coalescencia_junta_fila_numa_execucao(user_client, make_device, receita_pronta):
+    dev = make_device()
+    user_client.put("/config/motor", json={"coalesce_max_jobs": 3})
+    ids = [
+        user_client.post("/jobs", json={"receita_id": receita_pronta, "pessoas_solicitadas": n}).json()["id"]
+        for n in (1, 2)
+    ]
+
+    job = user_client.get("/devices/me/next_job", headers=dev).json()
+    assert job["id"] == ids[0] and job["lote_job_ids"] == ids
+    # um item por frasco, somando os dois jobs (Sal 10 + 20 g)
+    sal = next(it for it in job["itens"] if it["frasco"] == 1)
+    assert len(job["itens"]) == 2 and sal["quantidade_g"] == 30.0
+    assert [o["quantidade_g"] for o in sal["origem"]] == [10.0, 20.0]
+
+    payload = _complete_payload(job)
+    payload["execution_logs"][0]["quantidade_g"] = 27.0  # dispensou menos que o pedido
+    r = user_client.post(f"/devices/me/jobs/{job['id']}/complete", json=payload, headers=dev)
+    assert r.status_code == 200 and r.json()["next_job_pending"] is False
+
+    for job_id in ids:
+        assert user_client.get(f"/jobs/{job_id}").json()["status"] == "done"
+    estoque = {c["frasco"]: c["estoque_g"] for c in user_client.get("/config/robo").json()}
+    assert estoque[1] == 73.0 and estoque[2] == 88.0
+
+    # log normalizado: cada job do lote com a sua parte, pedida x real
+    from backend import database, models
+    db = database.SessionLocal()
+    try:
+        sal_por_job = {
+            r.job_id: (r.quantidade_pedida_g, r.quantidade_real_g)
+            for r in db.query(models.JobExecutionLog).filter(
+                models.JobExecutionLog.job_id.in_(ids), models.JobExecutionLog.frasco == 1
+            )
+        }
+    finally:
+        db.close()
+    assert sal_por_job == {ids[0]: (10.0, 9.0), ids[1]: (20.0, 18.0)}
+
+
+def test_plano_de_cardapio_sem_criar_jobs(user_client, receita_pronta):
+    # Sal: 10 g/pessoa, estoque 100 g → 4 + 5 cabe, a terceira entrada estoura
+    r = user_client.post("/jobs/plan", json={"itens": [
+        {"receita_id": receita_pronta, "pessoas_solicitadas": 4},
+        {"receita_id": receita_pronta, "pessoas_solicitadas": 5},
+        {"receita_id": receita_pronta, "pessoas_solicitadas": 2},
+        {"receita_id": 999999},
+    ]})
+    assert r.status_code == 200
+    plano = r.json()
+    assert [e["viavel"] for e in plano["entradas"]] == [True, True, False, False]
+    assert plano["entradas"][2]["faltas"] == [1]
+    assert plano["entradas"][3]["erros"] == ["Receita não encontrada."]
+    sal = next(f for f in plano["frascos"] if f["frasco"] == 1)
+    assert sal["necessario_g"] == 110.0 and sal["falta_g"] == 10.0
+    assert not plano["viavel"] and plano["tempo_total_s"] > 0
+
+    assert user_client.get("/jobs/fila").json() == []
+
+
+def test_sync_combina_heartbeat_poll_e_relatorio(user_client, make_device, receita_pronta):
+    dev = make_device()
+    r = user_client.post("/devices/me/sync", json={"status": {"rssi": -60}}, headers=dev).json()
+    assert r["job"] is None and r["job_changed"] is False and r["poll_ms"] >= 1000
+
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+    r = user_client.post("/devices/me/sync", json={}, headers=dev).json()
+    assert r["job_changed"] and r["job"]["id"] == job_id
+    job = r["job"]
+
+    # o device já tem o job: sem payload repetido
+    r = user_client.post("/devices/me/sync", json={"job_atual_id": job_id}, headers=dev).json()
+    assert r["job"] is None and r["job_changed"] is False
+
+    # relatório pendente + ack de job inexistente na mesma requisição
+    r = user_client.post("/devices/me/sync", json={
+        "job_atual_id": job_id,
+        "status_jobs": [{"job_id": 999999, "status": "running"}],
+        "relatorios": [{"job_id": job_id, **_complete_payload(job)}],
+    }, headers=dev).json()
+    assert {x["job_id"]: x["ok"] for x in r["resultados"]} == {999999: False, job_id: True}
+    assert r["job_changed"] and r["job"] is None
+    assert user_client.get(f"/jobs/{job_id}").json()["status"] == "done"
+
+
+def test_intervalo_de_poll_acompanha_atividade(user_client, make_device, receita_pronta):
+    from backend.pollhint import POLL_FAST_MS, POLL_IDLE_MS
+
+    dev = make_device()
+    r = user_client.get("/devices/me/next_job", headers=dev)
+    assert r.status_code == 204 and int(r.headers["x-poll-interval-ms"]) == POLL_IDLE_MS
+
+    # usuário abriu a aba Execução
+    user_client.get("/me/devices")
+    r = user_client.get("/devices/me/next_job", headers=dev)
+    assert int(r.headers["x-poll-interval-ms"]) == POLL_FAST_MS
+    # só o poll leva o hint: heartbeat/status não pagam a consulta
+    r = user_client.post("/devices/me/heartbeat", json={}, headers=dev)
+    assert "x-poll-interval-ms" not in r.headers
+
+    user_client.post("/jobs", json={"receita_id": receita_pronta})
+    r = user_client.post("/devices/me/sync", json={}, headers=dev)
+    assert r.json()["poll_ms"] == POLL_FAST_MS == int(r.headers["x-poll-interval-ms"])
+
+
+def test_historico_paginado_por_keyset(user_client, receita_pronta):
+    ids = [user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"] for _ in range(5)]
+    user_client.post(f"/jobs/{ids[1]}/cancel")
+
+    r = user_client.get("/jobs?limit=2").json()
+    assert [j["id"] for j in r["jobs"]] == [ids[4], ids[3]] and r["next_before"] == ids[3]
+    assert "itens" not in r["jobs"][0] and r["jobs"][0]["receita_nome"] == "Tempero base"
+    r = user_client.get(f"/jobs?limit=2&before={r['next_before']}").json()
+    assert [j["id"] for j in r["jobs"]] == [ids[2], ids[1]]
+    r = user_client.get(f"/jobs?limit=2&before={r['next_before']}").json()
+    assert [j["id"] for j in r["jobs"]] == [ids[0]] and r["next_before"] is None
+
+    r = user_client.get("/jobs?status=canceled&expand=itens").json()
+    assert [j["id"] for j in r["jobs"]] == [ids[1]]
+    assert [(i["ordem"], i["tempero"]) for i in r["jobs"][0]["itens"]] == [(1, "Sal"), (2, "Pimenta")]
+    assert user_client.get("/jobs?receita_id=999999").json()["jobs"] == []
+    assert user_client.get("/jobs?expand=logs").status_code == 422
+
+
+def test_reaper_nao_falha_segunda_tentativa_saudavel(user_client, make_device, receita_pronta):
+    from datetime import datetime, timedelta, timezone
+
+    from backend import database, models
+    from backend.reaper import REAPER_GRACE_SEC, reap_once
+
+    dev = make_device()
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+    user_client.get("/devices/me/next_job", headers=dev)
+
+    db = database.SessionLocal()
+    try:
+        # o primeiro lease foi pego há 2 h e venceu sem o device confirmar
+        agora = datetime.now(timezone.utc)
+        db.query(models.Job).filter(models.Job.id == job_id).update(
+            {models.Job.started_at: agora - timedelta(hours=2), models.Job.lease_until: agora - timedelta(hours=1)}
+        )
+        db.commit()
+        requeued, _failed = reap_once(db, now=agora)
+        assert (job_id, user_client.user_id) in requeued
+        db.expire_all()
+        assert db.get(models.Job, job_id).started_at is None
+
+        # segunda tentativa: lease de novo, "running", reaper passa logo em seguida
+        user_client.get("/devices/me/next_job", headers=dev)
+        user_client.post(f"/devices/me/jobs/{job_id}/status", json={"status": "running"}, headers=dev)
+        _requeued, failed = reap_once(db, now=datetime.now(timezone.utc) + timedelta(seconds=REAPER_GRACE_SEC // 2))
+        assert (job_id, user_client.user_id) not in failed
+        db.expire_all()
+        assert db.get(models.Job, job_id).status == "running"
+    finally:
+        db.close()
+
+
+def test_coalescencia_respeita_limites_do_firmware(user_client, make_device, receita_pronta, monkeypatch):
+    from backend import main
+
+    dev = make_device()
+    motor = {"coalesce_max_jobs": 10, "pre_start_delay_ms": 0, "post_stop_delay_ms": 0}
+
+    def lote(robo, **cfg):
+        user_client.put("/config/robo", json=robo)
+        user_client.put("/config/motor", json={**motor, **cfg})
+        for _ in range(4):
+            user_client.post("/jobs", json={"receita_id": receita_pronta})
+        r = user_client.get("/devices/me/next_job", headers=dev)
+        user_client.post("/jobs/active/cancel")  # limpa a fila para o próximo caso
+        return r, r.json().get("lote_job_ids") or [r.json()["id"]]
+
+    # tempo total: 14 s por job (Sal 10 s + Pimenta 4 s) e max_runtime de 30 s → 2 jobs
+    rapido = [
+        {"frasco": 1, "rotulo": "Sal", "g_por_seg": 1.0, "estoque_g": 1000},
+        {"frasco": 2, "rotulo": "Pimenta", "g_por_seg": 1.0, "estoque_g": 1000},
+    ]
+    _r, ids = lote(rapido, max_runtime_sec=30)
+    assert len(ids) == 2
+
+    # passo do firmware: Sal a 0,1 g/s = 100 s por job; dois passariam de MAX_STEP_MS
+    lento = [dict(rapido[0], g_por_seg=0.1), rapido[1]]
+    _r, ids = lote(lento, max_runtime_sec=600)
+    assert len(ids) == 1
+
+    # tamanho do JSON entregue ao ESP32
+    monkeypatch.setattr(main, "DEVICE_JOB_MAX_BYTES", 1000)
+    r, ids = lote(rapido, max_runtime_sec=600)
+    assert 1 < len(ids) < 4 and len(r.content) <= 1000
+
+
+def test_sync_limita_acks_por_requisicao(user_client, make_device):
+    dev = make_device()
+    acks = [{"job_id": i, "status": "running"} for i in range(1, 22)]
+    assert user_client.post("/devices/me/sync", json={"status_jobs": acks}, headers=dev).status_code == 422
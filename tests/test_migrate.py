@@ -0,0 +1,106 @@
+"""Testes do runner de migrações versionadas (backend/migrate.py)."""
+from pathlib import Path
+
+from sqlalchemy import create_engine, inspect, text
+
+from backend import migrate, models
+
+
+def _engine(tmp_dir: str, nome: str):
+    path = Path(tmp_dir) / nome
+    if path.exists():
+        path.unlink()
+    return create_engine(f"sqlite:///{path}", future=True)
+
+
+def _index_names(engine, table: str) -> set:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t"), {"t": table}
+        )
+        return {r[0] for r in rows}
+
+
+def test_banco_novo_cria_schema_e_marca_head(tmp_dir):
+    engine = _engine(tmp_dir, "novo.db")
+    aplicadas = migrate.upgrade(engine)
+
+    assert aplicadas == [v for v, _n, _f in migrate.MIGRATIONS]
+    assert migrate.current_version(engine) == migrate.HEAD_VERSION
+    assert "ix_jobs_user_status_id" in _index_names(engine, "jobs")
+    assert "ix_device_claims_code_unused" in _index_names(engine, "device_claims")
+    # segunda execução não faz nada
+    assert migrate.upgrade(engine) == []
+
+
+def test_banco_legado_aplica_pendentes(tmp_dir):
+    engine = _engine(tmp_dir, "legado.db")
+    # simula banco criado pelo antigo create_all do startup, sem os índices novos
+    with engine.begin() as conn:
+        models.Base.metadata.create_all(bind=conn)
+        for ix in ("ix_jobs_user_status_id", "ix_reservatorio_user_rotulo_lower",
+                   "ix_device_claims_code_unused", "ix_ingredientes_receita_tempero"):
+            conn.execute(text(f"DROP INDEX {ix}"))
+        conn.execute(text("ALTER TABLE receitas DROP COLUMN porcoes"))
+
+    assert migrate.current_version(engine) is None
+    assert migrate.upgrade(engine) == [v for v, _n, _f in migrate.MIGRATIONS]
+
+    cols = {c["name"] for c in inspect(engine).get_columns("receitas")}
+    assert "porcoes" in cols
+    assert "ix_reservatorio_user_rotulo_lower" in _index_names(engine, "reservatorio_config")
+    assert "ix_ingredientes_receita_tempero" in _index_names(engine, "ingredientes_receita")
+
+
+def test_verify_exige_head(tmp_dir):
+    import pytest
+
+    engine = _engine(tmp_dir, "verify.db")
+    with pytest.raises(RuntimeError):
+        migrate.verify(engine)
+    migrate.upgrade(engine)
+    assert migrate.verify(engine) == migrate.HEAD_VERSION
+
+
+def test_backfill_do_execution_report(tmp_dir, monkeypatch):
+    import json
+
+    engine = _engine(tmp_dir, "backfill.db")
+    with engine.begin() as conn:
+        models.Base.metadata.create_all(bind=conn)
+        conn.execute(text("DROP TABLE job_execution_log"))
+        conn.execute(text("INSERT INTO usuarios (id, nome, senha_hash) VALUES (1, 'u', 'x')"))
+        for job_id in (1, 2, 3):
+            report = json.dumps([
+                {"frasco": 2, "tempero": "Sal", "quantidade_g": 9.5, "segundos": 4.0, "status": "done"},
+                {"frasco": 3, "tempero": "Pimenta", "quantidade_g": 2.0, "segundos": 1.0,
+                 "status": "failed", "error": "travou"},
+            ])
+            conn.execute(text(
+                "INSERT INTO jobs (id, user_id, status, multiplicador, pessoas_solicitadas, prioridade, "
+                "created_at, finished_at, execution_report) "
+                "VALUES (:id, 1, 'done_partial', 1, 1, 0, '2025-01-01 10:00:00', '2025-01-01 10:01:00', :r)"
+            ), {"id": job_id, "r": report})
+            conn.execute(text(
+                "INSERT INTO job_items (job_id, ordem, frasco, tempero, quantidade_g, segundos, status) "
+                "VALUES (:j, 1, 2, 'Sal', 10.0, 5.0, 'done'), (:j, 2, 3, 'Pimenta', 2.0, 1.0, 'failed')"
+            ), {"j": job_id})
+        migrate.schema_migrations.create(bind=conn)
+        for version, name, _fn in migrate.MIGRATIONS[:10]:
+            migrate._record(conn, version, name)
+
+    monkeypatch.setattr(migrate, "BACKFILL_CHUNK", 2)  # força mais de um bloco
+    assert migrate.upgrade(engine) == [11, 12, 13, 14, 15, 16, 17]
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT job_id, frasco, quantidade_pedida_g, quantidade_real_g, status, error "
+            "FROM job_execution_log ORDER BY job_id, frasco"
+        )).all()
+    assert len(rows) == 6
+    assert tuple(rows[0]) == (1, 2, 10.0, 9.5, "done", None)
+    assert tuple(rows[1]) == (1, 3, 2.0, None, "failed", "travou")
+    assert "ix_job_exec_log_user_frasco_fin" in _index_names(engine, "job_execution_log")
+    # migração 12 já monta os rollups a partir do log
+    with engine.connect() as conn:
+        dia = conn.execute(text("SELECT frasco, gramas, doses, falhas FROM consumo_dia ORDER BY frasco")).all()
+    assert [tuple(r) for r in dia] == [(2, 28.5, 3, 0), (3, 0.0, 0, 3)]
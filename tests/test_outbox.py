@@ -0,0 +1,84 @@
+"""Testes do outbox transacional (entrega, retry, ordem por job)."""
+import asyncio
+from datetime import timedelta
+
+from backend import database, models, outbox
+
+
+def _pendentes(kind):
+    db = database.SessionLocal()
+    try:
+        return db.query(models.OutboxEvent).filter(models.OutboxEvent.kind == kind).order_by(models.OutboxEvent.id).all()
+    finally:
+        db.close()
+
+
+def _liberar(kind):
+    """Antecipa o backoff (simula o tempo passando)."""
+    db = database.SessionLocal()
+    try:
+        db.query(models.OutboxEvent).filter(models.OutboxEvent.kind == kind).update(
+            {models.OutboxEvent.available_at: outbox._now() - timedelta(seconds=1)}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_falha_reagenda_e_preserva_ordem_do_job():
+    db = database.SessionLocal()
+    for job_id, n in ((901, 1), (901, 2), (902, 3)):
+        outbox.enqueue(db, "teste_ordem", {"n": n}, user_id=1, job_id=job_id)
+    db.commit()
+    db.close()
+
+    vistos, falhar = [], {1}
+    async def handler(msg):
+        if msg.payload["n"] in falhar:
+            falhar.discard(msg.payload["n"])
+            raise RuntimeError("assinante fora")
+        vistos.append(msg.payload["n"])
+
+    disp = outbox.OutboxDispatcher(database.SessionLocal, max_attempts=2)
+    disp.register("teste_ordem", handler)
+    assert asyncio.run(disp.run_once()) == 1
+    assert vistos == [3]  # o 2 espera o 1 (mesmo job)
+    restantes = _pendentes("teste_ordem")
+    assert [r.attempts for r in restantes] == [1, 0] and restantes[0].last_error == "assinante fora"
+
+    _liberar("teste_ordem")
+    assert asyncio.run(disp.run_once()) == 2
+    assert vistos == [3, 1, 2] and _pendentes("teste_ordem") == []
+
+
+def test_esgotou_tentativas_fica_dead():
+    db = database.SessionLocal()
+    outbox.enqueue(db, "teste_dead", {}, job_id=903)
+    db.commit()
+    db.close()
+
+    async def handler(msg):
+        raise RuntimeError("sempre")
+
+    disp = outbox.OutboxDispatcher(database.SessionLocal, max_attempts=2)
+    disp.register("teste_dead", handler)
+    for _ in range(3):
+        asyncio.run(disp.run_once())
+        _liberar("teste_dead")
+    (ev,) = _pendentes("teste_dead")
+    assert ev.dead and ev.attempts == 2
+
+
+def test_conclusao_grava_outbox_na_transacao(user_client, make_device, receita_pronta, drain_outbox):
+    dev = make_device()
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+    user_client.get("/devices/me/next_job", headers=dev)
+    r = user_client.post(
+        f"/devices/me/jobs/{job_id}/complete",
+        json={"itens_completados": 0, "itens_falhados": 0, "execution_logs": []}, headers=dev,
+    )
+    assert r.status_code == 200
+    drain_outbox()
+    assert _pendentes("job_completed") == []
+    with user_client.websocket_connect(f"/ws/jobs/{job_id}?since=0") as ws:
+        assert ws.receive_json()["type"] == "execution_complete"
@@ -0,0 +1,52 @@
+"""Testes do planejador de dispensa paralela."""
+from backend.planner import capacidade_paralela, planejar
+
+
+def _itens(*pares):
+    return [{"ordem": i, "frasco": f, "segundos": s} for i, (f, s) in enumerate(pares, start=1)]
+
+
+def test_sequencial_igual_ao_comportamento_atual():
+    plano = planejar(_itens((1, 2.0), (2, 1.0)), 1, pre_start_delay_ms=500, post_stop_delay_ms=300)
+    assert plano["makespan_ms"] == plano["sequencial_ms"] == 2000 + 1000 + 2 * 800
+    assert [p["itens"][0]["frasco"] for p in plano["passos"]] == [1, 2]
+
+
+def test_paralelo_respeita_limite_e_frasco_unico_por_passo():
+    itens = _itens((1, 4.0), (2, 3.0), (3, 2.0), (4, 1.0), (1, 1.0))
+    plano = planejar(itens, 2)
+    for passo in plano["passos"]:
+        frascos = [i["frasco"] for i in passo["itens"]]
+        assert len(frascos) <= 2 and len(set(frascos)) == len(frascos)
+    # (4+3) (2+1) (1): 4 + 2 + 1 s
+    assert plano["makespan_ms"] == 7000 and plano["sequencial_ms"] == 11000
+
+    plano = planejar(_itens((1, 4.0), (2, 3.0), (3, 2.0), (4, 1.0)), 4)
+    assert len(plano["passos"]) == 1 and plano["makespan_ms"] == 4000
+
+
+def test_orcamento_de_corrente_limita_servos():
+    assert capacidade_paralela(4, None, 250) == 4
+    assert capacidade_paralela(4, 600, 250) == 2
+    assert capacidade_paralela(4, 100, 250) == 1
+
+
+def test_job_expoe_plano_e_tempo_estimado(user_client, make_device, receita_pronta):
+    user_client.put("/config/motor", json={
+        "pre_start_delay_ms": 0, "post_stop_delay_ms": 0, "max_servos_simultaneos": 2,
+    })
+    # Sal 10 g a 2 g/s = 5 s; Pimenta 4 g a 1 g/s = 4 s → em paralelo 5 s
+    job = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()
+    assert job["tempo_estimado_s"] == 5.0 and job["plano"]["sequencial_ms"] == 9000
+
+    dev = make_device()
+    leased = user_client.get("/devices/me/next_job", headers={**dev, "X-Device-Caps": "plano"}).json()
+    assert len(leased["plano"]["passos"]) == 1
+    assert leased["motor_config"]["max_servos_simultaneos"] == 2
+
+
+def test_next_job_sem_plano_para_firmware_sem_o_recurso(user_client, make_device, receita_pronta):
+    user_client.post("/jobs", json={"receita_id": receita_pronta})
+    leased = user_client.get("/devices/me/next_job", headers=make_device()).json()
+    assert leased["plano"] is None and leased["tempo_estimado_s"] is None
+    assert [it["frasco"] for it in leased["itens"]] == [1, 2]
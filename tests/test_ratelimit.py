@@ -0,0 +1,35 @@
+"""Testes do rate limiting por token bucket (backend/ratelimit.py)."""
+from pathlib import Path
+
+from backend.ratelimit import MemoryBucketStore, SQLiteBucketStore, _take
+
+
+def test_take_repoe_pela_taxa():
+    ok, tokens, _ = _take(0.0, 0.0, capacity=5, rate=2.0, now=1.0)
+    assert ok and tokens == 1.0  # 2 repostos, 1 consumido
+    ok, tokens, retry = _take(0.0, 10.0, capacity=5, rate=2.0, now=10.0)
+    assert not ok and retry == 0.5
+
+
+def test_memory_store_estoura_rajada():
+    store = MemoryBucketStore()
+    res = [store.consume("k", 3, 0.001)[0] for _ in range(4)]
+    assert res == [True, True, True, False]
+
+
+def test_sqlite_store_compartilhado(tmp_dir):
+    path = str(Path(tmp_dir) / "buckets.db")
+    a, b = SQLiteBucketStore(path), SQLiteBucketStore(path)  # dois "workers"
+    assert a.consume("k", 2, 0.001)[0]
+    assert b.consume("k", 2, 0.001)[0]
+    ok, retry = a.consume("k", 2, 0.001)
+    assert not ok and retry > 0
+
+
+def test_sugestoes_429_com_retry_after(user_client):
+    codes = [user_client.get("/receitas/sugestoes", params={"q": "a"}).status_code for _ in range(25)]
+    assert codes[0] == 200
+    assert 429 in codes
+    r = user_client.get("/receitas/sugestoes", params={"q": "a"})
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 1
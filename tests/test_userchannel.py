@@ -0,0 +1,75 @@
+"""Testes do canal multiplexado por usuário (/ws/me)."""
+
+
+def _proximo(ws, tipo):
+    while True:
+        msg = ws.receive_json()
+        if msg.get("type") == tipo:
+            return msg
+
+
+def test_ws_me_recebe_jobs_progresso_estoque_e_presenca(user_client, make_device, receita_pronta):
+    dev = make_device()
+    with user_client.websocket_connect("/ws/me") as ws:
+        hello = ws.receive_json()
+        assert hello["type"] == "hello" and set(hello["data"]["topics"]) == {"devices", "jobs", "progress", "stock"}
+
+        job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+        msg = _proximo(ws, "job_status")
+        assert msg["topic"] == "jobs" and msg["data"] == {"job_id": job_id, "status": "queued", "prioridade": 0}
+
+        job = user_client.get("/devices/me/next_job", headers=dev).json()
+        assert _proximo(ws, "job_status")["data"]["status"] == "leased"
+
+        logs = [{**{k: it[k] for k in ("frasco", "tempero", "quantidade_g", "segundos")}, "status": "done"}
+                for it in job["itens"]]
+        user_client.post(
+            f"/devices/me/jobs/{job_id}/complete",
+            json={"itens_completados": 2, "itens_falhados": 0, "execution_logs": logs}, headers=dev,
+        )
+        stock = _proximo(ws, "stock")["data"]["frascos"]
+        assert [f["estoque_g"] for f in stock] == [90.0, 96.0]
+        assert _proximo(ws, "job_status")["data"]["status"] == "done"
+        progresso = _proximo(ws, "execution_log_entry")
+        assert progresso["topic"] == "progress" and progresso["data"]["job_id"] == job_id
+
+
+def test_ws_me_exige_login(client):
+    from starlette.websockets import WebSocketDisconnect
+    import pytest
+
+    with client.websocket_connect("/ws/me") as ws:
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_json()
+    assert exc.value.code == 4401
+
+
+def test_presenca_emite_transicoes():
+    import asyncio
+
+    from backend.userchannel import DevicePresence, UserHub
+
+    async def cenario():
+        hub = UserHub()
+        sub = hub.subscribe(7, ["devices"])
+        presence = DevicePresence(hub)
+        presence.seed(1, True)
+        presence.sweep([(1, 7, False)])
+        presence.came_online(1, 7)
+        return [sub.queue.get_nowait()["type"] for _ in range(sub.queue.qsize())]
+
+    assert asyncio.run(cenario()) == ["device_offline", "device_online"]
+
+
+def test_ws_me_progresso_ve_reenfileiramento_do_reaper(user_client, receita_pronta):
+    import asyncio
+
+    from backend import main
+
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+    with user_client.websocket_connect("/ws/me?topics=progress") as ws:
+        ws.receive_json()  # hello
+        asyncio.run(main._notify_reaped([(job_id, user_client.user_id)], []))
+        msg = _proximo(ws, "job_status")
+        assert msg["topic"] == "progress"
+        assert msg["data"]["job_id"] == job_id and msg["data"]["reason"] == "lease_expired"
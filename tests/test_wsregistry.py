@@ -0,0 +1,66 @@
+"""Testes do registro de WebSockets (ciclo de vida, teto por usuário, liveness)."""
+import asyncio
+import time
+
+from backend.main import ws_registry
+from backend.wsregistry import ConnectionRegistry, LivenessLoop
+
+
+class _FakeWS:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+        self.closed = None
+
+    async def send_json(self, data):
+        if self.fail:
+            raise RuntimeError("socket morto")
+        self.sent.append(data)
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+
+
+def test_indices_somem_quando_vazios_e_teto_por_usuario():
+    reg = ConnectionRegistry(max_per_user=2)
+    a, b, c = _FakeWS(), _FakeWS(), _FakeWS()
+    assert reg.register(a, 1, job_id=10) and reg.register(b, 1)
+    assert reg.register(c, 1, job_id=11) is None
+    assert reg.stats()["rejected_total"] == 1
+
+    reg.unregister(a)
+    reg.unregister(a)  # idempotente
+    reg.unregister(b)
+    assert reg.stats() == {"sockets": 0, "jobs_watched": 0, "users": 0, "rejected_total": 1, "reaped_total": 0}
+    reg.unregister(_FakeWS())  # desconhecido não cria nada
+    assert reg.job_sockets(99) == [] and len(reg) == 0
+
+
+def test_liveness_pinga_quietos_e_derruba_ociosos_e_mortos():
+    reg = ConnectionRegistry()
+    vivo, ocioso, morto = _FakeWS(), _FakeWS(), _FakeWS(fail=True)
+    for ws in (vivo, ocioso, morto):
+        reg.register(ws, 1, job_id=5)
+    agora = time.monotonic()
+    reg.get(vivo).last_seen = agora - 30
+    reg.get(ocioso).last_seen = agora - 100
+    reg.get(morto).last_seen = agora - 30
+
+    loop = LivenessLoop(reg, interval_sec=20, idle_timeout_sec=75)
+    assert asyncio.run(loop.run_once()) == 2
+    assert vivo.sent == [{"type": "ping"}]
+    assert ocioso.closed is not None and morto.closed is not None
+    assert reg.job_sockets(5) == [vivo] and reg.stats()["reaped_total"] == 2
+
+
+def test_ws_de_job_sai_do_registro_ao_desconectar(user_client, receita_pronta):
+    job_id = user_client.post("/jobs", json={"receita_id": receita_pronta}).json()["id"]
+    with user_client.websocket_connect(f"/ws/jobs/{job_id}") as ws:
+        ws.send_text("ping")
+        assert ws.receive_json() == {"type": "pong"}
+        assert ws_registry.job_sockets(job_id)
+    with user_client.websocket_connect("/ws/me") as ws:
+        ws.receive_json()  # hello
+    saude = user_client.get("/health/realtime").json()
+    assert saude["websockets"]["sockets"] == 0 and saude["websockets"]["jobs_watched"] == 0
+    assert saude["user_channels"] == 0